@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# parse time of machine generated programs of growing size, time per line should stay flat
+# python3 benchmarks/parse_scaling.py [largest line count]
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.parse_program import ProgramParser
+
+def generate(lines: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    forms = [
+        lambda: f"R{rng.randrange(100)} := {rng.randint(-1000, 1000)}",
+        lambda: f"R{rng.randrange(100)} := R{rng.randrange(100)}",
+        lambda: f"R{rng.randrange(100)} := R{rng.randrange(100)} {rng.choice('+-*/')} {rng.randint(1, 100)}",
+        lambda: f"R{rng.randrange(100)} := R{rng.randrange(100)} {rng.choice('+-*/')} R{rng.randrange(100)}",
+        lambda: f"R{rng.randrange(100)} := [R{rng.randrange(100)}]",
+        lambda: f"[R{rng.randrange(100)}] := R{rng.randrange(100)}",
+        lambda: f"if (R{rng.randrange(100)} {rng.choice(['<', '>', '<=', '>=', '==', '!='])} {rng.randint(0, 100)}) goto L{rng.randrange(lines)}",
+        lambda: f"goto L{rng.randrange(lines)}",
+        lambda: f"L{rng.randrange(lines)}:",
+        lambda: f"R{rng.randrange(100)} := read()",
+        lambda: f"write(R{rng.randrange(100)})        // comment",
+        lambda: "halt",
+    ]
+    return "\n".join(rng.choice(forms)() for _ in range(lines))
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    lines = 1000
+    print(f"{'lines':>10} {'seconds':>10} {'us/line':>10}")
+    while lines <= largest:
+        text = generate(lines)
+        start = time.perf_counter()
+        ProgramParser.parse(text)
+        elapsed = time.perf_counter() - start
+        print(f"{lines:>10} {elapsed:>10.3f} {elapsed / lines * 1e6:>10.2f}")
+        lines *= 10
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@
 # https://www.cs.vsb.cz/sawa/uti/slides/uti-06-cz.pdf
 # 86
 
+import os
 from typing import Tuple
 import typer
 from enum import Enum
@@ -11,47 +12,132 @@ class Action(Enum):
     COMPILE_TO_C = "compile-to-c"
     COMPILE_TO_ASM = "compile-to-asm"
     INTERPRET = "interpret"
+    INTERPRET_FAST = "interpret-fast"
     DEBUG = "debug"
+    BATCH = "batch"
+    PRECOMPILE = "precompile"
 
 SomeType = Tuple[int, str, Action]
 
 def main(program_path: str
          , print_parsed_program: bool = False
          , action: Action = "interpret"
-         , output_path: str = None):
-    try:
-        with open(program_path, 'r') as f:
-            program_txt = f.read()
-    except FileNotFoundError:
+         , output_path: str = None
+         , input_path: str = None
+         , word_size: int = None
+         , workers: int = None
+         , profile: bool = False
+         , profile_output: str = None
+         , trace: str = None
+         , snapshot_interval: int = 1000
+         , history_limit: int = 1_000_000
+         , opt_level: int = 0
+         , opt_report: bool = False
+         , c_locals: bool = False
+         , memory: int = None
+         , bounds_checks: bool = False
+         , stream: bool = False
+         , cache: bool = True
+         , max_steps: int = None):
+    if word_size is not None and word_size != 64:
+        print(f"Unsupported word size {word_size}, only 64 is supported")
+        exit(1)
+
+    if opt_level not in (0, 1, 2):
+        print(f"Unsupported optimization level {opt_level}, use 0, 1 or 2")
+        exit(1)
+
+    if memory is not None and memory < 1:
+        print(f"Unsupported memory size {memory}, use at least 1 register")
+        exit(1)
+
+    if trace and (profile or profile_output):
+        print("--trace and --profile cannot be used together, the program runs under one of them")
+        exit(1)
+
+    if action == Action.BATCH:
+        run_batch(program_path, input_path, output_path, word_size, workers, opt_level, cache, max_steps)
+        return
+
+    if not os.path.isfile(program_path):
         print(f"File {program_path} not found")
         exit(1)
-    
 
-    from src.parse_program import ProgramParser as pp, FailedToParse
+    from src.precompiled import ProgramCache, PrecompiledError, is_precompiled, load_program
+    if action == Action.PRECOMPILE and is_precompiled(program_path):
+        # the hash in the header is the source's, which a .ramc file no longer has
+        print(f"{program_path} is already precompiled, precompile its source instead")
+        exit(1)
+    compiling = action in (Action.COMPILE_TO_C, Action.COMPILE_TO_ASM)
+    if compiling and opt_level == 0 and not print_parsed_program and not is_precompiled(program_path) \
+       and (stream or os.path.getsize(program_path) >= STREAM_THRESHOLD):
+        compile_streamed(program_path, action, output_path, c_locals, memory, bounds_checks)
+        exit(0)
 
+    from src.parse_program import FailedToParse
+
+    # an unchanged source is loaded from the cache (or a .ramc file given directly) without parsing
     try:
-        parsed_program = pp.parse(program_txt)
-    except FailedToParse as e:
+        parsed_program, source_lines = load_program(program_path, ProgramCache() if cache else None)
+    except (FailedToParse, PrecompiledError) as e:
         print(e)
         exit(1)
 
+    # the debugger shows the program as written
+    if opt_level > 0 and action != Action.DEBUG:
+        from src.optimizer import optimize
+        from src.encoded_program import EncodedProgram
+        optimized, origins, report = optimize(parsed_program, opt_level)
+        parsed_program = EncodedProgram.from_instructions(optimized)
+        source_lines = [source_lines[origin - 1] for origin in origins]
+        if opt_report:
+            import sys
+            print(report, file=sys.stderr)
+
     if print_parsed_program:
         for instruction in parsed_program:
             print(repr(instruction))
 
+    if action == Action.PRECOMPILE:
+        from src.precompiled import save_precompiled, source_hash
+        with open(program_path, 'rb') as f:
+            sha256 = source_hash(f.read())
+        try:
+            save_precompiled(parsed_program, source_lines, sha256, output_path or os.path.splitext(program_path)[0] + ".ramc")
+        except OSError as e:
+            print(e)
+            exit(1)
+        exit(0)
+
     
-    if action == Action.INTERPRET:
-        from src.interpreter import Interpreter
-        interpreter = Interpreter(parsed_program)
-        interpreter.run()
+    if action == Action.INTERPRET or action == Action.INTERPRET_FAST:
+        from src.io_channels import open_channels
+        if action == Action.INTERPRET:
+            from src.interpreter import Interpreter
+        else:
+            from src.pyjit import PyJitInterpreter as Interpreter
+        interpreter = Interpreter(parsed_program, word_size=word_size)
+        with open_channels(input_path, output_path) as (input_fn, output_fn):
+            if profile or profile_output:
+                run_profiled(interpreter, source_lines, input_fn, output_fn, profile_output)
+            elif trace:
+                from src.trace import TraceRecorder, TraceWriter
+                with open(trace, 'wb') as f:
+                    TraceRecorder(interpreter, TraceWriter(f)).run(input_fn=input_fn, output_fn=output_fn)
+            else:
+                interpreter.run(input_fn=input_fn, output_fn=output_fn)
         return
     
     if action == Action.DEBUG:
         from src.debugger import Debugger
         from src.interpreter import Interpreter
         try:
-            interpreter = Interpreter(parsed_program)
-            debugger = Debugger(interpreter)
+            interpreter = Interpreter(parsed_program, word_size=word_size)
+            input_fn = None
+            if input_path:
+                from src.io_channels import TokenInput
+                input_fn = TokenInput(open(input_path, 'rb'))
+            debugger = Debugger(interpreter, input_fn, snapshot_interval, history_limit)
             debugger.run()
         except Exception as e:
             # debugger controls terminal, so we need to print exception to file xd
@@ -62,24 +148,122 @@ def main(program_path: str
     if action == Action.COMPILE_TO_ASM:
         from src.compiler import Compiler
         from src.backend.backend_asm import BackendAsm
-        compiler = Compiler(BackendAsm(parsed_program))
-        if output_path:
-            with open(output_path, 'w') as f:
-                f.write(compiler.compile())
-        else:
-            print(compiler.compile())
+        compiler = Compiler(BackendAsm(parsed_program, memory_registers=memory, bounds_checks=bounds_checks))
+        write_compiled(compiler, output_path)
         exit(0)
 
     if action == Action.COMPILE_TO_C:
         from src.compiler import Compiler
         from src.backend.backend_c import BackendC
-        compiler = Compiler(BackendC(parsed_program))
+        compiler = Compiler(BackendC(parsed_program, registers_as_locals=c_locals, memory_registers=memory, bounds_checks=bounds_checks))
+        write_compiled(compiler, output_path)
+        exit(0)
+
+def write_compiled(compiler, output_path: str):
+    try:
+        code = compiler.compile()
+    except ValueError as e:
+        # memory too small for the program
+        print(e)
+        exit(1)
+    if output_path:
+        with open(output_path, 'w') as f:
+            f.write(code)
+    else:
+        print(code)
+
+# programs from this size on are compiled without ever being held in memory as a whole
+STREAM_THRESHOLD = 64 << 20
+
+def compile_streamed(program_path: str, action: Action, output_path: str, c_locals: bool, memory: int, bounds_checks: bool):
+    # the file is read twice, line by line: a scan that also reports parse errors before anything is written, then the compilation
+    import sys
+    from src.compiler import Compiler
+    from src.parse_program import ProgramParser as pp, FailedToParse
+    if action == Action.COMPILE_TO_ASM:
+        from src.backend.backend_asm import BackendAsm
+        backend = BackendAsm(None, memory_registers=memory, bounds_checks=bounds_checks)
+    else:
+        from src.backend.backend_c import BackendC
+        backend = BackendC(None, registers_as_locals=c_locals, memory_registers=memory, bounds_checks=bounds_checks)
+
+    def program():
+        with open(program_path, 'r') as f:
+            yield from pp.iter_parse(f)
+
+    compiler = Compiler(backend)
+    try:
+        scanned = compiler.pre_scan(program)
+    except (FailedToParse, ValueError) as e:
+        # a parse error or memory too small for the program, the output file is not touched
+        print(e)
+        exit(1)
+
+    out = open(output_path, 'w') if output_path else sys.stdout
+    try:
+        compiler.compile_stream(program, out, scanned)
+    finally:
         if output_path:
-            with open(output_path, 'w') as f:
-                f.write(compiler.compile())
+            out.close()
+    if not output_path:
+        out.write("\n")
+
+def run_profiled(interpreter, source_lines, input_fn, output_fn, profile_output: str):
+    # report goes to stderr (or json to profile_output), so program output stays untouched
+    import json
+    import sys
+    from src.profiler import Profiler
+    profiler = Profiler(interpreter, source_lines)
+    try:
+        profiler.run(input_fn=input_fn, output_fn=output_fn)
+    finally:
+        output_fn.flush()
+        if profile_output:
+            with open(profile_output, 'w') as f:
+                json.dump(profiler.to_json(), f, indent=2)
         else:
-            print(compiler.compile())
-        exit(0)
+            print(profiler.report(), file=sys.stderr)
+
+def run_batch(program_path: str, input_path: str, output_path: str, word_size: int, workers: int, opt_level: int, cache: bool
+              , max_steps: int):
+    # program_path and input_path can both be a file or a directory, every program runs on every input
+    # a job stops after max_steps instructions (BatchRunner.DEFAULT_MAX_STEPS when not given, 0 for no limit)
+    import json
+    import sys
+    from src.batch_runner import BatchRunner, collect_files
+    from src.parse_program import FailedToParse
+    from src.precompiled import ProgramCache, PrecompiledError, load_program
+
+    if not os.path.exists(program_path):
+        print(f"File {program_path} not found")
+        exit(1)
+
+    programs = {}
+    program_cache = ProgramCache() if cache else None
+    for path in collect_files(program_path, ".ram"):
+        try:
+            programs[path] = load_program(path, program_cache)[0]
+            if opt_level > 0:
+                from src.optimizer import optimize
+                from src.encoded_program import EncodedProgram
+                programs[path] = EncodedProgram.from_instructions(optimize(programs[path], opt_level)[0])
+        except (FailedToParse, PrecompiledError) as e:
+            print(f"{path}: {e}")
+            exit(1)
+
+    input_paths = collect_files(input_path) if input_path else [None]
+
+    out = open(output_path, 'w') if output_path else sys.stdout
+    failed = False
+    if max_steps is None:
+        max_steps = BatchRunner.DEFAULT_MAX_STEPS
+    for result in BatchRunner(programs, word_size, workers, max_steps or None).run(input_paths):
+        failed |= result["exit_status"] != 0
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+    if out is not sys.stdout:
+        out.close()
+    exit(1 if failed else 0)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,216 @@
+import re
+from typing import Optional, Union
+
+Operand = Union[str, int] # register name, memory operand like "qword [memory + 5 * 8]", or an immediate
+
+class AsmInstruction:
+    def __init__(self, opcode: str, *operands: Operand):
+        self.opcode = opcode
+        self.operands = list(operands)
+
+    def __repr__(self):
+        return f"AsmInstruction({self.opcode}, {self.operands})"
+
+    def __str__(self):
+        if not self.operands:
+            return f"    {self.opcode}"
+        return f"    {self.opcode} {', '.join(str(operand) for operand in self.operands)}"
+
+class AsmLabel:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f"AsmLabel({self.name})"
+
+    def __str__(self):
+        return f"{self.name}:"
+
+AsmLine = Union[AsmInstruction, AsmLabel]
+
+REGISTERS = { "rax", "rbx", "rcx", "rdx", "rsi", "rdi", "rbp", "rsp", *(f"r{i}" for i in range(8, 16)) }
+# scratch registers of BackendAsm, their values never live across a label or a jump, the rest hold RAM registers
+SCRATCH = { "rax", "rcx", "rdx" }
+CALLER_SAVED = { "rax", "rcx", "rdx", "rsi", "rdi", "r8", "r9", "r10", "r11" }
+INVERTED_JUMPS = { "je": "jne", "jne": "je", "jl": "jge", "jge": "jl", "jg": "jle", "jle": "jg" }
+ARITHMETIC = ("add", "sub", "imul", "shl", "sar")
+
+def is_register(operand: Operand) -> bool:
+    return isinstance(operand, str) and operand in REGISTERS
+
+def is_memory(operand: Operand) -> bool:
+    return isinstance(operand, str) and "[" in operand
+
+def is_imm32(operand: Operand) -> bool:
+    return isinstance(operand, int) and -(1 << 31) <= operand < (1 << 31)
+
+def _registers_in(operand: Operand) -> set[str]:
+    if isinstance(operand, int):
+        return set()
+    return { token for token in re.findall(r"[a-z0-9]+", operand) if token in REGISTERS }
+
+def _effects(line: AsmLine) -> Optional[tuple[set[str], set[str]]]:
+    # (registers read, registers written), None at a label or jump, where scratch registers are dead
+    if isinstance(line, AsmLabel) or line.opcode == "jmp" or line.opcode in INVERTED_JUMPS:
+        return None
+    opcode, operands = line.opcode, line.operands
+    addressing = set().union(*(_registers_in(operand) for operand in operands if is_memory(operand)))
+    if opcode == "mov" and len(operands) == 2:
+        destination, source = operands
+        written = { destination } if is_register(destination) else set()
+        return addressing | (_registers_in(source) if not is_memory(source) else set()), written
+    if opcode in ("add", "sub", "shl", "shr", "sar", "xor", "cmove") or opcode == "imul" and len(operands) == 2:
+        return addressing | _registers_in(operands[0]) | _registers_in(operands[1]), _registers_in(operands[0]) - addressing
+    if opcode == "imul" and len(operands) == 3:
+        return addressing | _registers_in(operands[1]), { operands[0] }
+    if opcode in ("imul", "idiv") and len(operands) == 1:
+        return addressing | _registers_in(operands[0]) | { "rax", "rdx" }, { "rax", "rdx" }
+    if opcode == "cqo":
+        return { "rax" }, { "rdx" }
+    if opcode in ("cmp", "test"):
+        return addressing | _registers_in(operands[0]) | _registers_in(operands[1]), set()
+    if opcode == "call":
+        return { "rdi" }, set(CALLER_SAVED)
+    if opcode == "syscall":
+        return { "rax", "rdi", "rsi", "rdx" }, { "rax", "rcx", "r11" }
+    # anything else reads everything
+    return set(REGISTERS), set()
+
+def is_dead_after(code: list[AsmLine], index: int, register: str, complete: bool = True) -> bool:
+    # whether the value register holds after code[index] is never read, code that is not complete may continue with a read
+    if register not in SCRATCH:
+        return False
+    for line in code[index + 1:]:
+        effects = _effects(line)
+        if effects is None:
+            return True
+        read, written = effects
+        if register in read:
+            return False
+        if register in written:
+            return True
+    return complete
+
+def _power_of_two(value: Operand) -> Optional[int]:
+    if isinstance(value, int) and value > 0 and value & (value - 1) == 0:
+        return value.bit_length() - 1
+    return None
+
+def _mov(line: AsmLine, destination: Optional[Operand] = None, source: Optional[Operand] = None) -> bool:
+    return isinstance(line, AsmInstruction) and line.opcode == "mov" and len(line.operands) == 2 \
+           and (destination is None or line.operands[0] == destination) and (source is None or line.operands[1] == source)
+
+def _rewrite(code: list[AsmLine], i: int, complete: bool = True) -> Optional[list[AsmLine]]:
+    # replacement for the lines starting at code[i] (as many as the returned pattern consumed), None if no pattern matches
+    line = code[i]
+    following = code[i + 1:i + 6]
+
+    if isinstance(line, AsmInstruction) and line.opcode == "mov" and line.operands[0] == line.operands[1]:
+        return [[]] # drop
+    # jmp to the very next line
+    if isinstance(line, AsmInstruction) and line.opcode == "jmp" and following and isinstance(following[0], AsmLabel) and following[0].name == line.operands[0]:
+        return [[]]
+    # compare and branch: jcc A / jmp B / A:  ->  j!cc B / A:
+    if isinstance(line, AsmInstruction) and line.opcode in INVERTED_JUMPS and len(following) >= 2 \
+       and isinstance(following[0], AsmInstruction) and following[0].opcode == "jmp" \
+       and isinstance(following[1], AsmLabel) and following[1].name == line.operands[0]:
+        return [[AsmInstruction(INVERTED_JUMPS[line.opcode], following[0].operands[0])], []]
+    # cmp r, 0 -> test r, r (shorter, fuses with the jump just as well)
+    if isinstance(line, AsmInstruction) and line.opcode == "cmp" and is_register(line.operands[0]) and line.operands[1] == 0:
+        return [[AsmInstruction("test", line.operands[0], line.operands[0])]]
+
+    if not _mov(line):
+        return None
+    destination, source = line.operands
+
+    # load after store: mov M, r / mov r2, M  ->  mov M, r / mov r2, r
+    if is_memory(destination) and is_register(source) and following and _mov(following[0], source=destination):
+        return [[line], [AsmInstruction("mov", following[0].operands[0], source)]]
+    # the same for a compare of the stored value
+    if is_memory(destination) and is_register(source) and following and isinstance(following[0], AsmInstruction) \
+       and following[0].opcode == "cmp" and following[0].operands[0] == destination and not is_memory(following[0].operands[1]):
+        return [[line], [AsmInstruction("cmp", source, following[0].operands[1])]]
+
+    if destination not in SCRATCH:
+        return None
+
+    # multiplication by a constant: mov rcx, imm / mov rax, r / imul rcx / mov r, rax
+    if destination == "rcx" and len(following) >= 3 and _mov(following[0], "rax") and is_register(following[0].operands[1]) \
+       and isinstance(following[1], AsmInstruction) and following[1].opcode == "imul" and following[1].operands == ["rcx"] \
+       and _mov(following[2], following[0].operands[1], "rax") and is_dead_after(code, i + 3, "rax", complete) and is_dead_after(code, i + 3, "rcx", complete):
+        target = following[0].operands[1]
+        shift = _power_of_two(source)
+        if shift is not None:
+            return [[AsmInstruction("shl", target, shift)] if shift else [], [], [], []]
+        if is_imm32(source):
+            return [[AsmInstruction("imul", target, target, source)], [], [], []]
+        if not isinstance(source, int) and target not in ("rax", "rcx"):
+            return [[AsmInstruction("imul", target, source)], [], [], []]
+
+    # division: mov rcx, d / mov rax, r / cqo / idiv rcx / mov r, rax
+    if destination == "rcx" and len(following) >= 4 and _mov(following[0], "rax") and is_register(following[0].operands[1]) \
+       and isinstance(following[1], AsmInstruction) and following[1].opcode == "cqo" \
+       and isinstance(following[2], AsmInstruction) and following[2].opcode == "idiv" and following[2].operands == ["rcx"] \
+       and _mov(following[3], following[0].operands[1], "rax") and is_dead_after(code, i + 4, "rcx", complete):
+        target = following[0].operands[1]
+        shift = _power_of_two(source)
+        if shift == 0 and is_dead_after(code, i + 4, "rax", complete):
+            return [[], [], [], [], []]
+        if shift is not None and target != "rax" and is_dead_after(code, i + 4, "rax", complete):
+            # signed division rounds towards zero: add 2^k - 1 to negative dividends before the arithmetic shift
+            return [[AsmInstruction("mov", "rax", target), AsmInstruction("sar", "rax", 63), AsmInstruction("shr", "rax", 64 - shift),
+                     AsmInstruction("add", target, "rax"), AsmInstruction("sar", target, shift)], [], [], [], []]
+        # no round trip through rcx, idiv takes a register or memory operand
+        if not isinstance(source, int) and source not in ("rax", "rdx"):
+            return [[], following[0:1], following[1:2], [AsmInstruction("idiv", source)], following[3:4]]
+
+    if not following or not isinstance(following[0], AsmInstruction):
+        return None
+    user = following[0]
+
+    # compute in place: mov rdx, a / op rdx, x / mov a, rdx  ->  op a, x
+    if user.opcode in ARITHMETIC and len(user.operands) in (2, 3) and user.operands[0] == destination and len(following) >= 2 \
+       and _mov(following[1], source, destination) and is_dead_after(code, i + 2, destination, complete):
+        if len(user.operands) == 3:
+            if user.operands[1] == destination and is_register(source):
+                return [[], [AsmInstruction("imul", source, source, user.operands[2])], []]
+            return None
+        operand = user.operands[1]
+        if operand == destination or is_memory(source) and (is_memory(operand) or user.opcode == "imul"):
+            return None
+        return [[], [AsmInstruction(user.opcode, source, operand)], []]
+    if not is_dead_after(code, i + 1, destination, complete):
+        return None
+
+    # copy through a scratch register: mov rdx, a / mov b, rdx  ->  mov b, a
+    if _mov(user, source=destination) and user.operands[0] != destination and not (is_memory(user.operands[0]) and is_memory(source)) \
+       and not (isinstance(source, int) and (is_memory(user.operands[0]) and not is_imm32(source))):
+        return [[], [AsmInstruction("mov", user.operands[0], source)]]
+    # source operand forms: mov rax, x / op r, rax  ->  op r, x
+    if user.opcode in ("add", "sub", "cmp", "imul") and len(user.operands) == 2 and user.operands[1] == destination \
+       and user.operands[0] != destination and not (is_memory(user.operands[0]) and is_memory(source)) \
+       and (not isinstance(source, int) or is_imm32(source) and user.opcode != "imul"):
+        return [[], [AsmInstruction(user.opcode, user.operands[0], source)]]
+    return None
+
+def peephole(code: list[AsmLine], max_rounds: int = 8, complete: bool = True) -> list[AsmLine]:
+    # rewrites small windows of the instruction stream until nothing matches anymore
+    # code that is not complete is a window of a streamed program, more lines may follow it
+    for _ in range(max_rounds):
+        changed = False
+        result: list[AsmLine] = []
+        i = 0
+        while i < len(code):
+            replacement = _rewrite(code, i, complete)
+            if replacement is None:
+                result.append(code[i])
+                i += 1
+                continue
+            for lines in replacement:
+                result.extend(lines)
+            i += len(replacement)
+            changed = True
+        code = result
+        if not changed:
+            break
+    return code
@@ -1,201 +1,319 @@
-from typing import Dict
+from typing import Dict, Optional
 from ..instruction import *
+from .. import control_flow
+from .memory_layout import MemoryLayout
+from .program_scan import ProgramScan
+from .asm_peephole import AsmInstruction, AsmLabel, AsmLine, Operand, is_imm32, is_memory, peephole
 
 class BackendAsm:
     DEFAULT_MEMORY_NAME = "memory"
-    DEFAULT_MEMORY_CAPACITY_BYTES = 8 * 2048 
-    def __init__(self, program: Program):
+    IO_BUFFER_BYTES = 1 << 16
+    STREAM_WINDOW = 4096
+    STREAM_KEPT_LINES = 16
+    # callee saved, so they survive the read_/write_ calls, and untouched by the generated code otherwise
+    ALLOCATABLE_REGISTERS = ["rbx", "r12", "r13", "r14", "r15"]
+    def __init__(self, program: Program, machine_registers: int = len(ALLOCATABLE_REGISTERS), peephole: bool = True
+                 , memory_registers: Optional[int] = None, bounds_checks: bool = False):
         self.program = program
+        self.machine_registers = machine_registers
+        self.peephole = peephole
+        self.memory_registers = memory_registers
+        self.bounds_checks = bounds_checks
+        self.memory: Optional[MemoryLayout] = None
+        self.pending: list[AsmLine] = [] # streamed lines the peephole has not seen enough of yet
+        # RAM register -> x86 register holding it, its memory slot is stale then and only Load/Store look at it
+        self.allocation: Dict[int,str] = {}
 
         self.compiled_instructions: int = 0
 
-        self.labels: Dict[str,str] = {}
         self.instruction_labels: Dict[int,str] = {}
 
     def map_label(self, label: str) -> str:
-        if label not in self.labels:
-            self.labels[label] = f"L_{len(self.labels)}"
-        return self.labels[label]
+        # RAM labels are identifiers already, the prefix keeps them apart from the runtime's names without a table of every label
+        return f"L_{label}"
 
 
-    # godbolt <3
+    # buffered runtime: write_ formats into an output buffer, flushed when full, before a blocking read and at exit
+    # read_ tokenizes a large input buffer, skipping anything that is not part of a number, end of input exits with status 1
+    # only caller saved registers are touched, the callee saved ones hold RAM registers
     def header(self) -> str:
         return """
 BITS 64
     global _start
 section .bss
-""" + f"{self.DEFAULT_MEMORY_NAME} : resb {self.DEFAULT_MEMORY_CAPACITY_BYTES}" + """ 
+""" + f"{self.DEFAULT_MEMORY_NAME} : resb {8 * self.memory.registers}" + f"""
+output_buffer : resb {self.IO_BUFFER_BYTES}
+output_length : resq 1
+input_buffer : resb {self.IO_BUFFER_BYTES}
+input_position : resq 1
+input_end : resq 1
+section .rodata
+memory_error_message : db "Memory access out of bounds", 10
+memory_error_message_length equ $ - memory_error_message
 section .text
+flush_:
+    mov rdx, qword [output_length]
+    lea rsi, [output_buffer]
+.flush_loop:
+    test rdx, rdx
+    jz .flush_done
+    mov eax, 1
+    mov edi, 1
+    syscall
+    test rax, rax
+    jle .flush_done
+    add rsi, rax
+    sub rdx, rax
+    jmp .flush_loop
+.flush_done:
+    mov qword [output_length], 0
+    ret
+
 write_:
-    sub rsp, 40
+    cmp qword [output_length], {self.IO_BUFFER_BYTES - 32}
+    jbe .write_room
+    push rdi
+    call flush_
+    pop rdi
+.write_room:
+    sub rsp, 32
+    lea rsi, [rsp + 31]
+    mov byte [rsi], 10
     mov rcx, rdi
-    xor r11d, r11d
-    mov BYTE [rsp+21], 10
     test rdi, rdi
-    jns .L2
+    jns .write_digit
     neg rcx
-    mov r11d, 1
-.L2:
-    lea r8, [rsp+20]
-    mov edi, 20
-    mov r10, -3689348814741910323
-.L3:
-    mov rax, rcx
-    movsx r9, edi
-    sub r8, 1
-    sub edi, 1
-    mul r10
+.write_digit:
     mov rax, rcx
+    mov r8, -3689348814741910323
+    mul r8
     shr rdx, 3
-    lea rsi, [rdx+rdx*4]
-    add rsi, rsi
-    sub rax, rsi
-    add eax, 48
-    mov BYTE [r8+1], al
-    mov rax, rcx
+    lea rax, [rdx + rdx * 4]
+    add rax, rax
+    sub rcx, rax
+    add cl, 48
+    dec rsi
+    mov byte [rsi], cl
     mov rcx, rdx
-    cmp rax, 9
-    jg .L3
-    test r11b, r11b
-    je .L4
-    movsx rdx, edi
-    lea eax, [r9-2]
-    movsx r9, edi
-    mov BYTE [rsp+rdx], 45
-    mov edi, eax
-.L4:
-    mov edx, 21
-    lea rsi, [rsp+r9]
+    test rcx, rcx
+    jnz .write_digit
+    test rdi, rdi
+    jns .write_copy
+    dec rsi
+    mov byte [rsi], 45
+.write_copy:
+    lea rcx, [rsp + 32]
+    sub rcx, rsi
+    mov rdx, qword [output_length]
+    lea rdi, [output_buffer + rdx]
+    add rdx, rcx
+    mov qword [output_length], rdx
+    rep movsb
+    add rsp, 32
+    ret
+
+input_byte_:
+    mov rax, qword [input_position]
+    cmp rax, qword [input_end]
+    jb .input_byte_have
+    call flush_
     xor eax, eax
-    sub edx, edi
-    mov edi, 1
-    mov rax, 1
+    xor edi, edi
+    lea rsi, [input_buffer]
+    mov edx, {self.IO_BUFFER_BYTES}
     syscall
-    add rsp, 40
+    test rax, rax
+    jle .input_byte_end
+    mov qword [input_end], rax
+    xor eax, eax
+.input_byte_have:
+    movzx ecx, byte [input_buffer + rax]
+    inc rax
+    mov qword [input_position], rax
+    mov eax, ecx
+    ret
+.input_byte_end:
+    mov eax, -1
     ret
 
 read_:
-    sub rsp, 40
-    mov edx, 22
-    xor edi, edi
-    xor eax, eax
-    mov rsi, rsp
-    mov rax, 0
-    syscall
-    movsx eax, BYTE  [rsp]
-    cmp al, 45
-    je .L30
-    xor esi, esi
-    xor ecx, ecx
-    cmp al, 10
-    je .L29
-.L18:
-    add rcx, rsp
-    xor edx, edx
-.L16:
+    xor r8d, r8d
+    xor r9d, r9d
+.read_skip:
+    call input_byte_
+    cmp eax, -1
+    je .read_end
+    cmp eax, 45
+    je .read_minus
+    sub eax, 48
+    cmp eax, 9
+    ja .read_skip
+    jmp .read_digit
+.read_minus:
+    mov r9d, 1
+    call input_byte_
     sub eax, 48
-    lea rdx, [rdx+rdx*4]
-    add rcx, 1
-    cdqe
-    lea rdx, [rax+rdx*2]
-    movsx eax, BYTE  [rcx]
-    cmp al, 10
-    jne .L16
-    mov rax, rdx
+    cmp eax, 9
+    ja .read_done
+.read_digit:
+    imul r8, r8, 10
+    add r8, rax
+    call input_byte_
+    sub eax, 48
+    cmp eax, 9
+    jbe .read_digit
+.read_done:
+    mov rax, r8
+    test r9d, r9d
+    jz .read_return
     neg rax
-    test sil, sil
-    cmovne rdx, rax
-    add rsp, 40
-    mov rax, rdx
-    ret
-.L30:
-    movsx eax, BYTE [rsp+1]
-    mov esi, 1
-    mov ecx, 1
-    cmp al, 10
-    jne .L18
-.L29:
-    xor edx, edx
-    add rsp, 40
-    mov rax, rdx
+.read_return:
     ret
+.read_end:
+    call flush_
+    mov edi, 1
+    mov eax, 60
+    syscall
+
+memory_error_:
+    call flush_
+    mov eax, 1
+    mov edi, 2
+    lea rsi, [memory_error_message]
+    mov edx, memory_error_message_length
+    syscall
+    mov edi, 1
+    mov eax, 60
+    syscall
+
 _start:
-"""
+""" + "".join(f"    xor {machine_register}, {machine_register}\n" for machine_register in self.allocation.values())
     
     def footer(self) -> str:
         return """
+    call flush_
     mov rdi, 0
     mov rax, 60
     syscall"""
     
+    def _allocate(self, weights: dict[int, int]):
+        hottest = sorted(weights, key=lambda register: (-weights[register], register))[:self.machine_registers]
+        self.allocation = { register: self.ALLOCATABLE_REGISTERS[i] for i, register in enumerate(hottest) }
+
+    def pre_scan(self, scan: ProgramScan) -> str:
+        # everything a streamed program can be compiled with, registers are allocated by plain use counts
+        for instruction in scan.instruction_targets:
+            self.instruction_labels[instruction] = "IL_" + str(instruction)
+        self.memory = MemoryLayout.from_scan(scan, self.memory_registers, self.bounds_checks)
+        self._allocate(scan.uses)
+        return ""
+
     def pre_compilation(self, program: Program) -> str:
-        for instruction in program:
-            if isinstance(instruction, UnconditionalJmpToInstruction) or isinstance(instruction, ConditionalJmpToInstruction):
-                self.instruction_labels[instruction.instruction] = "IL_" + str(instruction.instruction)
+        scan = ProgramScan(program)
+        self.pre_scan(scan)
+        self.memory = MemoryLayout.analyze(program, scan, self.memory_registers, self.bounds_checks)
+
+        # the hottest directly named registers (uses weighted by loop nesting) live in machine registers
+        labels = { instruction.label: index + 1 for index, instruction in enumerate(program) if isinstance(instruction, Label) }
+        self._allocate(control_flow.register_weights(program, labels))
         return ""
     
-    def _indented(self, code: str) -> str:
-        return "    " + code
+    def post_compilation(self, parts: list) -> str:
+        # parts: pre_compilation and header text, the instructions' code (lists of AsmLine, separated by newlines), footer text
+        code = [line for part in parts if isinstance(part, list) for line in part]
+        if self.peephole:
+            code = peephole(code)
+        return parts[0] + parts[1] + "".join(f"{line}\n" for line in code) + parts[-1]
     
-    def pre_instruction(self) -> str:
+    def stream_compilation(self, parts: list) -> str:
+        # the peephole runs over a window of pending lines, the last few stay pending so patterns can span windows
+        self.pending += [line for part in parts if isinstance(part, list) for line in part]
+        if len(self.pending) < self.STREAM_WINDOW:
+            return ""
+        code = peephole(self.pending, complete=False) if self.peephole else self.pending
+        self.pending = code[-self.STREAM_KEPT_LINES:]
+        return "".join(f"{line}\n" for line in code[:-self.STREAM_KEPT_LINES])
+
+    def stream_end(self) -> str:
+        code = peephole(self.pending) if self.peephole else self.pending
+        self.pending = []
+        return "".join(f"{line}\n" for line in code)
+
+    def pre_instruction(self) -> list[AsmLine]:
         self.compiled_instructions += 1
         if self.compiled_instructions in self.instruction_labels:
-            return f"{self.instruction_labels[self.compiled_instructions]}:\n"
-        return ""
+            return [AsmLabel(self.instruction_labels[self.compiled_instructions])]
+        return []
 
-    def set_value(self, register: int, value: int) -> str:
-        return self._indented(f"mov qword [memory + {register} * 8], {value}")
+    def _operand(self, register: int) -> str:
+        if register in self.allocation:
+            return self.allocation[register]
+        return f"qword [memory + {register} * 8]"
+
+    def _move(self, target: str, source: str) -> list[AsmLine]:
+        # memory to memory goes through rdx
+        if target == source:
+            return []
+        if is_memory(target) and is_memory(source):
+            return [AsmInstruction("mov", "rdx", source), AsmInstruction("mov", target, "rdx")]
+        return [AsmInstruction("mov", target, source)]
+
+    def set_value(self, register: int, value: int) -> list[AsmLine]:
+        # a memory operand only takes a sign extended 32bit immediate
+        if register not in self.allocation and not is_imm32(value):
+            return [AsmInstruction("mov", "rax", value), AsmInstruction("mov", self._operand(register), "rax")]
+        return [AsmInstruction("mov", self._operand(register), value)]
     
-    def set_register(self, target_register: int, source_register: int) -> str:
-        result = f"mov rdx, qword [memory + {source_register} * 8]\n"
-        result += f"\tmov qword [memory + {target_register} * 8], rdx"
-        return self._indented(result)
+    def set_register(self, target_register: int, source_register: int) -> list[AsmLine]:
+        return self._move(self._operand(target_register), self._operand(source_register))
 
-    def _compile_op(self, result_first_reg: str, second_reg: str, op: Op) -> str:
+    def _compile_op(self, result_first_reg: str, second_reg: Operand, op: Op) -> list[AsmLine]:
         if op == Op.ADD:
-            return f"add {result_first_reg}, {second_reg}"
+            return [AsmInstruction("add", result_first_reg, second_reg)]
         elif op == Op.SUB:
-            return f"sub {result_first_reg}, {second_reg}"
+            return [AsmInstruction("sub", result_first_reg, second_reg)]
         elif op == Op.MUL:
-            result = f"mov rax, {result_first_reg}\n"
-            result += f"\tmov rdx, {second_reg}\n"
-            result += f"\timul rdx\n"
-            result += f"\tmov {result_first_reg}, rax"
-            return result
+            # second_reg may be rax, it goes to rcx first (rbx and the other callee saved registers hold RAM registers)
+            return [AsmInstruction("mov", "rcx", second_reg)
+                    , AsmInstruction("mov", "rax", result_first_reg)
+                    , AsmInstruction("imul", "rcx")
+                    , AsmInstruction("mov", result_first_reg, "rax")]
         elif op == Op.DIV:
-            result = f"mov rcx, {result_first_reg}\n"
-            result += f"\tmov rbx, {second_reg}\n"
-            result += f"\txor rdx, rdx\n"
-            result += f"\tmov rax, rcx\n"
-            result += f"\tcqo\n"
-            result += f"\tidiv rbx\n"
-            result += f"\tmov {result_first_reg}, rax"
-            return result
-
-    def set_register_reg_op_const(self, target_register: int, source_register: int, op: Op, value: int) -> str:
-        result = f"mov rdx, qword [memory + {source_register} * 8]\n"
-        result += f"\t{self._compile_op('rdx', value, op)}\n"
-        result += f"\tmov qword [memory + {target_register} * 8], rdx"
-        return self._indented(result)
+            return [AsmInstruction("mov", "rcx", second_reg)
+                    , AsmInstruction("mov", "rax", result_first_reg)
+                    , AsmInstruction("cqo")
+                    , AsmInstruction("idiv", "rcx")
+                    , AsmInstruction("mov", result_first_reg, "rax")]
+        raise ValueError(f"Unknown op: {op}")
+
+    def set_register_reg_op_const(self, target_register: int, source_register: int, op: Op, value: int) -> list[AsmLine]:
+        result = [AsmInstruction("mov", "rdx", self._operand(source_register))]
+        if not is_imm32(value) and op in (Op.ADD, Op.SUB):
+            # add/sub only take a 32bit immediate
+            result.append(AsmInstruction("mov", "rax", value))
+            value = "rax"
+        result += self._compile_op("rdx", value, op)
+        result.append(AsmInstruction("mov", self._operand(target_register), "rdx"))
+        return result
     
-    def set_register_reg_op_reg(self, target_register: int, first_source_register: int, op: Op, second_source_register: int) -> str:
-        result = f"mov rdx, qword [memory + {first_source_register} * 8]\n"
-        result += f"\tmov rax, qword [memory + {second_source_register} * 8]\n"
-        result += f"\t{self._compile_op('rdx', 'rax', op)}\n"
-        result += f"\tmov qword [memory + {target_register} * 8], rdx"
-        return self._indented(result)
+    def set_register_reg_op_reg(self, target_register: int, first_source_register: int, op: Op, second_source_register: int) -> list[AsmLine]:
+        result = [AsmInstruction("mov", "rdx", self._operand(first_source_register))
+                  , AsmInstruction("mov", "rax", self._operand(second_source_register))]
+        result += self._compile_op("rdx", "rax", op)
+        result.append(AsmInstruction("mov", self._operand(target_register), "rdx"))
+        return result
     
-    def write(self, register: int) -> str:
-        return self._indented(f"mov rdi, qword [memory + {register} * 8]\n\tcall write_")
+    def write(self, register: int) -> list[AsmLine]:
+        return [AsmInstruction("mov", "rdi", self._operand(register)), AsmInstruction("call", "write_")]
     
-    def read(self, register: int) -> str:
-        return self._indented(f"call read_\n\tmov qword [memory + {register} * 8], rax")
+    def read(self, register: int) -> list[AsmLine]:
+        return [AsmInstruction("call", "read_"), AsmInstruction("mov", self._operand(register), "rax")]
     
-    def label(self, label: str) -> str:
-        return f"{self.map_label(label)}:"
+    def label(self, label: str) -> list[AsmLine]:
+        return [AsmLabel(self.map_label(label))]
     
-    def unconditional_jmp_to_label(self, label: str) -> str:
-        return self._indented(f"jmp {self.map_label(label)}")
+    def unconditional_jmp_to_label(self, label: str) -> list[AsmLine]:
+        return [AsmInstruction("jmp", self.map_label(label))]
     
     def _rel_to_jmp(self, rel: Rel) -> str:
         if rel == Rel.EQ:
@@ -213,37 +331,52 @@ _start:
         else:
             raise ValueError(f"Unknown rel: {rel}")
     
-    def _compile_condition(self, condition:  Union[ConditionWithRegister, ConditionWithConst]) -> str:
+    def _compile_condition(self, condition:  Union[ConditionWithRegister, ConditionWithConst]) -> list[AsmLine]:
         if isinstance(condition, ConditionWithRegister):
-            result = f"mov rax, qword [memory + {condition.first_register} * 8]\n"
-            result += f"\tmov rdx, qword [memory + {condition.second_register} * 8]\n"
-            result += f"\tcmp rax, rdx"
-            return result
+            first, second = self._operand(condition.first_register), self._operand(condition.second_register)
+            if is_memory(first) and is_memory(second):
+                return [AsmInstruction("mov", "rax", first), AsmInstruction("cmp", "rax", second)]
+            return [AsmInstruction("cmp", first, second)]
         elif isinstance(condition, ConditionWithConst):
-            return f"cmp qword [memory + {condition.register} * 8], {condition.value}"
+            if not is_imm32(condition.value):
+                return [AsmInstruction("mov", "rax", condition.value), AsmInstruction("cmp", self._operand(condition.register), "rax")]
+            return [AsmInstruction("cmp", self._operand(condition.register), condition.value)]
         else:
             raise ValueError(f"Unknown condition: {condition}")
 
-    def conditional_jmp_to_label(self, condition:  Union[ConditionWithRegister, ConditionWithConst], label: str) -> str:
-        return self._indented(f"{self._compile_condition(condition)}\n\t{self._rel_to_jmp(condition.rel)} {self.map_label(label)}")
+    def conditional_jmp_to_label(self, condition:  Union[ConditionWithRegister, ConditionWithConst], label: str) -> list[AsmLine]:
+        return self._compile_condition(condition) + [AsmInstruction(self._rel_to_jmp(condition.rel), self.map_label(label))]
+
+    def halt(self) -> list[AsmLine]:
+        return [AsmInstruction("call", "flush_"), AsmInstruction("mov", "rdi", 0), AsmInstruction("mov", "rax", 60), AsmInstruction("syscall")]
 
-    def halt(self) -> str:
-        return self._indented("mov rdi, 0\n\tmov rax, 60\n\tsyscall")
+    def unconditional_jmp_to_instruction(self, instruction_to_jmp: int) -> list[AsmLine]:
+        return [AsmInstruction("jmp", self.instruction_labels[instruction_to_jmp])]
 
-    def unconditional_jmp_to_instruction(self, instruction_to_jmp: int) -> str:
-        return self._indented(f"jmp {self.instruction_labels[instruction_to_jmp]}")
+    def conditional_jmp_to_instruction(self, condition:  Union[ConditionWithRegister, ConditionWithConst], instruction_to_jmp: int) -> list[AsmLine]:
+        return self._compile_condition(condition) + [AsmInstruction(self._rel_to_jmp(condition.rel), self.instruction_labels[instruction_to_jmp])]
 
-    def conditional_jmp_to_instruction(self, condition:  Union[ConditionWithRegister, ConditionWithConst], instruction_to_jmp: int) -> str:
-        return self._indented(f"{self._compile_condition(condition)}\n\t{self._rel_to_jmp(condition.rel)} {self.instruction_labels[instruction_to_jmp]}")
+    # an indirect access may hit an allocated register, whose memory slot is stale:
+    # Load takes the machine register instead, Store updates it too (cmov, no spilling)
+    def _bounds_check(self) -> list[AsmLine]:
+        # address in rdx, unsigned compare so negative addresses fail too
+        if not self.memory.needs_check(self.compiled_instructions):
+            return []
+        if not is_imm32(self.memory.registers):
+            return [AsmInstruction("mov", "rcx", self.memory.registers), AsmInstruction("cmp", "rdx", "rcx"), AsmInstruction("jae", "memory_error_")]
+        return [AsmInstruction("cmp", "rdx", self.memory.registers), AsmInstruction("jae", "memory_error_")]
 
-    def load(self, target_register: int, address_register: int) -> str:
-        result = f"mov rdx, qword [memory + {address_register} * 8]\n"
-        result += f"\tmov rax, qword [memory + rdx * 8]\n"
-        result += f"\tmov qword [memory + {target_register} * 8], rax"
-        return self._indented(result)
+    def load(self, target_register: int, address_register: int) -> list[AsmLine]:
+        result = [AsmInstruction("mov", "rdx", self._operand(address_register))] + self._bounds_check() \
+                 + [AsmInstruction("mov", "rax", "qword [memory + rdx * 8]")]
+        for register, machine_register in self.allocation.items():
+            result += [AsmInstruction("cmp", "rdx", register), AsmInstruction("cmove", "rax", machine_register)]
+        result.append(AsmInstruction("mov", self._operand(target_register), "rax"))
+        return result
     
-    def store(self, address_register: int, source_register: int) -> str:
-        result = f"mov rdx, qword [memory + {address_register} * 8]\n"
-        result += f"\tmov rax, qword [memory + {source_register} * 8]\n"
-        result += f"\tmov qword [memory + rdx * 8], rax"
-        return self._indented(result)
\ No newline at end of file
+    def store(self, address_register: int, source_register: int) -> list[AsmLine]:
+        result = [AsmInstruction("mov", "rdx", self._operand(address_register))] + self._bounds_check() \
+                 + [AsmInstruction("mov", "rax", self._operand(source_register)), AsmInstruction("mov", "qword [memory + rdx * 8]", "rax")]
+        for register, machine_register in self.allocation.items():
+            result += [AsmInstruction("cmp", "rdx", register), AsmInstruction("cmove", machine_register, "rax")]
+        return result
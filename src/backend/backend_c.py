@@ -1,41 +1,162 @@
-from typing import Dict
+from typing import Dict, Optional
 from ..instruction import *
+from ..ranges import RangeAnalysis, contains
+from .memory_layout import MemoryLayout
+from .program_scan import ProgramScan
 
 class BackendC:
     MEMORY_NAME = "memory"
-    def __init__(self, program: Program):
+    def __init__(self, program: Program, registers_as_locals: bool = False, memory_registers: Optional[int] = None, bounds_checks: bool = False):
         self.program = program
+        self.registers_as_locals = registers_as_locals
+        self.memory_registers = memory_registers
+        self.bounds_checks = bounds_checks
+        self.memory: Optional[MemoryLayout] = None
+        # registers no Load/Store can reach, emitted as int64_t locals the C compiler can keep in machine registers
+        self.locals: set[int] = set()
         self.compiled_instructions: int = 0
 
-        self.labels: Dict[str,str] = {}
         self.instruction_labels: Dict[int,str] = {}
 
     def map_label(self, label: str) -> str:
-        if label not in self.labels:
-            self.labels[label] = f"L_{len(self.labels)}"
-        return self.labels[label]
+        # RAM labels are identifiers already, the prefix keeps them apart from the runtime's names without a table of every label
+        return f"L_{label}"
 
-    def header(self) -> str:
-        return """
+    # buffered runtime: write_int formats into an output buffer, flushed when full, before a blocking read and at halt/return
+    # read_int parses whitespace separated numbers from a large input buffer, running out of input exits with status 1
+    # read(2) instead of fread, fread would wait for a full buffer on interactive input
+    RUNTIME = """
 #include <stdio.h>
 #include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+#define IO_BUFFER_SIZE (1 << 16)
+
+static char output_buffer[IO_BUFFER_SIZE];
+static size_t output_length = 0;
+static char input_buffer[IO_BUFFER_SIZE];
+static size_t input_position = 0;
+static size_t input_end = 0;
+
+static void flush_output(void)
+{
+    fwrite(output_buffer, 1, output_length, stdout);
+    fflush(stdout);
+    output_length = 0;
+}
+
+static void write_int(int64_t value)
+{
+    char digits[24];
+    char* end = digits + sizeof(digits);
+    char* start = end;
+    uint64_t magnitude = value < 0 ? -(uint64_t)value : (uint64_t)value;
+    *--start = '\\n';
+    do {
+        *--start = (char)('0' + magnitude % 10);
+        magnitude /= 10;
+    } while (magnitude != 0);
+    if (value < 0)
+        *--start = '-';
+    if (output_length + (size_t)(end - start) > IO_BUFFER_SIZE)
+        flush_output();
+    memcpy(output_buffer + output_length, start, (size_t)(end - start));
+    output_length += (size_t)(end - start);
+}
+
+static int input_byte(void)
+{
+    if (input_position == input_end) {
+        flush_output();
+        ssize_t length = read(0, input_buffer, IO_BUFFER_SIZE);
+        if (length <= 0)
+            return EOF;
+        input_position = 0;
+        input_end = (size_t)length;
+    }
+    return (unsigned char)input_buffer[input_position++];
+}
 
+static int64_t read_int(void)
+{
+    int c = input_byte();
+    while (c != EOF && c != '-' && (c < '0' || c > '9'))
+        c = input_byte();
+    if (c == EOF) {
+        flush_output();
+        exit(1);
+    }
+    int negative = c == '-';
+    if (negative)
+        c = input_byte();
+    uint64_t value = 0;
+    while (c >= '0' && c <= '9') {
+        value = value * 10 + (uint64_t)(c - '0');
+        c = input_byte();
+    }
+    return (int64_t)(negative ? -value : value);
+}
+"""
+
+    MEMORY_ERROR = """
+static void memory_error(int64_t address)
+{
+    flush_output();
+    fprintf(stderr, "Memory access out of bounds: %lld\\n", (long long)address);
+    exit(1);
+}
+"""
+
+    def header(self) -> str:
+        return self.RUNTIME + (self.MEMORY_ERROR if self.memory.has_checks else "") + f"""
+static int64_t {self.MEMORY_NAME}[{self.memory.registers}];
+""" + """
 int main(void) 
 {
-    int64_t """ + self.MEMORY_NAME + "[2048] = {0};\n"
+""" + "".join(self._indented(f"int64_t {self._register(register)} = 0;\n") for register in sorted(self.locals))
     
     def footer(self) -> str:
-        return "}"
+        return self._indented("flush_output();\n") + self._indented("return 0;\n") + "}"
     
     def _indented(self, code: str) -> str:
         return "    " + code
     
+    def pre_scan(self, scan: ProgramScan) -> str:
+        # everything a streamed program can be compiled with, without analysing it as a whole
+        for instruction in scan.instruction_targets:
+            self.instruction_labels[instruction] = "IL_" + str(instruction)
+        self.memory = MemoryLayout.from_scan(scan, self.memory_registers, self.bounds_checks)
+        if self.registers_as_locals and not scan.indirect:
+            self.locals = set(scan.uses)
+        return ""
+
     def pre_compilation(self, program: Program) -> str:
-        for instruction in program:
-            if isinstance(instruction, UnconditionalJmpToInstruction) or isinstance(instruction, ConditionalJmpToInstruction):
-                self.instruction_labels[instruction.instruction] = "IL_" + str(instruction.instruction)
+        scan = ProgramScan(program)
+        self.pre_scan(scan)
+
+        analysis = RangeAnalysis(program)
+        self.memory = MemoryLayout.analyze(program, scan, self.memory_registers, self.bounds_checks, analysis)
+        if self.registers_as_locals:
+            addresses = analysis.indirect_addresses()
+            self.locals = { register for register in scan.uses if addresses is None or not contains(addresses, register) }
         return ""
+
+    def _register(self, register: int) -> str:
+        if register in self.locals:
+            return f"r{register}"
+        return f"{self.MEMORY_NAME}[{register}]"
     
+    def post_compilation(self, parts: list[str]) -> str:
+        return "".join(parts)
+
+    def stream_compilation(self, parts: list[str]) -> str:
+        return "".join(parts)
+
+    def stream_end(self) -> str:
+        return ""
+
     def pre_instruction(self) -> str:
         self.compiled_instructions += 1
         if self.compiled_instructions in self.instruction_labels:
@@ -43,22 +164,22 @@ int main(void)
         return ""
 
     def set_value(self, register: int, value: int) -> str:
-        return self._indented(f"memory[{register}] = {value};")  
+        return self._indented(f"{self._register(register)} = {value};")  
     
     def set_register(self, target_register: int, source_register: int) -> str:
-        return self._indented(f"memory[{target_register}] = memory[{source_register}];")
+        return self._indented(f"{self._register(target_register)} = {self._register(source_register)};")
     
     def set_register_reg_op_const(self, target_register: int, source_register: int, op: Op, value: int) -> str:
-        return self._indented(f"memory[{target_register}] = memory[{source_register}] {op} {value};")
+        return self._indented(f"{self._register(target_register)} = {self._register(source_register)} {op} {value};")
     
     def set_register_reg_op_reg(self, target_register: int, first_source_register: int, op: Op, second_source_register: int) -> str:
-        return self._indented(f"memory[{target_register}] = memory[{first_source_register}] {op} memory[{second_source_register}];")
+        return self._indented(f"{self._register(target_register)} = {self._register(first_source_register)} {op} {self._register(second_source_register)};")
     
     def write(self, register: int) -> str:
-        return self._indented(f"printf(\"%d\\n\", memory[{register}]);")
+        return self._indented(f"write_int({self._register(register)});")
     
     def read(self, register: int) -> str:
-        return self._indented(f"scanf(\"%d\", &memory[{register}]);")
+        return self._indented(f"{self._register(register)} = read_int();")
     
     def label(self, label: str) -> str:
         return self._indented(f"{self.map_label(label)}:")
@@ -68,29 +189,35 @@ int main(void)
     
     def conditional_jmp_to_label(self, condition:  Union[ConditionWithRegister, ConditionWithConst], label: str) -> str:
         if isinstance(condition, ConditionWithRegister):
-            return self._indented(f"if (memory[{condition.first_register}] {condition.rel} memory[{condition.second_register}])\n\t\tgoto {self.map_label(label)};")
+            return self._indented(f"if ({self._register(condition.first_register)} {condition.rel} {self._register(condition.second_register)})\n\t\tgoto {self.map_label(label)};")
         elif isinstance(condition, ConditionWithConst):
-            return self._indented(f"if (memory[{condition.register}] {condition.rel} {condition.value}) \n\t\tgoto {self.map_label(label)};")
+            return self._indented(f"if ({self._register(condition.register)} {condition.rel} {condition.value}) \n\t\tgoto {self.map_label(label)};")
         else:
             raise ValueError(f"Unknown condition: {condition}")
 
     def halt(self) -> str:
-        return self._indented("return 0;")
+        return self._indented("flush_output();\n") + self._indented("return 0;")
 
     def unconditional_jmp_to_instruction(self, instruction_to_jmp: int) -> str:
         return self._indented(f"goto {self.instruction_labels[instruction_to_jmp]};")
 
     def conditional_jmp_to_instruction(self, condition:  Union[ConditionWithRegister, ConditionWithConst], instruction_to_jmp: int) -> str:
         if isinstance(condition, ConditionWithRegister):
-            return self._indented(f"if (memory[{condition.first_register}] {condition.rel} memory[{condition.second_register}])\n\t\tgoto {self.instruction_labels[instruction_to_jmp]};")
+            return self._indented(f"if ({self._register(condition.first_register)} {condition.rel} {self._register(condition.second_register)})\n\t\tgoto {self.instruction_labels[instruction_to_jmp]};")
         elif isinstance(condition, ConditionWithConst):
-            return self._indented(f"if (memory[{condition.register}] {condition.rel} {condition.value}) \n\t\tgoto {self.instruction_labels[instruction_to_jmp]};")
+            return self._indented(f"if ({self._register(condition.register)} {condition.rel} {condition.value}) \n\t\tgoto {self.instruction_labels[instruction_to_jmp]};")
         else:
             raise ValueError(f"Unknown condition: {condition}")   
 
 
+    def _bounds_check(self, address_register: int) -> str:
+        if not self.memory.needs_check(self.compiled_instructions):
+            return ""
+        address = self._register(address_register)
+        return self._indented(f"if ((uint64_t){address} >= {self.memory.registers})\n\t\tmemory_error({address});\n")
+
     def load(self, target_register: int, address_register: int) -> str:
-        return self._indented(f"memory[{target_register}] = memory[memory[{address_register}]];")
+        return self._bounds_check(address_register) + self._indented(f"{self._register(target_register)} = memory[{self._register(address_register)}];")
     
     def store(self, address_register: int, source_register: int) -> str:
-        return self._indented(f"memory[memory[{address_register}]] = memory[{source_register}];")
\ No newline at end of file
+        return self._bounds_check(address_register) + self._indented(f"memory[{self._register(address_register)}] = {self._register(source_register)};")
\ No newline at end of file
@@ -0,0 +1,64 @@
+from typing import Optional
+
+from ..instruction import *
+from ..ranges import RangeAnalysis
+from .program_scan import ProgramScan
+
+class MemoryLayout:
+    # how many registers the memory region of a compiled program holds and which Load/Store need a bounds check
+    # the size is --memory when given, otherwise everything the program can provably reach (directly named registers and
+    # Load/Store address bounds), otherwise LARGE_REGISTERS: a bss region, the kernel only commits the pages that get touched
+    LARGE_REGISTERS = 1 << 27 # 1 GiB
+
+    def __init__(self, registers: int, required: Optional[int], checked: Optional[set[int]]):
+        self.registers = registers
+        self.required = required # None when the program's needs are unknown
+        # instruction pointers of the Load/Store whose address may fall outside the region, None for every Load/Store
+        self.checked = checked
+
+    def needs_check(self, instruction_pointer: int) -> bool:
+        return self.checked is None or instruction_pointer in self.checked
+
+    @property
+    def has_checks(self) -> bool:
+        return self.checked is None or len(self.checked) > 0
+
+    @staticmethod
+    def _size(largest_named: int, required: Optional[int], registers: Optional[int]) -> int:
+        if registers is None:
+            if largest_named >= MemoryLayout.LARGE_REGISTERS:
+                raise ValueError(f"The program uses R{largest_named}, compiled programs have at most {MemoryLayout.LARGE_REGISTERS} registers")
+            return required if required is not None else MemoryLayout.LARGE_REGISTERS
+        if registers <= largest_named:
+            raise ValueError(f"Memory of {registers} registers is too small, the program uses R{largest_named}")
+        return registers
+
+    @classmethod
+    def analyze(cls, program: Program, scan: ProgramScan, registers: Optional[int] = None, bounds_checks: bool = False
+                , analysis: Optional[RangeAnalysis] = None) -> "MemoryLayout":
+        # sized by the range analysis of the whole program, only accesses it cannot bound are checked
+        # a bound past LARGE_REGISTERS gets the large region too, the accesses reaching past it are checked even without bounds_checks
+        analysis = analysis if analysis is not None else RangeAnalysis(program)
+        required = scan.largest_named + 1
+        addresses = analysis.indirect_addresses()
+        if addresses is not None:
+            low, high = addresses
+            required = None if low is None or low < 0 or high is None or high >= cls.LARGE_REGISTERS else max(scan.largest_named, high) + 1
+        size = cls._size(scan.largest_named, required, registers)
+
+        checked: set[int] = set()
+        for index, (instruction, state) in enumerate(zip(program, analysis.states())):
+            if state is None or not isinstance(instruction, (Load, Store)):
+                continue
+            low, high = state.get(instruction.source_register if isinstance(instruction, Load) else instruction.target_register)
+            if bounds_checks and (low is None or low < 0 or high is None or high >= size) \
+               or high is not None and high >= max(size, cls.LARGE_REGISTERS):
+                checked.add(index + 1)
+        return cls(size, required, checked)
+
+    @classmethod
+    def from_scan(cls, scan: ProgramScan, registers: Optional[int] = None, bounds_checks: bool = False) -> "MemoryLayout":
+        # for streamed programs, no analysis: any Load/Store makes the needs unknown
+        required = None if scan.indirect else scan.largest_named + 1
+        size = cls._size(scan.largest_named, required, registers)
+        return cls(size, required, None if bounds_checks and scan.indirect else set())
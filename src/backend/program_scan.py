@@ -0,0 +1,25 @@
+from typing import Iterable
+
+from ..instruction import *
+from .. import control_flow
+
+class ProgramScan:
+    # what a backend has to know before emitting anything, collected in a single pass over the instructions
+    # without keeping them, so a streamed program can be scanned first and compiled in a second pass
+    def __init__(self, program: Iterable[Instruction]):
+        self.instruction_targets: set[int] = set() # numeric jump targets
+        self.uses: dict[int, int] = {} # directly named register -> how many times it is named
+        self.indirect: bool = False # any Load/Store
+        self.length: int = 0
+        for instruction in program:
+            self.length += 1
+            if isinstance(instruction, (UnconditionalJmpToInstruction, ConditionalJmpToInstruction)):
+                self.instruction_targets.add(instruction.instruction)
+            elif isinstance(instruction, (Load, Store)):
+                self.indirect = True
+            for register in control_flow.static_registers(instruction):
+                self.uses[register] = self.uses.get(register, 0) + 1
+
+    @property
+    def largest_named(self) -> int:
+        return max(self.uses, default=0)
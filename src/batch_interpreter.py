@@ -0,0 +1,238 @@
+from enum import Enum
+from typing import Callable, Iterable, Optional
+import numpy as np
+
+from .instruction import *
+from .registers import wrap_int64
+from . import control_flow
+
+class LaneStatus(Enum):
+    RUNNING = 0 # still running when the step limit was hit
+    HALTED = 1 # executed halt
+    FINISHED = 2 # ran past the end of the program
+    ERROR = 3
+
+class LaneResult:
+    def __init__(self, output: list[int], status: LaneStatus, instruction_pointer: int, error: Optional[str] = None):
+        self.output = output
+        self.status = status
+        self.instruction_pointer = instruction_pointer
+        self.error = error
+
+    def __repr__(self):
+        return f"LaneResult({self.output}, {self.status}, {self.instruction_pointer}, {self.error})"
+
+# handler(lanes) executes one instruction for the given lane indices and updates their instruction pointers
+LaneHandler = Callable[[np.ndarray], None]
+
+class BatchInterpreter:
+    # runs one program on many inputs at once, lane i has its own registers (row i), instruction pointer and input
+    # registers are int64 like Interpreter(word_size=64): arithmetic wraps and division truncates like C
+    # Store grows the register matrix up to this many columns, registers past it (or negative) are kept per lane in overflow
+    DENSE_REGISTERS = 1 << 12
+
+    RELATIONS = {
+        Rel.LT: np.less,
+        Rel.GT: np.greater,
+        Rel.LE: np.less_equal,
+        Rel.GE: np.greater_equal,
+        Rel.EQ: np.equal,
+        Rel.NE: np.not_equal,
+    }
+
+    def __init__(self, program: Program, inputs: Iterable[Iterable[int]]):
+        self.program: Program = program
+        self.labels: dict[str, int] = { instruction.label: index + 1 for index, instruction in enumerate(program) if isinstance(instruction, Label) }
+
+        inputs = [[wrap_int64(int(value)) for value in lane_input] for lane_input in inputs]
+        self.lanes: int = len(inputs)
+        self.input_length = np.array([len(lane_input) for lane_input in inputs], dtype=np.int64)
+        self.input_matrix = np.zeros((self.lanes, max([len(lane_input) for lane_input in inputs], default=0)), dtype=np.int64)
+        for lane, lane_input in enumerate(inputs):
+            self.input_matrix[lane, :len(lane_input)] = lane_input
+        self.input_cursor = np.zeros(self.lanes, dtype=np.int64)
+
+        highest_register = max((register for instruction in program for register in control_flow.static_registers(instruction)), default=0)
+        self.registers = np.zeros((self.lanes, highest_register + 1), dtype=np.int64)
+        self.instruction_pointers = np.ones(self.lanes, dtype=np.int64)
+        self.status = np.full(self.lanes, LaneStatus.RUNNING.value, dtype=np.int8)
+        self.errors: dict[int, str] = {}
+        self.overflow: dict[tuple[int, int], int] = {} # (lane, register) -> value, registers outside the matrix written by Store
+
+        # written values are collected as (lanes, values) chunks and split per lane at the end
+        self.output_chunks: list[tuple[np.ndarray, np.ndarray]] = []
+
+        self.handlers: list[LaneHandler] = [self._decode_instruction(index + 1, instruction) for index, instruction in enumerate(program)]
+
+    def _fail(self, lanes: np.ndarray, error: str):
+        self.status[lanes] = LaneStatus.ERROR.value
+        for lane in lanes.tolist():
+            self.errors[lane] = error
+
+    def _ensure_registers(self, count: int):
+        if count > self.registers.shape[1]:
+            grown = max(count, min(2 * self.registers.shape[1], self.DENSE_REGISTERS))
+            self.registers = np.pad(self.registers, ((0, 0), (0, grown - self.registers.shape[1])))
+
+    def _apply_operation(self, op: Op, lanes: np.ndarray, a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # returns (lanes that succeeded, result for them)
+        if op == Op.ADD:
+            return lanes, a + b
+        elif op == Op.SUB:
+            return lanes, a - b
+        elif op == Op.MUL:
+            return lanes, a * b
+        elif op == Op.DIV:
+            zero = b == 0
+            if zero.any():
+                self._fail(lanes[zero], "ZeroDivisionError")
+                lanes, a, b = lanes[~zero], a[~zero], b[~zero]
+            quotient = a // b
+            # floor -> truncation towards zero
+            quotient += ((a % b) != 0) & ((a < 0) != (b < 0))
+            return lanes, quotient
+        raise ValueError(f"Invalid operation: {op}")
+
+    def _condition(self, condition: Union[ConditionWithRegister, ConditionWithConst], lanes: np.ndarray) -> np.ndarray:
+        relation = self.RELATIONS[condition.rel]
+        if isinstance(condition, ConditionWithConst):
+            return relation(self.registers[lanes, condition.register], condition.value)
+        elif isinstance(condition, ConditionWithRegister):
+            return relation(self.registers[lanes, condition.first_register], self.registers[lanes, condition.second_register])
+        raise ValueError(f"Invalid condition: {condition}")
+
+    def _decode_instruction(self, instruction_pointer: int, instruction: Instruction) -> LaneHandler:
+        next_ip = instruction_pointer + 1
+        ips = self.instruction_pointers
+
+        if isinstance(instruction, Label):
+            def handler(lanes):
+                ips[lanes] = next_ip
+        elif isinstance(instruction, SetValue):
+            target, value = instruction.target_register, wrap_int64(instruction.value)
+            def handler(lanes):
+                self.registers[lanes, target] = value
+                ips[lanes] = next_ip
+        elif isinstance(instruction, SetRegister):
+            target, source = instruction.target_register, instruction.source_register
+            def handler(lanes):
+                self.registers[lanes, target] = self.registers[lanes, source]
+                ips[lanes] = next_ip
+        elif isinstance(instruction, SetRegisterRegOpConst):
+            target, source, op, value = instruction.target_register, instruction.source_register, instruction.op, np.int64(wrap_int64(instruction.value))
+            if op == Op.DIV and value == 0:
+                # a constant divisor of 0 fails every lane reaching it
+                def handler(lanes):
+                    self._fail(lanes, "ZeroDivisionError")
+                return handler
+            def handler(lanes):
+                lanes, result = self._apply_operation(op, lanes, self.registers[lanes, source], value)
+                self.registers[lanes, target] = result
+                ips[lanes] = next_ip
+        elif isinstance(instruction, SetRegisterRegOpReg):
+            target, first, op, second = instruction.target_register, instruction.first_source_register, instruction.op, instruction.second_source_register
+            def handler(lanes):
+                lanes, result = self._apply_operation(op, lanes, self.registers[lanes, first], self.registers[lanes, second])
+                self.registers[lanes, target] = result
+                ips[lanes] = next_ip
+        elif isinstance(instruction, Load):
+            target, source = instruction.target_register, instruction.source_register
+            def handler(lanes):
+                addresses = self.registers[lanes, source]
+                # registers outside the matrix are in overflow when they were written, otherwise they read as 0
+                inside = (addresses >= 0) & (addresses < self.registers.shape[1])
+                values = np.zeros(len(lanes), dtype=np.int64)
+                values[inside] = self.registers[lanes[inside], addresses[inside]]
+                if self.overflow and not inside.all():
+                    values[~inside] = [self.overflow.get(key, 0) for key in zip(lanes[~inside].tolist(), addresses[~inside].tolist())]
+                self.registers[lanes, target] = values
+                ips[lanes] = next_ip
+        elif isinstance(instruction, Store):
+            target, source = instruction.target_register, instruction.source_register
+            def handler(lanes):
+                addresses = self.registers[lanes, target]
+                # the matrix grows for every lane, only up to DENSE_REGISTERS, higher (and negative) registers go to overflow
+                dense = addresses[(addresses >= 0) & (addresses < self.DENSE_REGISTERS)]
+                if len(dense):
+                    self._ensure_registers(int(dense.max()) + 1)
+                values = self.registers[lanes, source]
+                inside = (addresses >= 0) & (addresses < self.registers.shape[1])
+                self.registers[lanes[inside], addresses[inside]] = values[inside]
+                if not inside.all():
+                    self.overflow.update(zip(zip(lanes[~inside].tolist(), addresses[~inside].tolist()), values[~inside].tolist()))
+                ips[lanes] = next_ip
+        elif isinstance(instruction, control_flow.JUMPS):
+            jump_target = control_flow.jump_target(instruction, self.labels)
+            condition = instruction.condition if isinstance(instruction, control_flow.CONDITIONAL_JUMPS) else None
+            def handler(lanes):
+                taken = np.ones(len(lanes), dtype=bool) if condition is None else self._condition(condition, lanes)
+                if jump_target is None or jump_target < 1:
+                    if taken.any():
+                        self._fail(lanes[taken], f"Invalid jump target in instruction {instruction_pointer}")
+                    ips[lanes[~taken]] = next_ip
+                    return
+                ips[lanes] = np.where(taken, jump_target, next_ip)
+        elif isinstance(instruction, Read):
+            target = instruction.target_register
+            def handler(lanes):
+                exhausted = self.input_cursor[lanes] >= self.input_length[lanes]
+                if exhausted.any():
+                    self._fail(lanes[exhausted], "EOFError")
+                    lanes = lanes[~exhausted]
+                self.registers[lanes, target] = self.input_matrix[lanes, self.input_cursor[lanes]]
+                self.input_cursor[lanes] += 1
+                ips[lanes] = next_ip
+        elif isinstance(instruction, Write):
+            source = instruction.source_register
+            def handler(lanes):
+                self.output_chunks.append((lanes.copy(), self.registers[lanes, source].copy()))
+                ips[lanes] = next_ip
+        elif isinstance(instruction, Halt):
+            def handler(lanes):
+                self.status[lanes] = LaneStatus.HALTED.value
+        else:
+            raise ValueError(f"Invalid instruction: {instruction}")
+
+        return handler
+
+    def step(self) -> bool:
+        # every running lane executes one instruction, lanes sharing an instruction pointer run it as one vector op
+        running = np.flatnonzero(self.status == LaneStatus.RUNNING.value)
+        finished = self.instruction_pointers[running] > len(self.program)
+        if finished.any():
+            self.status[running[finished]] = LaneStatus.FINISHED.value
+            running = running[~finished]
+        if len(running) == 0:
+            return False
+
+        lane_ips = self.instruction_pointers[running]
+        order = np.argsort(lane_ips, kind='stable')
+        sorted_lanes, sorted_ips = running[order], lane_ips[order]
+        group_starts = np.flatnonzero(np.diff(sorted_ips, prepend=-1))
+        group_ends = np.append(group_starts[1:], len(sorted_lanes))
+
+        with np.errstate(over='ignore'):
+            for start, end in zip(group_starts.tolist(), group_ends.tolist()):
+                self.handlers[int(sorted_ips[start]) - 1](sorted_lanes[start:end])
+        return True
+
+    def run(self, max_steps: Optional[int] = None) -> list[LaneResult]:
+        steps = 0
+        while (max_steps is None or steps < max_steps) and self.step():
+            steps += 1
+        return self.results()
+
+    def results(self) -> list[LaneResult]:
+        outputs: list[list[int]] = [[] for _ in range(self.lanes)]
+        if self.output_chunks:
+            lanes = np.concatenate([lanes for lanes, _ in self.output_chunks])
+            values = np.concatenate([values for _, values in self.output_chunks])
+            # stable sort keeps every lane's values in the order they were written
+            order = np.argsort(lanes, kind='stable')
+            lanes, values = lanes[order], values[order]
+            boundaries = np.searchsorted(lanes, np.arange(self.lanes + 1))
+            for lane in range(self.lanes):
+                outputs[lane] = values[boundaries[lane]:boundaries[lane + 1]].tolist()
+
+        return [LaneResult(outputs[lane], LaneStatus(int(self.status[lane])), int(self.instruction_pointers[lane]), self.errors.get(lane))
+                for lane in range(self.lanes)]
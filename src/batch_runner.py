@@ -0,0 +1,80 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, Optional
+
+from .instruction import Program
+from .interpreter import Interpreter
+from .io_channels import TokenInput, ListInput, ListOutput
+
+def collect_files(path: str, suffix: str = "") -> list[str]:
+    # a single file, or every matching file of a directory
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.endswith(suffix) and os.path.isfile(os.path.join(path, name)))
+
+# programs are sent to each worker once (pool initializer) and decoded there once, jobs only carry paths
+_worker_programs: dict[str, Program] = {}
+_worker_interpreters: dict[str, Interpreter] = {}
+_worker_word_size: Optional[int] = None
+_worker_max_steps: Optional[int] = None
+
+def _init_worker(programs: dict[str, Program], word_size: Optional[int], max_steps: Optional[int]):
+    global _worker_word_size, _worker_max_steps
+    _worker_programs.update(programs)
+    _worker_word_size = word_size
+    _worker_max_steps = max_steps
+
+def _interpreter_for(program_path: str) -> Interpreter:
+    interpreter = _worker_interpreters.get(program_path)
+    if interpreter is None:
+        interpreter = Interpreter(_worker_programs[program_path], word_size=_worker_word_size)
+        _worker_interpreters[program_path] = interpreter
+    else:
+        interpreter.reset()
+    return interpreter
+
+def run_job(program_path: str, input_path: Optional[str]) -> dict:
+    output = ListOutput()
+    result = { "program": program_path, "input": input_path }
+    start = time.perf_counter()
+    interpreter = None
+    try:
+        interpreter = _interpreter_for(program_path)
+        if input_path is None:
+            finished = interpreter.run(input_fn=ListInput([]), output_fn=output, max_steps=_worker_max_steps)
+        else:
+            with open(input_path, 'rb') as f:
+                finished = interpreter.run(input_fn=TokenInput(f), output_fn=output, max_steps=_worker_max_steps)
+        result["exit_status"] = 0 if finished else 1
+        if not finished:
+            # a program that does not terminate would hold its worker forever
+            result["error"] = f"StepLimit: stopped after {_worker_max_steps} instructions"
+    except Exception as e:
+        result["exit_status"] = 1
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    result["wall_time"] = time.perf_counter() - start
+    result["instructions"] = interpreter.executed_instructions if interpreter is not None else 0
+    result["stdout"] = "".join(f"{value}\n" for value in output.values)
+    return result
+
+class BatchRunner:
+    DEFAULT_MAX_STEPS = 100_000_000 # instructions a job may run, None runs every job to its end
+
+    def __init__(self, programs: dict[str, Program], word_size: Optional[int] = None, workers: Optional[int] = None
+                 , max_steps: Optional[int] = DEFAULT_MAX_STEPS):
+        self.programs = programs
+        self.word_size = word_size
+        self.workers = workers
+        self.max_steps = max_steps
+
+    def run(self, input_paths: list[Optional[str]]) -> Iterator[dict]:
+        # every program with every input, results are yielded as soon as a job finishes
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.programs, self.word_size, self.max_steps)) as executor:
+            futures = [executor.submit(run_job, program_path, input_path)
+                       for program_path in self.programs
+                       for input_path in input_paths]
+            for future in as_completed(futures):
+                yield future.result()
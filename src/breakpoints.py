@@ -0,0 +1,48 @@
+from typing import Callable, Iterator, Optional
+
+from .instruction import *
+from .interpreter import Interpreter
+from . import control_flow
+
+class Breakpoints:
+    # line breakpoints of the debugger, optionally with a condition, and watched registers
+    # `instruction_pointer in breakpoints` is true when execution should stop there, conditions are checked against the current registers
+    def __init__(self, interpreter: Interpreter):
+        self.interpreter = interpreter
+        self.conditions: dict[int, Optional[Union[ConditionWithConst, ConditionWithRegister]]] = {} # None for unconditional
+        self.predicates: dict[int, Callable[[], bool]] = {} # compiled once, only conditional breakpoints
+        self.watched: dict[int, str] = {} # register -> how it was given (R7, [R2])
+
+    def add(self, instruction_pointer: int, condition: Optional[Union[ConditionWithConst, ConditionWithRegister]] = None):
+        self.conditions[instruction_pointer] = condition
+        self.predicates.pop(instruction_pointer, None)
+        if condition is not None:
+            # the predicate indexes the dense region directly when the registers it names fit in it
+            self.interpreter.registers.reserve(max(control_flow.condition_registers(condition)) + 1)
+            self.predicates[instruction_pointer] = self.interpreter.decode_condition(condition)
+
+    def remove(self, instruction_pointer: int):
+        self.conditions.pop(instruction_pointer, None)
+        self.predicates.pop(instruction_pointer, None)
+
+    def watch(self, register: int, description: str):
+        self.watched[register] = description
+
+    def unwatch(self, register: int):
+        self.watched.pop(register, None)
+
+    def __contains__(self, instruction_pointer: int) -> bool:
+        if instruction_pointer not in self.conditions:
+            return False
+        predicate = self.predicates.get(instruction_pointer)
+        return predicate is None or predicate()
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.conditions)
+
+    def describe(self) -> list[str]:
+        described = []
+        for instruction_pointer in sorted(self.conditions):
+            condition = self.conditions[instruction_pointer]
+            described.append(str(instruction_pointer) if condition is None else f"{instruction_pointer} if {condition}")
+        return described
@@ -1,6 +1,7 @@
-from typing import Union
+from typing import Callable, Iterable, Optional, TextIO, Union
 from .backend.backend_c import BackendC
 from .backend.backend_asm import BackendAsm
+from .backend.program_scan import ProgramScan
 from .instruction import *
 
 Backend = Union[BackendC, BackendAsm]
@@ -12,43 +13,60 @@ class Compiler:
     def compile(self) -> str:
         program = self.target.program
 
-        result = self.target.pre_compilation(program)
-        result += self.target.header()
+        # backends return the code of every instruction, post_compilation puts it together
+        result = [self.target.pre_compilation(program), self.target.header()]
 
         for instruction in program:
-            result += self.target.pre_instruction()
-            if isinstance(instruction, SetValue):
-                result += self.target.set_value(instruction.target_register, instruction.value)
-            elif isinstance(instruction, SetRegister):
-                result += self.target.set_register(instruction.target_register, instruction.source_register)
-            elif isinstance(instruction, SetRegisterRegOpConst):
-                result += self.target.set_register_reg_op_const(instruction.target_register, instruction.source_register, instruction.op, instruction.value)
-            elif isinstance(instruction, SetRegisterRegOpReg):
-                result += self.target.set_register_reg_op_reg(instruction.target_register, instruction.first_source_register, instruction.op, instruction.second_source_register)
-            elif isinstance(instruction, Write):
-                result += self.target.write(instruction.source_register)
-            elif isinstance(instruction, Read):
-                result += self.target.read(instruction.target_register)
-            elif isinstance(instruction, Label):
-                result += self.target.label(instruction.label)
-            elif isinstance(instruction, UnconditionalJmpToLabel):
-                result += self.target.unconditional_jmp_to_label(instruction.label)
-            elif isinstance(instruction, UnconditionalJmpToInstruction):
-                result += self.target.unconditional_jmp_to_instruction(instruction.instruction)
-            elif isinstance(instruction, ConditionalJmpToInstruction):
-                result += self.target.conditional_jmp_to_instruction(instruction.condition, instruction.instruction)
-            elif isinstance(instruction, ConditionalJmpToLabel):
-                result += self.target.conditional_jmp_to_label(instruction.condition, instruction.label)
-            elif isinstance(instruction, Halt):
-                result += self.target.halt()
-            elif isinstance(instruction, Load):
-                result += self.target.load(instruction.target_register, instruction.source_register)
-            elif isinstance(instruction, Store):
-                result += self.target.store(instruction.target_register, instruction.source_register)
-            else:
-                raise NotImplementedError(f"Unknown instruction: {repr(instruction)}")
-            
-            result += "\n"
-
-        result += self.target.footer()
-        return result
\ No newline at end of file
+            result += self._compile_instruction(instruction)
+
+        result.append(self.target.footer())
+        return self.target.post_compilation(result)
+
+    def pre_scan(self, program: Callable[[], Iterable[Instruction]], scan: Optional[ProgramScan] = None) -> str:
+        # the first pass of compile_stream, on its own a program the backend rejects fails before any output is opened
+        return self.target.pre_scan(scan if scan is not None else ProgramScan(program()))
+
+    def compile_stream(self, program: Callable[[], Iterable[Instruction]], out: TextIO, scanned: Optional[str] = None):
+        # two passes over a program too large to keep: a scan for what the header needs, then the code is written as it is compiled
+        # program returns a fresh iterable of the instructions for each pass, scanned is what pre_scan returned if it already ran
+        out.write(scanned if scanned is not None else self.pre_scan(program))
+        out.write(self.target.header())
+        for instruction in program():
+            out.write(self.target.stream_compilation(self._compile_instruction(instruction)))
+        out.write(self.target.stream_end())
+        out.write(self.target.footer())
+
+    def _compile_instruction(self, instruction: Instruction) -> list:
+        parts = [self.target.pre_instruction()]
+        if isinstance(instruction, SetValue):
+            parts.append(self.target.set_value(instruction.target_register, instruction.value))
+        elif isinstance(instruction, SetRegister):
+            parts.append(self.target.set_register(instruction.target_register, instruction.source_register))
+        elif isinstance(instruction, SetRegisterRegOpConst):
+            parts.append(self.target.set_register_reg_op_const(instruction.target_register, instruction.source_register, instruction.op, instruction.value))
+        elif isinstance(instruction, SetRegisterRegOpReg):
+            parts.append(self.target.set_register_reg_op_reg(instruction.target_register, instruction.first_source_register, instruction.op, instruction.second_source_register))
+        elif isinstance(instruction, Write):
+            parts.append(self.target.write(instruction.source_register))
+        elif isinstance(instruction, Read):
+            parts.append(self.target.read(instruction.target_register))
+        elif isinstance(instruction, Label):
+            parts.append(self.target.label(instruction.label))
+        elif isinstance(instruction, UnconditionalJmpToLabel):
+            parts.append(self.target.unconditional_jmp_to_label(instruction.label))
+        elif isinstance(instruction, UnconditionalJmpToInstruction):
+            parts.append(self.target.unconditional_jmp_to_instruction(instruction.instruction))
+        elif isinstance(instruction, ConditionalJmpToInstruction):
+            parts.append(self.target.conditional_jmp_to_instruction(instruction.condition, instruction.instruction))
+        elif isinstance(instruction, ConditionalJmpToLabel):
+            parts.append(self.target.conditional_jmp_to_label(instruction.condition, instruction.label))
+        elif isinstance(instruction, Halt):
+            parts.append(self.target.halt())
+        elif isinstance(instruction, Load):
+            parts.append(self.target.load(instruction.target_register, instruction.source_register))
+        elif isinstance(instruction, Store):
+            parts.append(self.target.store(instruction.target_register, instruction.source_register))
+        else:
+            raise NotImplementedError(f"Unknown instruction: {repr(instruction)}")
+        parts.append("\n")
+        return parts
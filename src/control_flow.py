@@ -0,0 +1,75 @@
+from typing import Optional
+
+from .instruction import *
+
+JUMPS = (UnconditionalJmpToLabel, UnconditionalJmpToInstruction, ConditionalJmpToLabel, ConditionalJmpToInstruction)
+CONDITIONAL_JUMPS = (ConditionalJmpToLabel, ConditionalJmpToInstruction)
+UNCONDITIONAL_JUMPS = (UnconditionalJmpToLabel, UnconditionalJmpToInstruction)
+
+def jump_target(instruction: Instruction, labels: dict[str, int]) -> Optional[int]:
+    # instruction pointer the jump lands on, None for unknown labels
+    if isinstance(instruction, (UnconditionalJmpToLabel, ConditionalJmpToLabel)):
+        return labels.get(instruction.label)
+    return instruction.instruction
+
+def is_terminator(instruction: Instruction) -> bool:
+    return isinstance(instruction, (*JUMPS, Halt))
+
+def static_registers(instruction: Instruction) -> list[int]:
+    # registers an instruction names directly (not through Load/Store)
+    if isinstance(instruction, (SetValue, Read)):
+        return [instruction.target_register]
+    elif isinstance(instruction, (SetRegister, SetRegisterRegOpConst, Load, Store)):
+        return [instruction.target_register, instruction.source_register]
+    elif isinstance(instruction, SetRegisterRegOpReg):
+        return [instruction.target_register, instruction.first_source_register, instruction.second_source_register]
+    elif isinstance(instruction, Write):
+        return [instruction.source_register]
+    elif isinstance(instruction, (ConditionalJmpToLabel, ConditionalJmpToInstruction)):
+        return condition_registers(instruction.condition)
+    return []
+
+def condition_registers(condition: Union[ConditionWithConst, ConditionWithRegister]) -> list[int]:
+    if isinstance(condition, ConditionWithConst):
+        return [condition.register]
+    return [condition.first_register, condition.second_register]
+
+def written_register(instruction: Instruction) -> Optional[int]:
+    # register an instruction writes, None for Store whose target is only known at runtime
+    if isinstance(instruction, (SetValue, SetRegister, SetRegisterRegOpConst, SetRegisterRegOpReg, Load, Read)):
+        return instruction.target_register
+    return None
+
+def block_leaders(program: Program, labels: dict[str, int]) -> list[int]:
+    # instruction pointers (counted from 1) where a basic block starts
+    leaders = {1} if program else set()
+    for index, instruction in enumerate(program):
+        instruction_pointer = index + 1
+        if isinstance(instruction, Label):
+            leaders.add(instruction_pointer)
+        if isinstance(instruction, JUMPS):
+            target = jump_target(instruction, labels)
+            if target is not None and 1 <= target <= len(program):
+                leaders.add(target)
+        if is_terminator(instruction) and instruction_pointer < len(program):
+            leaders.add(instruction_pointer + 1)
+    return sorted(leaders)
+
+def loop_depths(program: Program, labels: dict[str, int]) -> list[int]:
+    # for every instruction, how many loops (ranges from a backward jump's target to the jump) contain it
+    depths = [0] * len(program)
+    for index, instruction in enumerate(program):
+        if isinstance(instruction, JUMPS):
+            target = jump_target(instruction, labels)
+            if target is not None and 1 <= target <= index + 1:
+                for inner in range(target - 1, index + 1):
+                    depths[inner] += 1
+    return depths
+
+def register_weights(program: Program, labels: dict[str, int]) -> dict[int, int]:
+    # how hot every directly named register is, each use counts 8 times more per enclosing loop
+    weights: dict[int, int] = {}
+    for instruction, depth in zip(program, loop_depths(program, labels)):
+        for register in static_registers(instruction):
+            weights[register] = weights.get(register, 0) + 8 ** min(depth, 8)
+    return weights
@@ -1,7 +1,12 @@
+import itertools
 import string
+from typing import Callable, Optional
 
-from .instruction import Read
+from .instruction import Program, Read
 from .interpreter import Interpreter
+from .history import ExecutionHistory
+from .breakpoints import Breakpoints
+from .parse_program import ProgramParser
 import curses
 
 class Tui:
@@ -10,6 +15,8 @@ class Tui:
         self.input_win: curses.window = None
         self.code_view_win: curses.window = None
         self.detail_win: curses.window = None
+        # lines currently on screen per window, only the ones that differ get redrawn
+        self.drawn_lines: dict[str, list[str]] = { "code": [], "detail": [] }
 
         self._init_tui()
 
@@ -50,28 +57,29 @@ class Tui:
         self.input_win.addstr(1, 1, message)
         self.input_win.noutrefresh()
 
-    def draw_code_window(self, code):
-        self.code_win.clear()
-        self.code_win.box()
-        for i, line in enumerate(code.splitlines()):
-            if i >= self.get_code_window_height():
-                break
-            self.code_win.addstr(i + 1, 1, line)
-        self.code_win.noutrefresh()
+    def _draw_lines(self, name: str, window, lines: list[str], height: int):
+        # rewrites only the rows that changed since the last draw, the box stays untouched
+        width = window.getmaxyx()[1] - 2
+        drawn = self.drawn_lines[name]
+        lines = [line.expandtabs(8)[:width] for line in lines[:height]]
+        for i in range(max(len(lines), len(drawn))):
+            line = lines[i] if i < len(lines) else ""
+            if i < len(drawn) and drawn[i] == line:
+                continue
+            window.addstr(i + 1, 1, line.ljust(width))
+        self.drawn_lines[name] = lines
+        window.noutrefresh()
+
+    def draw_code_window(self, code: list[str]):
+        self._draw_lines("code", self.code_win, code, self.get_code_window_height())
 
     def get_code_window_height(self):
         return curses.LINES - self.PREVIEW_WINDOW_HEIGHT - 2
     
     get_detail_window_height = get_code_window_height
 
-    def draw_detail_window(self, detail):
-        self.detail_win.clear()
-        self.detail_win.box()
-        for i, line in enumerate(detail.splitlines()):
-            if i >= self.get_detail_window_height():
-                break
-            self.detail_win.addstr(i + 1, 1, line)
-        self.detail_win.noutrefresh()
+    def draw_detail_window(self, detail: str):
+        self._draw_lines("detail", self.detail_win, detail.splitlines(), self.get_detail_window_height())
 
 
     def draw_info_bar(self, message):
@@ -96,41 +104,87 @@ class Tui:
             self.detail_win.resize(curses.LINES - 6, curses.COLS // 2)
             self.detail_win.mvwin(2, curses.COLS // 2)
             self.detail_win.box()
+            # everything has to be drawn again
+            for window in (self.code_win, self.detail_win):
+                window.erase()
+                window.box()
+            self.drawn_lines = { name: [] for name in self.drawn_lines }
         curses.doupdate()
         self.screen.refresh()
 
+class CodeView:
+    # instruction strings are formatted once, on first display, and rendering only slices the visible window
+    CONTEXT_LINES = 3 # instructions shown above the instruction pointer
+
+    def __init__(self, program: Program):
+        self.program = program
+        self.lines: list[Optional[str]] = [None] * len(program)
+
+    def _line(self, index: int) -> str:
+        line = self.lines[index]
+        if line is None:
+            line = self.lines[index] = str(self.program[index])
+        return line
+
+    def render(self, instruction_pointer: int, height: int) -> list[str]:
+        first = max(1, min(instruction_pointer, len(self.program)) - self.CONTEXT_LINES)
+        last = min(len(self.program), first + height - 1)
+        return ["{}{}\t{}".format(ip, " >" if ip == instruction_pointer else "", self._line(ip - 1)) for ip in range(first, last + 1)]
+
 class Debugger:
-    def __init__(self, interpretet: Interpreter):
+    def __init__(self, interpretet: Interpreter, input_fn: Optional[Callable[[], int]] = None
+                 , snapshot_interval: int = ExecutionHistory.DEFAULT_SNAPSHOT_INTERVAL
+                 , history_limit: int = ExecutionHistory.DEFAULT_MAX_UNDO_ENTRIES):
         self.interpreter: Interpreter = interpretet
-        self.breakpoints: list[int] = []
+        self.breakpoints = Breakpoints(interpretet)
+        self.history = ExecutionHistory(interpretet, snapshot_interval, history_limit)
 
         self.tui = Tui()
+        self.code_view = CodeView(interpretet.program)
+
+        # Read takes values from here when set (e.g. an io_channels.TokenInput), otherwise it prompts
+        self.input_fn = input_fn
 
-        self.program_output: list[int] = []
+    @property
+    def program_output(self) -> list[int]:
+        return self.history.output
 
     def _create_info(self) -> str:
         info = ""
         info += "Instruction pointer: {}\n".format(self.interpreter.instruction_pointer)
-        info += "Breakpoints: {}\n".format(self.breakpoints)
+        info += "Step: {}\n".format(self.history.step_count)
+        info += "Breakpoints: {}\n".format(", ".join(self.breakpoints.describe()))
+        info += "Watched: {}\n".format(", ".join("{} = {}".format(description, self.interpreter.registers.get(register)) for register, description in self.breakpoints.watched.items()))
         info += "Program output: {}\n".format(self.program_output)
         return info
 
     def _run_debugger(self, input_fn, output_fn):
-        if self.interpreter.instruction_pointer in self.breakpoints:
-            self.interpreter.step(input_fn=input_fn, output_fn=output_fn)
-
-        while not self.interpreter.instruction_pointer in self.breakpoints \
-              and self.interpreter.instruction_pointer < len(self.interpreter.program):
-            
-            self.interpreter.step(input_fn=input_fn, output_fn=output_fn)
+        self.history.run_to_breakpoint(self.breakpoints, input_fn, output_fn, self.breakpoints.watched)
+
+    def _breakpoint_index(self, argument: str) -> int:
+        if not argument.isnumeric():
+            return self.interpreter.labels[argument]
+        return int(argument)
+
+    def _watch_register(self, argument: str) -> Optional[int]:
+        # R7 is register 7, [R2] the register R2 points to at the moment
+        argument = argument.strip()
+        indirect = argument.startswith("[") and argument.endswith("]")
+        if indirect:
+            argument = argument[1:-1].strip()
+        if not (argument.startswith("R") and argument[1:].isnumeric()):
+            return None
+        register = int(argument[1:])
+        return self.interpreter.registers.get(register) if indirect else register
 
     def _memory_view(self, start_register = 0) -> str:
         memory_view = ""
-        if start_register < 0 or start_register >= len(self.interpreter.registers):
+        if start_register < 0:
             return "Invalid register"
-        
-        for i in range(start_register, len(self.interpreter.registers)):
-            memory_view += "R{}:\t {}\n".format(i, self.interpreter.registers[i])
+
+        # only as many registers as fit the window, of the dense region and allocated pages (unset registers are all zero)
+        for register, value in itertools.islice(self.interpreter.registers.populated(start_register), self.tui.get_detail_window_height()):
+            memory_view += "R{}:\t {}\n".format(register, value)
         return memory_view
     
     def _help(self) -> str:
@@ -138,8 +192,14 @@ class Debugger:
         help += "Commands:\n"
         help += "  run: Run the program until the next breakpoint\n"
         help += "  step: Step through the program\n"
+        help += "  reverse-step (rs): Step back one instruction\n"
+        help += "  reverse-continue (rc): Run backwards to the previous breakpoint\n"
+        help += "  goto-step <number> (g): Go to the given step, forwards or backwards\n"
         help += "  break <numbers>: Set a breakpoints at the given line\n"
+        help += "  break <number> if <condition>: Set a breakpoint stopping only when the condition holds, e.g. break 5 if R3 > 100\n"
         help += "  delete <numbers>: Delete the given breakpoints\n"
+        help += "  watch <register>: Stop run when R7 changes, [R2] watches the register R2 points to now\n"
+        help += "  unwatch <register>: Stop watching the register\n"
         help += "  memory <registers>: View the memory starting at the given register (default is 0)\n"
         help += "  reset: Reset the program\n"
         help += "  help: Show this help message\n"
@@ -153,18 +213,18 @@ class Debugger:
         
         def input_fn():
             nonlocal detail_view_fn
+            if self.input_fn is not None:
+                return self.input_fn()
             detail_view_fn = None
             self.tui.draw_detail_window("Waiting for input")
             self.tui.update()
             return int(self.tui.get_input())
                 
         def output_fn(value):
-            nonlocal current_details
-            self.program_output.append(value)
-            current_details = self._create_info()
+            nonlocal detail_view_fn
+            detail_view_fn = self._create_info
         def get_code_view():
-            # python go brr
-            return "\n".join(["{}\t{}".format(i + self.interpreter.instruction_pointer , str(line)) if not i == 0 else "{} >\t{}".format(i + self.interpreter.instruction_pointer , str(line)) for i, line in enumerate(self.interpreter.program[self.interpreter.instruction_pointer - 1:])])
+            return self.code_view.render(self.interpreter.instruction_pointer, self.tui.get_code_window_height())
 
         current_code = get_code_view()
 
@@ -181,9 +241,38 @@ class Debugger:
             if command == "":
                 command = last_command
 
-            if command.startswith("reset") or command.startswith("re"):
-                self.interpreter.reset()
-                self.program_output = []
+            if command.startswith("reverse-step") or command == "rs":
+                self.history.reverse_step(input_fn, output_fn)
+                current_code = get_code_view()
+
+
+
+            elif command.startswith("reverse-continue") or command == "rc":
+                self.history.reverse_continue(self.breakpoints, input_fn, output_fn)
+                current_code = get_code_view()
+
+
+
+            elif command.startswith("goto-step") or command[0] == "g":
+                splitted = command.split(" ")
+                if len(splitted) < 2 or not splitted[1].isnumeric():
+                    detail_view_fn = None
+                    current_details = "Missing step number"
+                    continue
+                self.history.goto(int(splitted[1]), input_fn, output_fn)
+                current_code = get_code_view()
+
+
+
+            elif command.startswith("rev"):
+                # a mistyped reverse-step / reverse-continue must not fall through to reset or run and lose the history
+                detail_view_fn = None
+                current_details = "Unknown command \"{}\"".format(command)
+
+
+
+            elif command == "reset" or command == "re":
+                self.history.reset()
                 current_code = get_code_view()
                 detail_view_fn = self._create_info
 
@@ -208,12 +297,16 @@ class Debugger:
                     continue
                 detail_view_fn = self._create_info
 
-                for i in range(1, len(splitted)):
-                    if not splitted[i].isnumeric():
-                        breakpoint = self.interpreter.labels[splitted[i]]
-                    else:
-                        breakpoint = int(splitted[i])
-                    self.breakpoints.append(breakpoint)
+                if len(splitted) > 2 and splitted[2] == "if":
+                    condition = ProgramParser.parse_condition(" ".join(splitted[3:]))
+                    if condition is None:
+                        detail_view_fn = None
+                        current_details = "Invalid condition \"{}\"".format(" ".join(splitted[3:]))
+                        continue
+                    self.breakpoints.add(self._breakpoint_index(splitted[1]), condition)
+                else:
+                    for i in range(1, len(splitted)):
+                        self.breakpoints.add(self._breakpoint_index(splitted[i]))
 
 
 
@@ -226,13 +319,31 @@ class Debugger:
 
                 detail_view_fn = self._create_info
                 for i in range(1, len(splitted)):
-                    breakpoint = int(splitted[i])
-                    self.breakpoints.remove(breakpoint)
+                    self.breakpoints.remove(self._breakpoint_index(splitted[i]))
+
+
+
+            elif command.startswith("watch") or command[0] == "w" \
+                 or command.startswith("unwatch") or command[0] == "u":
+                splitted = command.split(" ", 1)
+                register = self._watch_register(splitted[1]) if len(splitted) == 2 else None
+                if register is None:
+                    detail_view_fn = None
+                    current_details = "Expected a register like R7 or [R2]"
+                    continue
+                detail_view_fn = self._create_info
+                if command[0] == "w":
+                    description = splitted[1].strip()
+                    if description.startswith("["):
+                        description += " (R{})".format(register)
+                    self.breakpoints.watch(register, description)
+                else:
+                    self.breakpoints.unwatch(register)
 
 
 
             elif command.startswith("step") or command[0] == "s":
-                self.interpreter.step(input_fn=input_fn, output_fn=output_fn)
+                self.history.step(input_fn, output_fn)
                 current_code = get_code_view()
 
 
@@ -0,0 +1,237 @@
+from array import array
+from typing import Iterable, Iterator, Optional, Sequence
+
+from .instruction import *
+from . import control_flow
+
+# instruction kinds, the opcode is kind << 3 | variant (the Op or Rel value)
+LABEL = 0 # A: label index
+SET_VALUE = 1 # A: target, C: value
+SET_REGISTER = 2 # A: target, B: source
+SET_REG_OP_CONST = 3 # A: target, B: source, C: value
+SET_REG_OP_REG = 4 # A: target, B: first source, C: second source
+LOAD = 5 # A: target, B: source
+STORE = 6 # A: target (address register), B: source
+GOTO_LABEL = 7 # C: label index
+GOTO_INSTRUCTION = 8 # C: instruction
+IF_CONST_GOTO_LABEL = 9 # A: register, B: value, C: label index
+IF_REGISTER_GOTO_LABEL = 10 # A: first register, B: second register, C: label index
+IF_CONST_GOTO_INSTRUCTION = 11 # A: register, B: value, C: instruction
+IF_REGISTER_GOTO_INSTRUCTION = 12 # A: first register, B: second register, C: instruction
+READ = 13 # A: target
+WRITE = 14 # A: source
+HALT = 15
+WIDE = 16 # A: index into the wide instructions, an operand does not fit in 64 bits
+
+LABEL_JUMPS = (GOTO_LABEL, IF_CONST_GOTO_LABEL, IF_REGISTER_GOTO_LABEL)
+INSTRUCTION_JUMPS = (GOTO_INSTRUCTION, IF_CONST_GOTO_INSTRUCTION, IF_REGISTER_GOTO_INSTRUCTION)
+NO_TARGET = -1 # target column of instructions that do not jump, or jump to an unknown label
+
+# how many of A, B, C (in this order) are directly named registers
+REGISTER_OPERANDS = [0, 1, 2, 2, 3, 2, 2, 0, 0, 1, 2, 1, 2, 1, 1, 0, 0]
+
+OPS = list(Op)
+RELS = list(Rel)
+
+class EncodedProgram:
+    # a program as parallel int64 columns instead of a list of instruction objects, about 40 bytes an instruction
+    # indexing and iterating it gives the usual instruction classes, built on the fly, so it can stand in for a Program
+    # everything reading a program only (interpreter, compilers, debugger, analyses) takes it as is
+    def __init__(self):
+        self.opcodes = array('q')
+        self.a = array('q')
+        self.b = array('q')
+        self.c = array('q')
+        self._targets = array('q')
+        self.label_names: list[str] = []
+        self.label_indices: dict[str, int] = {}
+        self.wide: list[Instruction] = []
+        self._resolved = True
+
+    @classmethod
+    def from_instructions(cls, program: Iterable[Instruction]) -> "EncodedProgram":
+        encoded = cls()
+        for instruction in program:
+            encoded.append(instruction)
+        return encoded
+
+    @classmethod
+    def from_columns(cls, opcodes: Sequence[int], a: Sequence[int], b: Sequence[int], c: Sequence[int], targets: Sequence[int]
+                     , label_names: list[str], wide: list[Instruction]) -> "EncodedProgram":
+        # columns as they were written by an earlier encoding (resolved targets included), memory mapped ones are not copied
+        encoded = cls()
+        encoded.opcodes, encoded.a, encoded.b, encoded.c, encoded._targets = opcodes, a, b, c, targets
+        encoded.label_names = label_names
+        encoded.label_indices = { label: index for index, label in enumerate(label_names) }
+        encoded.wide = wide
+        return encoded
+
+    def __getstate__(self) -> dict:
+        # memory mapped columns do not pickle, they are copied
+        state = dict(self.__dict__)
+        for name in ("opcodes", "a", "b", "c", "_targets"):
+            if not isinstance(state[name], array):
+                state[name] = array('q', state[name])
+        return state
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    def __bool__(self) -> bool:
+        return len(self.opcodes) > 0
+
+    def _label_index(self, label: str) -> int:
+        index = self.label_indices.get(label)
+        if index is None:
+            index = self.label_indices[label] = len(self.label_names)
+            self.label_names.append(label)
+        return index
+
+    def _push(self, opcode: int, a: int, b: int, c: int):
+        length = len(self.opcodes)
+        try:
+            self.opcodes.append(opcode)
+            self.a.append(a)
+            self.b.append(b)
+            self.c.append(c)
+            self._targets.append(NO_TARGET)
+        except OverflowError:
+            # an operand past int64, the columns stay the same length
+            for column in (self.opcodes, self.a, self.b, self.c, self._targets):
+                del column[length:]
+            raise
+
+    def append(self, instruction: Instruction):
+        encoder = FIELDS.get(type(instruction))
+        if encoder is None:
+            raise ValueError(f"Invalid instruction: {instruction}")
+        kind, variant, a, b, c = encoder(self, instruction)
+        try:
+            self._push(kind << 3 | variant, a, b, c)
+        except OverflowError:
+            self._push(WIDE << 3, len(self.wide), 0, 0)
+            self.wide.append(instruction)
+        self._resolved = False
+
+    def kind(self, index: int) -> int:
+        return self.opcodes[index] >> 3
+
+    def _decode(self, opcode: int, a: int, b: int, c: int) -> Instruction:
+        kind, variant = opcode >> 3, opcode & 7
+        if kind == LABEL:
+            return Label(self.label_names[a])
+        if kind == SET_VALUE:
+            return SetValue(a, c)
+        if kind == SET_REGISTER:
+            return SetRegister(a, b)
+        if kind == SET_REG_OP_CONST:
+            return SetRegisterRegOpConst(a, b, OPS[variant], c)
+        if kind == SET_REG_OP_REG:
+            return SetRegisterRegOpReg(a, b, OPS[variant], c)
+        if kind == LOAD:
+            return Load(a, b)
+        if kind == STORE:
+            return Store(a, b)
+        if kind == GOTO_LABEL:
+            return UnconditionalJmpToLabel(self.label_names[c])
+        if kind == GOTO_INSTRUCTION:
+            return UnconditionalJmpToInstruction(c)
+        if kind == IF_CONST_GOTO_LABEL:
+            return ConditionalJmpToLabel(ConditionWithConst(a, RELS[variant], b), self.label_names[c])
+        if kind == IF_REGISTER_GOTO_LABEL:
+            return ConditionalJmpToLabel(ConditionWithRegister(a, RELS[variant], b), self.label_names[c])
+        if kind == IF_CONST_GOTO_INSTRUCTION:
+            return ConditionalJmpToInstruction(ConditionWithConst(a, RELS[variant], b), c)
+        if kind == IF_REGISTER_GOTO_INSTRUCTION:
+            return ConditionalJmpToInstruction(ConditionWithRegister(a, RELS[variant], b), c)
+        if kind == READ:
+            return Read(a)
+        if kind == WRITE:
+            return Write(a)
+        if kind == HALT:
+            return Halt()
+        if kind == WIDE:
+            return self.wide[a]
+        raise ValueError(f"Invalid opcode: {opcode}")
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._decode(self.opcodes[index], self.a[index], self.b[index], self.c[index])
+
+    def __iter__(self) -> Iterator[Instruction]:
+        decode = self._decode
+        for opcode, a, b, c in zip(self.opcodes, self.a, self.b, self.c):
+            yield decode(opcode, a, b, c)
+
+    def labels(self) -> dict[str, int]:
+        # label -> instruction pointer, the last definition wins like in Interpreter.labels
+        names = self.label_names
+        return { names[a]: index + 1 for index, (opcode, a) in enumerate(zip(self.opcodes, self.a)) if opcode >> 3 == LABEL }
+
+    @property
+    def targets(self) -> array:
+        # jump target of every instruction, NO_TARGET for the rest, unknown labels and wide jumps
+        if not self._resolved:
+            positions = { self.label_indices[label]: target for label, target in self.labels().items() }
+            targets = self._targets
+            for index, (opcode, c) in enumerate(zip(self.opcodes, self.c)):
+                kind = opcode >> 3
+                if kind in LABEL_JUMPS:
+                    targets[index] = positions.get(c, NO_TARGET)
+                elif kind in INSTRUCTION_JUMPS:
+                    targets[index] = c
+            self._resolved = True
+        return self._targets
+
+    def rows(self) -> Iterator[tuple[int, int, int, int, int, Optional[int]]]:
+        # (kind, variant, A, B, C, jump target or None) of every instruction, a wide one with its operands as they are
+        labels = None
+        for opcode, a, b, c, target in zip(self.opcodes, self.a, self.b, self.c, self.targets):
+            kind = opcode >> 3
+            if kind == WIDE:
+                instruction = self.wide[a]
+                kind, variant, a, b, c = FIELDS[type(instruction)](self, instruction)
+                if kind in LABEL_JUMPS:
+                    labels = labels if labels is not None else self.labels()
+                    yield kind, variant, a, b, c, labels.get(instruction.label)
+                else:
+                    yield kind, variant, a, b, c, c if kind in INSTRUCTION_JUMPS else None
+            else:
+                yield kind, opcode & 7, a, b, c, None if target == NO_TARGET and kind not in INSTRUCTION_JUMPS else target
+
+    @property
+    def largest_register(self) -> int:
+        # the largest directly named register, without building any instruction
+        largest = 0
+        for opcode, a, b, c in zip(self.opcodes, self.a, self.b, self.c):
+            named = REGISTER_OPERANDS[opcode >> 3]
+            if named:
+                largest = max(largest, a, b if named > 1 else 0, c if named > 2 else 0)
+        for instruction in self.wide:
+            largest = max(largest, *control_flow.static_registers(instruction), 0)
+        return largest
+
+def _condition_fields(kind: int, condition: Union[ConditionWithConst, ConditionWithRegister], c: int) -> tuple[int, int, int, int, int]:
+    # the kinds with a register condition directly follow the ones with a constant
+    if isinstance(condition, ConditionWithConst):
+        return kind, condition.rel.value, condition.register, condition.value, c
+    return kind + 1, condition.rel.value, condition.first_register, condition.second_register, c
+
+# instruction class -> (kind, variant, A, B, C) of an instruction, label names are added to the program's label table
+FIELDS = {
+    Label: lambda program, i: (LABEL, 0, program._label_index(i.label), 0, 0),
+    SetValue: lambda program, i: (SET_VALUE, 0, i.target_register, 0, i.value),
+    SetRegister: lambda program, i: (SET_REGISTER, 0, i.target_register, i.source_register, 0),
+    SetRegisterRegOpConst: lambda program, i: (SET_REG_OP_CONST, i.op.value, i.target_register, i.source_register, i.value),
+    SetRegisterRegOpReg: lambda program, i: (SET_REG_OP_REG, i.op.value, i.target_register, i.first_source_register, i.second_source_register),
+    Load: lambda program, i: (LOAD, 0, i.target_register, i.source_register, 0),
+    Store: lambda program, i: (STORE, 0, i.target_register, i.source_register, 0),
+    UnconditionalJmpToLabel: lambda program, i: (GOTO_LABEL, 0, 0, 0, program._label_index(i.label)),
+    UnconditionalJmpToInstruction: lambda program, i: (GOTO_INSTRUCTION, 0, 0, 0, i.instruction),
+    ConditionalJmpToLabel: lambda program, i: _condition_fields(IF_CONST_GOTO_LABEL, i.condition, program._label_index(i.label)),
+    ConditionalJmpToInstruction: lambda program, i: _condition_fields(IF_CONST_GOTO_INSTRUCTION, i.condition, i.instruction),
+    Read: lambda program, i: (READ, 0, i.target_register, 0, 0),
+    Write: lambda program, i: (WRITE, 0, i.source_register, 0, 0),
+    Halt: lambda program, i: (HALT, 0, 0, 0, 0),
+}
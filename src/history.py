@@ -0,0 +1,240 @@
+from typing import Callable, Collection, Optional
+
+from .instruction import Read, Store
+from .interpreter import Interpreter
+from . import control_flow
+
+class Snapshot:
+    def __init__(self, step: int, instruction_pointer: int, registers: tuple, output_length: int, input_cursor: int):
+        self.step = step
+        self.instruction_pointer = instruction_pointer
+        self.registers = registers
+        self.output_length = output_length
+        self.input_cursor = input_cursor
+
+# (instruction pointer, written register or None, its old value, output length, input cursor), all before the step
+UndoEntry = tuple[int, Optional[int], int, int, int]
+
+class ExecutionHistory:
+    # time travel for the debugger: a register file snapshot every snapshot_interval steps plus an undo entry per step
+    # going back undoes steps, or restores the closest snapshot and replays forward, whichever is shorter
+    # read values are recorded, so replaying never asks for input again
+    DEFAULT_SNAPSHOT_INTERVAL = 1000
+    DEFAULT_MAX_UNDO_ENTRIES = 1_000_000
+    DEFAULT_MAX_SNAPSHOTS = 256
+
+    def __init__(self, interpreter: Interpreter
+                 , snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL
+                 , max_undo_entries: int = DEFAULT_MAX_UNDO_ENTRIES
+                 , max_snapshots: int = DEFAULT_MAX_SNAPSHOTS):
+        self.interpreter = interpreter
+        self.snapshot_interval = max(1, snapshot_interval)
+        self.max_undo_entries = max_undo_entries
+        self.max_snapshots = max(2, max_snapshots)
+
+        self.output: list[int] = []
+        self.inputs: list[int] = []
+        self.input_cursor: int = 0
+
+        self.undo_log: list[UndoEntry] = []
+        self.undo_start: int = self.step_count # step the first undo entry belongs to
+        self.snapshots: list[Snapshot] = [self._snapshot()]
+
+    @property
+    def step_count(self) -> int:
+        return self.interpreter.executed_instructions
+
+    def reset(self):
+        self.interpreter.reset()
+        self.output.clear()
+        self.inputs.clear()
+        self.input_cursor = 0
+        self.undo_log.clear()
+        self.undo_start = 0
+        self.snapshots = [self._snapshot()]
+
+    def _snapshot(self) -> Snapshot:
+        return Snapshot(self.step_count, self.interpreter.instruction_pointer, self.interpreter.registers.snapshot(), len(self.output), self.input_cursor)
+
+    def _restore(self, snapshot: Snapshot):
+        self.interpreter.registers.restore(snapshot.registers)
+        self.interpreter.instruction_pointer = snapshot.instruction_pointer
+        self.interpreter.executed_instructions = snapshot.step
+        del self.output[snapshot.output_length:]
+        self.input_cursor = snapshot.input_cursor
+        # the undo log has to end at the current step
+        self.undo_log.clear()
+        self.undo_start = snapshot.step
+
+    def _add_snapshot(self):
+        if self.step_count % self.snapshot_interval != 0 or self.snapshots[-1].step >= self.step_count:
+            return
+        self.snapshots.append(self._snapshot())
+        if len(self.snapshots) > self.max_snapshots:
+            # thin out to every other snapshot, the first one always stays so every step stays reachable
+            self.snapshots = self.snapshots[:1] + self.snapshots[2::2]
+            self.snapshot_interval *= 2
+
+    def _undo(self):
+        instruction_pointer, register, old_value, output_length, input_cursor = self.undo_log.pop()
+        if register is not None:
+            self.interpreter.registers.set(register, old_value)
+        self.interpreter.instruction_pointer = instruction_pointer
+        self.interpreter.executed_instructions -= 1
+        del self.output[output_length:]
+        self.input_cursor = input_cursor
+
+    def recording_io(self, input_fn: Callable[[], int], output_fn: Callable[[int], None]) -> tuple[Callable[[], int], Callable[[int], None]]:
+        # recorded inputs are replayed before input_fn is asked, written values land in self.output too
+        def read() -> int:
+            if self.input_cursor < len(self.inputs):
+                value = self.inputs[self.input_cursor]
+            else:
+                value = int(input_fn())
+                self.inputs.append(value)
+            self.input_cursor += 1
+            return value
+
+        def write(value: int):
+            self.output.append(value)
+            output_fn(value)
+
+        return read, write
+
+    def step(self, input_fn: Callable[[], int], output_fn: Callable[[int], None]) -> Interpreter.Halt:
+        interpreter = self.interpreter
+        if interpreter.instruction_pointer > len(interpreter.program):
+            return True
+
+        self._add_snapshot()
+        register = interpreter.written_register()
+        old_value = interpreter.registers.get(register) if register is not None else 0
+        entry = (interpreter.instruction_pointer, register, old_value, len(self.output), self.input_cursor)
+
+        read, write = self.recording_io(input_fn, output_fn)
+        try:
+            halted = interpreter.step(input_fn=read, output_fn=write)
+        except BaseException:
+            # nothing was executed, keep the step count in line with the undo log
+            interpreter.executed_instructions = self.undo_start + len(self.undo_log)
+            self.input_cursor = entry[4]
+            raise
+
+        self.undo_log.append(entry)
+        if len(self.undo_log) > self.max_undo_entries:
+            dropped = len(self.undo_log) - self.max_undo_entries * 3 // 4
+            del self.undo_log[:dropped]
+            self.undo_start += dropped
+        return halted
+
+    # flags of stops[instruction pointer] in run_to_breakpoint
+    BREAKPOINT = 1
+    READ = 2
+    WATCH = 4
+
+    def run_to_breakpoint(self, breakpoints: Collection[int], input_fn: Callable[[], int], output_fn: Callable[[int], None]
+                          , watched: Collection[int] = ()) -> Interpreter.Halt:
+        # runs the decoded handlers directly until a breakpoint, a change of a watched register, a halt or the end of the program
+        # no undo entries are recorded on the way, only snapshots, so going back replays from the closest snapshot
+        # only instructions marked in stops leave the fast loop and go through step(): breakpoints (`in breakpoints` decides
+        # whether a conditional one stops), Reads so their values are recorded for replays, and instructions that may write
+        # a watched register, so unwatched registers cost nothing
+        interpreter = self.interpreter
+        handlers = interpreter.handlers
+        program_length = len(handlers)
+        stops = bytearray(program_length + 2)
+        for index, instruction in enumerate(interpreter.program):
+            if isinstance(instruction, Read):
+                stops[index + 1] |= self.READ
+            if watched and (isinstance(instruction, Store) or control_flow.written_register(instruction) in watched):
+                stops[index + 1] |= self.WATCH
+        for breakpoint in breakpoints:
+            if 1 <= breakpoint <= program_length:
+                stops[breakpoint] |= self.BREAKPOINT
+        read, write = self.recording_io(input_fn, output_fn)
+        get_register = interpreter.registers.get
+
+        leaving = True # the breakpoint we are sitting on does not stop us again
+        while True:
+            instruction_pointer = interpreter.instruction_pointer
+            if instruction_pointer > program_length:
+                return True
+            stop = stops[instruction_pointer]
+            if stop & self.BREAKPOINT and not leaving and instruction_pointer in breakpoints:
+                return False
+            leaving = False
+            if stop:
+                register = interpreter.written_register() if stop & self.WATCH else None
+                watching = register in watched
+                old_value = get_register(register) if watching else 0
+                if self.step(input_fn, output_fn):
+                    return True
+                if watching and get_register(register) != old_value:
+                    return False
+                continue
+
+            # one chunk up to the next snapshot step
+            self._add_snapshot()
+            budget = self.snapshot_interval - self.step_count % self.snapshot_interval
+            executed = 0
+            halted = False
+            try:
+                while executed < budget:
+                    next_ip = handlers[instruction_pointer - 1](read, write)
+                    executed += 1
+                    if next_ip is None:
+                        halted = True
+                        break
+                    instruction_pointer = next_ip
+                    if instruction_pointer > program_length or stops[instruction_pointer]:
+                        break
+            finally:
+                interpreter.instruction_pointer = instruction_pointer
+                interpreter.executed_instructions += executed
+                self.undo_log.clear()
+                self.undo_start = self.step_count
+            if halted:
+                return True
+
+    def _closest_snapshot(self, step: int) -> Snapshot:
+        return max((snapshot for snapshot in self.snapshots if snapshot.step <= step), key=lambda snapshot: snapshot.step)
+
+    def goto(self, target_step: int, input_fn: Callable[[], int], output_fn: Callable[[int], None]):
+        target_step = max(0, target_step)
+        if target_step < self.step_count:
+            snapshot = self._closest_snapshot(target_step)
+            if target_step >= self.undo_start and self.step_count - target_step <= target_step - snapshot.step:
+                while self.step_count > target_step:
+                    self._undo()
+                return
+            self._restore(snapshot)
+
+        while self.step_count < target_step:
+            if self.step(input_fn, output_fn):
+                break
+
+    def reverse_step(self, input_fn: Callable[[], int], output_fn: Callable[[int], None]):
+        self.goto(self.step_count - 1, input_fn, output_fn)
+
+    def reverse_continue(self, breakpoints: Collection[int], input_fn: Callable[[], int], output_fn: Callable[[int], None]):
+        # back to the latest earlier step sitting on a breakpoint, or to the start
+        while self.step_count > self.undo_start:
+            self._undo()
+            if self.interpreter.instruction_pointer in breakpoints:
+                return
+
+        # past the undo log, replay the snapshot intervals backwards looking for the last breakpoint hit
+        end = self.step_count
+        for snapshot in sorted((snapshot for snapshot in self.snapshots if snapshot.step < end), key=lambda snapshot: snapshot.step, reverse=True):
+            self._restore(snapshot)
+            hits = []
+            while self.step_count < end:
+                if self.interpreter.instruction_pointer in breakpoints:
+                    hits.append(self.step_count)
+                if self.step(input_fn, output_fn):
+                    break
+            if hits:
+                self.goto(hits[-1], input_fn, output_fn)
+                return
+            end = snapshot.step
+        self.goto(0, input_fn, output_fn)
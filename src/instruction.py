@@ -80,6 +80,8 @@ Register = int
 Value = int
 
 class SetValue:
+    __slots__ = ("target_register", "value")
+
     def __init__(self, target_register: Register, value: Value):
         assert isinstance(target_register, int)
         assert isinstance(value, int)
@@ -93,6 +95,8 @@ class SetValue:
         return f"R{self.target_register} := {self.value}"
 
 class SetRegister:
+    __slots__ = ("target_register", "source_register")
+
     def __init__(self, target_register: Register, source_register: Register):
         assert isinstance(target_register, int)
         assert isinstance(source_register, int)
@@ -106,6 +110,8 @@ class SetRegister:
         return f"R{self.target_register} := R{self.source_register}"
     
 class SetRegisterRegOpConst:
+    __slots__ = ("target_register", "source_register", "op", "value")
+
     def __init__(self, target_register: Register, source_register: Register, op: Op, value: Value):
         assert isinstance(target_register, int)
         assert isinstance(source_register, int)
@@ -123,6 +129,8 @@ class SetRegisterRegOpConst:
         return f"R{self.target_register} := R{self.source_register} {self.op} {self.value}"
 
 class SetRegisterRegOpReg:
+    __slots__ = ("target_register", "first_source_register", "op", "second_source_register")
+
     def __init__(self, target_register: Register, first_source_register: Register, op: Op, second_source_register: Register):
         assert isinstance(target_register, int)
         assert isinstance(first_source_register, int)
@@ -139,6 +147,8 @@ class SetRegisterRegOpReg:
     def __str__(self):
         return f"R{self.target_register} := R{self.first_source_register} {self.op} R{self.second_source_register}"
 class Load:
+    __slots__ = ("target_register", "source_register")
+
     def __init__(self, target_register: Register, source_register: Register):
         assert isinstance(target_register, int)
         assert isinstance(source_register, int)
@@ -152,6 +162,8 @@ class Load:
         return f"R{self.target_register} := [R{self.source_register}]"
     
 class Store:
+    __slots__ = ("target_register", "source_register")
+
     def __init__(self, target_register: Register, source_register: Register):
         assert isinstance(target_register, int)
         assert isinstance(source_register, int)
@@ -166,6 +178,8 @@ class Store:
     
 
 class UnconditionalJmpToLabel:
+    __slots__ = ("label",)
+
     def __init__(self, label: str):
         assert isinstance(label, str)
         self.label = label
@@ -177,6 +191,8 @@ class UnconditionalJmpToLabel:
         return f"goto {self.label}"
     
 class UnconditionalJmpToInstruction:
+    __slots__ = ("instruction",)
+
     def __init__(self, instruction: int):
         assert isinstance(instruction, int)
         self.instruction = instruction
@@ -188,6 +204,8 @@ class UnconditionalJmpToInstruction:
         return f"goto {self.instruction}"
     
 class ConditionWithRegister:
+    __slots__ = ("first_register", "rel", "second_register")
+
     def __init__(self, first_register: Register, rel: Rel, second_register: Register):
         assert isinstance(first_register, int)
         assert isinstance(rel, Rel)
@@ -203,6 +221,8 @@ class ConditionWithRegister:
         return f"R{self.first_register} {self.rel} R{self.second_register}"
     
 class ConditionWithConst:
+    __slots__ = ("register", "rel", "value")
+
     def __init__(self, register: Register, rel: Rel, value: Value):
         assert isinstance(register, int)
         assert isinstance(rel, Rel)
@@ -218,6 +238,8 @@ class ConditionWithConst:
         return f"R{self.register} {self.rel} {self.value}"
     
 class ConditionalJmpToLabel:
+    __slots__ = ("condition", "label")
+
     def __init__(self, condition: Union[ConditionWithRegister, ConditionWithConst], label: str):
         assert isinstance(condition, ConditionWithRegister) or isinstance(condition, ConditionWithConst)
         assert isinstance(label, str)
@@ -231,6 +253,8 @@ class ConditionalJmpToLabel:
         return f"if ({self.condition}) goto {self.label}"
     
 class ConditionalJmpToInstruction:
+    __slots__ = ("condition", "instruction")
+
     def __init__(self, condition: Union[ConditionWithRegister, ConditionWithConst], instruction: int):
         assert isinstance(condition, ConditionWithRegister) or isinstance(condition, ConditionWithConst)
         assert isinstance(instruction, int)
@@ -244,6 +268,8 @@ class ConditionalJmpToInstruction:
         return f"if ({self.condition}) goto {self.instruction}"
 
 class Read:
+    __slots__ = ("target_register",)
+
     def __init__(self, target_register: Register):
         assert isinstance(target_register, int)
         self.target_register = target_register
@@ -255,6 +281,8 @@ class Read:
         return f"R{self.target_register} := read()"
     
 class Write:
+    __slots__ = ("source_register",)
+
     def __init__(self, source_register: Register):
         assert isinstance(source_register, int)
         self.source_register = source_register
@@ -266,6 +294,8 @@ class Write:
         return f"write(R{self.source_register})"
     
 class Halt:
+    __slots__ = ()
+
     def __repr__(self):
         return f"Halt()"
     
@@ -273,6 +303,8 @@ class Halt:
         return f"halt"
 
 class Label:
+    __slots__ = ("label",)
+
     def __init__(self, label: str):
         assert isinstance(label, str)
         self.label = label
@@ -1,54 +1,82 @@
+import gc
+import operator
+from typing import Callable, MutableSequence, Optional
+
 from .instruction import *
+from .encoded_program import EncodedProgram
+from . import encoded_program as encoded
+from .registers import RegisterFile, Int64RegisterFile, wrap_int64, div_int64
+from . import control_flow
+
+# handler(input_fn, output_fn) -> next instruction pointer, None means halt
+Handler = Callable[[Callable, Callable], Optional[int]]
 
 class Interpreter:
-    def __init__(self, program: Program):
-        self.program: Program = program
+    OPERATIONS: dict[Op, Callable[[int, int], int]] = {
+        Op.ADD: operator.add,
+        Op.SUB: operator.sub,
+        Op.MUL: operator.mul,
+        Op.DIV: operator.floordiv,
+    }
+
+    # fixed width mode matching the int64_t registers of the compiled backends
+    INT64_OPERATIONS: dict[Op, Callable[[int, int], int]] = {
+        Op.ADD: lambda a, b: wrap_int64(a + b),
+        Op.SUB: lambda a, b: wrap_int64(a - b),
+        Op.MUL: lambda a, b: wrap_int64(a * b),
+        Op.DIV: div_int64,
+    }
+
+    RELATIONS: dict[Rel, Callable[[int, int], bool]] = {
+        Rel.LT: operator.lt,
+        Rel.GT: operator.gt,
+        Rel.LE: operator.le,
+        Rel.GE: operator.ge,
+        Rel.EQ: operator.eq,
+        Rel.NE: operator.ne,
+    }
+
+    WORD_SIZES = (64,)
+
+    def __init__(self, program: Union[Program, EncodedProgram], registers: Optional[RegisterFile] = None, word_size: Optional[int] = None):
+        if word_size is not None and word_size not in self.WORD_SIZES:
+            raise ValueError(f"Unsupported word size: {word_size}")
+
+        self.program: Union[Program, EncodedProgram] = program
+        self.word_size: Optional[int] = word_size
+        self.operations: dict[Op, Callable[[int, int], int]] = self.OPERATIONS if word_size is None else self.INT64_OPERATIONS
         self.instruction_pointer: int = 1 # instruction are counted from 1
-        self.registers: list[int] = [0] * 100
-        self.labels: dict[str, int] = { instruction.label: index + 1 for index, instruction in enumerate(program) if isinstance(instruction, Label) }
+        self.executed_instructions: int = 0
+        if registers is None:
+            registers = RegisterFile() if word_size is None else Int64RegisterFile()
+        self.registers: RegisterFile = registers
+        if isinstance(program, EncodedProgram):
+            self.labels: dict[str, int] = program.labels()
+        else:
+            self.labels: dict[str, int] = { instruction.label: index + 1 for index, instruction in enumerate(program) if isinstance(instruction, Label) }
+        self.handlers: list[Handler] = self._decode()
 
     Halt = bool
 
     def _set_register(self, target_register: int, value: int):
-        if len(self.registers) <= target_register:
-            self.registers += [0] * (target_register - len(self.registers) + 1)
-
-        self.registers[target_register] = value
+        self.registers.set(target_register, value)
 
     def _get_register(self, register: int) -> int:
-        if len(self.registers) <= register:
-            self.registers += [0] * (register - len(self.registers) + 1)
+        return self.registers.get(register)
+
+    def _wrap(self, value: int) -> int:
+        return value if self.word_size is None else wrap_int64(value)
 
-        return self.registers[register]
-    
     def _apply_operation(self, operation: Op, a: int, b: int) -> int:
-        if operation == Op.ADD:
-            return a + b
-        elif operation == Op.SUB:
-            return a - b
-        elif operation == Op.MUL:
-            return a * b
-        elif operation == Op.DIV:
-            return a // b
-        
-        raise ValueError(f"Invalid operation: {operation}")
-    
+        if operation not in self.operations:
+            raise ValueError(f"Invalid operation: {operation}")
+        return self.operations[operation](a, b)
+
     def _apply_relation(self, relation: Rel, a: int, b: int) -> bool:
-        if relation == Rel.LT:
-            return a < b
-        elif relation == Rel.GT:
-            return a > b
-        elif relation == Rel.LE:
-            return a <= b
-        elif relation == Rel.GE:
-            return a >= b
-        elif relation == Rel.EQ:
-            return a == b
-        elif relation == Rel.NE:
-            return a != b
-        
-        raise ValueError(f"Invalid relation: {relation}")
-    
+        if relation not in self.RELATIONS:
+            raise ValueError(f"Invalid relation: {relation}")
+        return self.RELATIONS[relation](a, b)
+
     def _apply_condition(self, condition: Union[ConditionWithConst, ConditionWithRegister] ) -> bool:
         if isinstance(condition, ConditionWithConst):
             return self._apply_relation(condition.rel, self._get_register(condition.register), condition.value)
@@ -57,60 +85,184 @@ class Interpreter:
         else:
             raise ValueError(f"Invalid condition: {condition}")
 
-    def run(self):
-        while self.instruction_pointer < len(self.program):
-            if self.step():
-                break
+    def _decode(self) -> list[Handler]:
+        # handlers are built from the encoded columns, a list of instructions is encoded first
+        program = self.program if isinstance(self.program, EncodedProgram) else EncodedProgram.from_instructions(self.program)
+        # registers named in the program go to the dense region, so handlers can index it directly,
+        # up to RegisterFile.MAX_DENSE_SIZE, handlers naming a higher one go through the pages
+        self.largest_register = program.largest_register
+        self.registers.reserve(self.largest_register + 1)
+
+        # a closure per instruction and no cycles among them, collecting while they pile up only costs time
+        label_names = program.label_names
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return [self._decode_instruction(index + 1, row, label_names) for index, row in enumerate(program.rows())]
+        finally:
+            if collecting:
+                gc.enable()
+
+    def decode_condition(self, condition: Union[ConditionWithConst, ConditionWithRegister]) -> Callable[[], bool]:
+        if isinstance(condition, ConditionWithConst):
+            return self._decode_relation(condition.rel, condition.register, condition.value, True)
+        elif isinstance(condition, ConditionWithRegister):
+            return self._decode_relation(condition.rel, condition.first_register, condition.second_register, False)
+        else:
+            raise ValueError(f"Invalid condition: {condition}")
+
+    def _indexable(self, *registers: int) -> MutableSequence[int]:
+        # the dense list when it holds all of registers, otherwise the register file, indexing it gets / sets through the pages
+        dense = self.registers.dense
+        return dense if max(registers) < len(dense) else self.registers
+
+    def _decode_relation(self, rel: Rel, register: int, other: int, with_const: bool) -> Callable[[], bool]:
+        regs = self._indexable(register, 0 if with_const else other)
+        relation = self.RELATIONS[rel]
+        if with_const:
+            return lambda: relation(regs[register], other)
+        return lambda: relation(regs[register], regs[other])
+
+    def _decode_instruction(self, instruction_pointer: int, row: tuple, label_names: list[str]) -> Handler:
+        # row is (kind, variant, A, B, C, jump target) as EncodedProgram.rows gives it
+        # static registers go straight to the dense list, Load/Store go through the register file
+        kind, variant, a, b, c, jump_target = row
+        regs = self._indexable(0, *(a, b, c)[:encoded.REGISTER_OPERANDS[kind]])
+        get, set_ = self.registers.get, self.registers.set
+        next_ip = instruction_pointer + 1
+
+        if kind == encoded.LABEL:
+            def handler(input_fn, output_fn):
+                return next_ip
+        elif kind == encoded.SET_VALUE:
+            target, value = a, self._wrap(c)
+            def handler(input_fn, output_fn):
+                regs[target] = value
+                return next_ip
+        elif kind == encoded.SET_REGISTER:
+            target, source = a, b
+            def handler(input_fn, output_fn):
+                regs[target] = regs[source]
+                return next_ip
+        elif kind == encoded.SET_REG_OP_CONST:
+            operation = self.operations[encoded.OPS[variant]]
+            target, source, value = a, b, c
+            def handler(input_fn, output_fn):
+                regs[target] = operation(regs[source], value)
+                return next_ip
+        elif kind == encoded.SET_REG_OP_REG:
+            operation = self.operations[encoded.OPS[variant]]
+            target, first, second = a, b, c
+            def handler(input_fn, output_fn):
+                regs[target] = operation(regs[first], regs[second])
+                return next_ip
+        elif kind == encoded.LOAD:
+            target, source = a, b
+            def handler(input_fn, output_fn):
+                regs[target] = get(regs[source])
+                return next_ip
+        elif kind == encoded.STORE:
+            target, source = a, b
+            def handler(input_fn, output_fn):
+                set_(regs[target], regs[source])
+                return next_ip
+        elif kind in (encoded.GOTO_LABEL, encoded.GOTO_INSTRUCTION):
+            if jump_target is None:
+                label = label_names[c]
+                def handler(input_fn, output_fn):
+                    raise KeyError(label)
+            else:
+                def handler(input_fn, output_fn):
+                    return jump_target
+        elif kind in (encoded.IF_CONST_GOTO_LABEL, encoded.IF_REGISTER_GOTO_LABEL, encoded.IF_CONST_GOTO_INSTRUCTION, encoded.IF_REGISTER_GOTO_INSTRUCTION):
+            condition = self._decode_relation(encoded.RELS[variant], a, b, kind in (encoded.IF_CONST_GOTO_LABEL, encoded.IF_CONST_GOTO_INSTRUCTION))
+            if jump_target is None:
+                label = label_names[c]
+                def handler(input_fn, output_fn):
+                    if condition():
+                        raise KeyError(label)
+                    return next_ip
+            else:
+                def handler(input_fn, output_fn):
+                    return jump_target if condition() else next_ip
+        elif kind == encoded.READ:
+            target = a
+            if self.word_size is None:
+                def handler(input_fn, output_fn):
+                    regs[target] = int(input_fn())
+                    return next_ip
+            else:
+                def handler(input_fn, output_fn):
+                    regs[target] = wrap_int64(int(input_fn()))
+                    return next_ip
+        elif kind == encoded.WRITE:
+            source = a
+            def handler(input_fn, output_fn):
+                output_fn(regs[source])
+                return next_ip
+        elif kind == encoded.HALT:
+            def handler(input_fn, output_fn):
+                return None
+        else:
+            raise ValueError(f"Invalid instruction kind: {kind}")
+
+        return handler
+
+    def run(self, input_fn = input, output_fn = print, max_steps: Optional[int] = None) -> bool:
+        # True once the program halted or ran past its end, False when it was stopped after max_steps instructions
+        handlers = self.handlers
+        program_length = len(handlers)
+        instruction_pointer = self.instruction_pointer
+        executed = 0
+        try:
+            if max_steps is None:
+                # the loop every plain run goes through, without the limit check
+                while instruction_pointer <= program_length:
+                    executed += 1
+                    next_ip = handlers[instruction_pointer - 1](input_fn, output_fn)
+                    if next_ip is None:
+                        break
+                    instruction_pointer = next_ip
+            else:
+                while instruction_pointer <= program_length:
+                    if executed == max_steps:
+                        return False
+                    executed += 1
+                    next_ip = handlers[instruction_pointer - 1](input_fn, output_fn)
+                    if next_ip is None:
+                        break
+                    instruction_pointer = next_ip
+        finally:
+            self.instruction_pointer = instruction_pointer
+            self.executed_instructions += executed
+        return True
 
     def reset(self):
         self.instruction_pointer = 1
-        self.registers = [0] * 100
-        
+        self.executed_instructions = 0
+        self.registers.clear()
 
     def step(self, input_fn = input, output_fn = print) -> Halt:
         if self.instruction_pointer > len(self.program):
             return True
-        instruction = self.program[self.instruction_pointer - 1]
-        if isinstance(instruction, Label):
-            pass
-        elif isinstance(instruction, SetValue):
-            self._set_register(instruction.target_register, instruction.value)
-        elif isinstance(instruction, SetRegister):
-            self._set_register(instruction.target_register, self._get_register(instruction.source_register))
-        elif isinstance(instruction, SetRegisterRegOpConst):
-            result = self._apply_operation(instruction.op, self._get_register(instruction.source_register), instruction.value)
-            self._set_register(instruction.target_register, result)
-        elif isinstance(instruction, SetRegisterRegOpReg):
-            result = self._apply_operation(instruction.op, self._get_register(instruction.first_source_register), self._get_register(instruction.second_source_register))
-            self._set_register(instruction.target_register, result)
-        elif isinstance(instruction, Load):
-            source_reg = self._get_register(instruction.source_register)
-            self._set_register(instruction.target_register, self._get_register(source_reg))
-        elif isinstance(instruction, Store):
-            target_reg = self._get_register(instruction.target_register)
-            self._set_register(target_reg, self._get_register(instruction.source_register))
-        elif isinstance(instruction, UnconditionalJmpToLabel):
-            self.instruction_pointer = self.labels[instruction.label] - 1
-        elif isinstance(instruction, UnconditionalJmpToInstruction):
-            self.instruction_pointer = instruction.instruction - 1
-        elif isinstance(instruction, ConditionalJmpToLabel):
-            if self._apply_condition(instruction.condition):
-                self.instruction_pointer = self.labels[instruction.label] - 1
-        elif isinstance(instruction, ConditionalJmpToInstruction):
-            if self._apply_condition(instruction.condition):
-                self.instruction_pointer = instruction.instruction - 1
-        elif isinstance(instruction, Read):
-                self._set_register(instruction.target_register, int(input_fn()))
-        elif isinstance(instruction, Write):
-            output_fn(self._get_register(instruction.source_register))
-        elif isinstance(instruction, Halt):
+
+        self.executed_instructions += 1
+        next_ip = self.handlers[self.instruction_pointer - 1](input_fn, output_fn)
+        if next_ip is None:
             return True
-        else:
-            raise ValueError(f"Invalid instruction: {instruction}")
-        
-        self.instruction_pointer += 1
+
+        self.instruction_pointer = next_ip
         return False
-        
+
+    def written_register(self) -> Optional[int]:
+        # register the current instruction is about to write, Store resolves its address from the current registers
+        if self.instruction_pointer > len(self.program):
+            return None
+        instruction = self.current_instruction
+        if isinstance(instruction, Store):
+            return self.registers.get(instruction.target_register)
+        return control_flow.written_register(instruction)
+
     @property
     def current_instruction(self) -> Instruction:
         return self.program[self.instruction_pointer - 1]
@@ -0,0 +1,104 @@
+import sys
+from contextlib import ExitStack, contextmanager
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, TextIO
+
+# Read/Write channels, every channel is a plain callable so it can be passed
+# anywhere an input_fn/output_fn is expected (Interpreter.run, step, Debugger, ...)
+
+class TokenInput:
+    # whitespace separated integers, the stream is read a chunk at a time instead of a line per value
+    DEFAULT_CHUNK_SIZE = 1 << 16
+
+    def __init__(self, stream: Optional[BinaryIO] = None, before_read: Optional[Callable[[], None]] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.stream = stream if stream is not None else sys.stdin.buffer
+        self.before_read = before_read
+        self.chunk_size = chunk_size
+
+        self.tokens: list[bytes] = []
+        self.position: int = 0
+        self.partial: bytes = b""
+
+    def _fill(self):
+        if self.before_read is not None:
+            self.before_read()
+
+        # read1 returns whatever is available, so interactive pipes and terminals don't block on a full chunk
+        if hasattr(self.stream, "read1"):
+            chunk = self.stream.read1(self.chunk_size)
+        else:
+            chunk = self.stream.read(self.chunk_size)
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+
+        if not chunk:
+            if not self.partial:
+                raise EOFError("No more input")
+            self.tokens, self.position, self.partial = [self.partial], 0, b""
+            return
+
+        data = self.partial + chunk
+        tokens = data.split()
+        # the last token may continue in the next chunk
+        self.partial = tokens.pop() if tokens and not data[-1:].isspace() else b""
+        self.tokens, self.position = tokens, 0
+
+    def __call__(self) -> int:
+        while self.position >= len(self.tokens):
+            self._fill()
+        token = self.tokens[self.position]
+        self.position += 1
+        return int(token)
+
+class BufferedOutput:
+    # values are collected and written with a single write once the threshold is hit, or on flush
+    DEFAULT_THRESHOLD = 4096
+
+    def __init__(self, stream: Optional[TextIO] = None, threshold: int = DEFAULT_THRESHOLD):
+        self.stream = stream if stream is not None else sys.stdout
+        self.threshold = threshold
+        self.buffer: list[int] = []
+
+    def __call__(self, value: int):
+        self.buffer.append(value)
+        if len(self.buffer) >= self.threshold:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write("\n".join(map(str, self.buffer)) + "\n")
+            self.buffer.clear()
+        self.stream.flush()
+
+class ListInput:
+    def __init__(self, values: Iterable[int]):
+        self.values: list[int] = list(values)
+        self.position: int = 0
+
+    def __call__(self) -> int:
+        if self.position >= len(self.values):
+            raise EOFError("No more input")
+        value = self.values[self.position]
+        self.position += 1
+        return value
+
+class ListOutput:
+    def __init__(self):
+        self.values: list[int] = []
+
+    def __call__(self, value: int):
+        self.values.append(value)
+
+    def flush(self):
+        pass
+
+@contextmanager
+def open_channels(input_path: Optional[str] = None, output_path: Optional[str] = None) -> Iterator[tuple[TokenInput, BufferedOutput]]:
+    # files (or pipes) when a path is given, stdin/stdout otherwise, output is flushed and the files closed on exit, even on errors
+    # pending output is flushed before blocking on input, so interactive use still sees prompts in order
+    with ExitStack() as files:
+        output = BufferedOutput(files.enter_context(open(output_path, 'w')) if output_path else None)
+        input_ = TokenInput(files.enter_context(open(input_path, 'rb')) if input_path else None, before_read=output.flush)
+        try:
+            yield input_, output
+        finally:
+            output.flush()
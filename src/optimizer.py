@@ -0,0 +1,456 @@
+from typing import Optional
+
+from .instruction import *
+from .registers import INT64_MIN
+from . import control_flow
+
+INT64_MAX = -INT64_MIN - 1
+
+class OptimizationReport:
+    def __init__(self, original_length: int):
+        self.original_length = original_length
+        self.optimized_length = original_length
+        self.folded = 0 # instructions rewritten to a simpler form (constants, decided jumps)
+        self.threaded = 0 # jumps retargeted past jumps they landed on
+        self.unreachable = 0
+        self.dead_stores = 0
+        self.removed_jumps = 0 # never taken or jumping to the next instruction
+        self.removed_labels = 0
+
+    @property
+    def removed(self) -> int:
+        return self.original_length - self.optimized_length
+
+    def __str__(self) -> str:
+        report = "Optimization\n"
+        report += f"  instructions: {self.original_length} -> {self.optimized_length} ({self.removed} removed)\n"
+        report += f"  folded: {self.folded}\n"
+        report += f"  jumps threaded: {self.threaded}\n"
+        report += f"  unreachable removed: {self.unreachable}\n"
+        report += f"  dead stores removed: {self.dead_stores}\n"
+        report += f"  jumps removed: {self.removed_jumps}\n"
+        report += f"  labels removed: {self.removed_labels}\n"
+        return report
+
+class ConstantState:
+    # known register values before an instruction, registers missing from values are 0 when rest_zero (nothing unknown was stored yet)
+    def __init__(self, values: dict[int, Optional[int]], rest_zero: bool):
+        self.values = values # None is unknown
+        self.rest_zero = rest_zero
+
+    def get(self, register: int) -> Optional[int]:
+        if register in self.values:
+            return self.values[register]
+        return 0 if self.rest_zero else None
+
+    def copy(self) -> "ConstantState":
+        return ConstantState(dict(self.values), self.rest_zero)
+
+    def meet(self, other: "ConstantState") -> "ConstantState":
+        values = {}
+        for register in self.values.keys() | other.values.keys():
+            value = self.get(register)
+            values[register] = value if value is not None and value == other.get(register) else None
+        return ConstantState(values, self.rest_zero and other.rest_zero)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ConstantState) and self.rest_zero == other.rest_zero \
+               and all(self.get(register) == other.get(register) for register in self.values.keys() | other.values.keys())
+
+class Optimizer:
+    # program -> program passes keeping the observable behaviour (read/written values, halting, runtime errors)
+    # every pass works on instruction pointers, removing instructions remaps numeric jump targets
+    # folding assumes a fresh start (every register 0), like Interpreter.run after construction or reset
+    # level 1: constant propagation and folding, decided jumps, jump threading, unreachable code
+    # level 2: also dead stores and unreferenced labels
+    LEVELS = (0, 1, 2)
+    MAX_ROUNDS = 16
+    # Load/Store through a known address become direct accesses below this, every register named directly is allocated up front
+    MAX_STATIC_ADDRESS = 1 << 16
+
+    RELATIONS = {
+        Rel.LT: lambda a, b: a < b,
+        Rel.GT: lambda a, b: a > b,
+        Rel.LE: lambda a, b: a <= b,
+        Rel.GE: lambda a, b: a >= b,
+        Rel.EQ: lambda a, b: a == b,
+        Rel.NE: lambda a, b: a != b,
+    }
+
+    def __init__(self, program: Program, level: int = 1):
+        if level not in self.LEVELS:
+            raise ValueError(f"Unsupported optimization level: {level}")
+        self.program: Program = list(program)
+        self.level = level
+        self.origins: list[int] = list(range(1, len(program) + 1)) # original instruction pointer of every instruction
+        self.report = OptimizationReport(len(program))
+
+    def optimize(self) -> Program:
+        # jumps to instruction 0 or below wrap around in the interpreter, such programs are left alone
+        labels = self._labels()
+        if self.level == 0 or any(isinstance(instruction, control_flow.JUMPS) and (control_flow.jump_target(instruction, labels) or 1) < 1
+                                  for instruction in self.program):
+            return self.program
+
+        for _ in range(self.MAX_ROUNDS):
+            changed = self._propagate_constants()
+            changed |= self._thread_jumps()
+            changed |= self._remove_unreachable()
+            changed |= self._remove_useless_jumps()
+            if self.level >= 2:
+                changed |= self._remove_dead_stores()
+                changed |= self._remove_unused_labels()
+            if not changed:
+                break
+        self.report.optimized_length = len(self.program)
+        return self.program
+
+    def _labels(self) -> dict[str, int]:
+        return { instruction.label: index + 1 for index, instruction in enumerate(self.program) if isinstance(instruction, Label) }
+
+    def _successors(self, instruction_pointer: int, labels: dict[str, int]) -> list[int]:
+        # instruction pointers execution may continue at, past the end means the program finishes
+        instruction = self.program[instruction_pointer - 1]
+        if isinstance(instruction, Halt):
+            return []
+        successors = []
+        if not isinstance(instruction, control_flow.UNCONDITIONAL_JUMPS):
+            successors.append(instruction_pointer + 1)
+        if isinstance(instruction, control_flow.JUMPS):
+            target = control_flow.jump_target(instruction, labels)
+            if target is not None: # an unknown label raises when taken
+                successors.append(target)
+        return [successor for successor in successors if successor <= len(self.program)]
+
+    def _remove(self, keep: list[bool]) -> int:
+        # removed instructions behave like no-ops from here on, jumps to them land on the next kept instruction
+        # a jump to the removed tail of the program would land past its end, which the backends have no label for,
+        # so its target stays; returns how many instructions were removed
+        keep = list(keep)
+        last_kept = max((index for index, kept in enumerate(keep) if kept), default=-1)
+        pending = [index for index, kept in enumerate(keep) if kept]
+        while pending:
+            instruction = self.program[pending.pop()]
+            if isinstance(instruction, (UnconditionalJmpToInstruction, ConditionalJmpToInstruction)) \
+               and last_kept < instruction.instruction - 1 < len(self.program):
+                last_kept = instruction.instruction - 1
+                keep[last_kept] = True
+                pending.append(last_kept)
+        removed = keep.count(False)
+        if removed == 0:
+            return 0
+
+        new_pointer = []
+        kept = 0
+        for index in range(len(self.program)):
+            new_pointer.append(kept + 1)
+            kept += keep[index]
+        end = kept + 1
+
+        program, origins = [], []
+        for index, instruction in enumerate(self.program):
+            if not keep[index]:
+                continue
+            if isinstance(instruction, (UnconditionalJmpToInstruction, ConditionalJmpToInstruction)):
+                target = new_pointer[instruction.instruction - 1] if instruction.instruction <= len(self.program) else end
+                instruction = self._retarget(instruction, target)
+            program.append(instruction)
+            origins.append(self.origins[index])
+        self.program, self.origins = program, origins
+        return removed
+
+    @staticmethod
+    def _retarget(jump: Instruction, target: int) -> Instruction:
+        if isinstance(jump, control_flow.CONDITIONAL_JUMPS):
+            return ConditionalJmpToInstruction(jump.condition, target)
+        return UnconditionalJmpToInstruction(target)
+
+    @staticmethod
+    def _fold(op: Op, a: int, b: int) -> Optional[int]:
+        # only results every backend agrees on: int64 range, division of nonnegative numbers (floor == truncation)
+        if op == Op.ADD:
+            result = a + b
+        elif op == Op.SUB:
+            result = a - b
+        elif op == Op.MUL:
+            result = a * b
+        elif op == Op.DIV:
+            if a < 0 or b <= 0:
+                return None
+            result = a // b
+        else:
+            return None
+        return result if INT64_MIN <= result <= INT64_MAX else None
+
+    def _transfer(self, instruction: Instruction, state: ConstantState) -> ConstantState:
+        state = state.copy()
+        if isinstance(instruction, SetValue):
+            state.values[instruction.target_register] = instruction.value if INT64_MIN <= instruction.value <= INT64_MAX else None
+        elif isinstance(instruction, SetRegister):
+            state.values[instruction.target_register] = state.get(instruction.source_register)
+        elif isinstance(instruction, SetRegisterRegOpConst):
+            source = state.get(instruction.source_register)
+            state.values[instruction.target_register] = None if source is None else self._fold(instruction.op, source, instruction.value)
+        elif isinstance(instruction, SetRegisterRegOpReg):
+            first, second = state.get(instruction.first_source_register), state.get(instruction.second_source_register)
+            state.values[instruction.target_register] = None if first is None or second is None else self._fold(instruction.op, first, second)
+        elif isinstance(instruction, Load):
+            address = state.get(instruction.source_register)
+            state.values[instruction.target_register] = None if address is None else state.get(address)
+        elif isinstance(instruction, Store):
+            address = state.get(instruction.target_register)
+            if address is None:
+                # any register may have been written
+                return ConstantState({}, False)
+            state.values[address] = state.get(instruction.source_register)
+        elif isinstance(instruction, Read):
+            state.values[instruction.target_register] = None
+        return state
+
+    def _constant_states(self) -> list[Optional[ConstantState]]:
+        # state before every instruction, None for instructions never reached
+        labels = self._labels()
+        states: list[Optional[ConstantState]] = [None] * len(self.program)
+        if not self.program:
+            return states
+        states[0] = ConstantState({}, True)
+        worklist = [1]
+        while worklist:
+            instruction_pointer = worklist.pop()
+            after = self._transfer(self.program[instruction_pointer - 1], states[instruction_pointer - 1])
+            for successor in self._successors(instruction_pointer, labels):
+                current = states[successor - 1]
+                merged = after if current is None else current.meet(after)
+                if current is None or merged != current:
+                    states[successor - 1] = merged
+                    worklist.append(successor)
+        return states
+
+    def _decide(self, condition: Union[ConditionWithConst, ConditionWithRegister], state: ConstantState) -> Optional[bool]:
+        if isinstance(condition, ConditionWithConst):
+            first, second = state.get(condition.register), condition.value
+        else:
+            first, second = state.get(condition.first_register), state.get(condition.second_register)
+        if first is None or second is None:
+            return None
+        return self.RELATIONS[condition.rel](first, second)
+
+    def _simplify(self, instruction: Instruction, state: ConstantState) -> Optional[Instruction]:
+        # cheaper equivalent of the instruction in the given state, None if there is none
+        if isinstance(instruction, SetRegister):
+            value = state.get(instruction.source_register)
+            if value is not None:
+                return SetValue(instruction.target_register, value)
+        elif isinstance(instruction, SetRegisterRegOpConst):
+            source = state.get(instruction.source_register)
+            if source is not None and (value := self._fold(instruction.op, source, instruction.value)) is not None:
+                return SetValue(instruction.target_register, value)
+        elif isinstance(instruction, SetRegisterRegOpReg):
+            first, second = state.get(instruction.first_source_register), state.get(instruction.second_source_register)
+            if first is not None and second is not None and (value := self._fold(instruction.op, first, second)) is not None:
+                return SetValue(instruction.target_register, value)
+            # constants of the instruction forms are unsigned
+            if second is not None and second >= 0 and (instruction.op != Op.DIV or second > 0):
+                return SetRegisterRegOpConst(instruction.target_register, instruction.first_source_register, instruction.op, second)
+        elif isinstance(instruction, Load):
+            address = state.get(instruction.source_register)
+            if address is not None and 0 <= address < self.MAX_STATIC_ADDRESS:
+                value = state.get(address)
+                if value is not None:
+                    return SetValue(instruction.target_register, value)
+                return SetRegister(instruction.target_register, address)
+        elif isinstance(instruction, Store):
+            address = state.get(instruction.target_register)
+            if address is not None and 0 <= address < self.MAX_STATIC_ADDRESS:
+                return SetRegister(address, instruction.source_register)
+        elif isinstance(instruction, control_flow.CONDITIONAL_JUMPS):
+            taken = self._decide(instruction.condition, state)
+            if taken is True:
+                if isinstance(instruction, ConditionalJmpToLabel):
+                    return UnconditionalJmpToLabel(instruction.label)
+                return UnconditionalJmpToInstruction(instruction.instruction)
+            if isinstance(instruction.condition, ConditionWithRegister) and taken is None:
+                second = state.get(instruction.condition.second_register)
+                if second is not None and second >= 0:
+                    condition = ConditionWithConst(instruction.condition.first_register, instruction.condition.rel, second)
+                    if isinstance(instruction, ConditionalJmpToLabel):
+                        return ConditionalJmpToLabel(condition, instruction.label)
+                    return ConditionalJmpToInstruction(condition, instruction.instruction)
+        return None
+
+    def _propagate_constants(self) -> bool:
+        states = self._constant_states()
+        changed = False
+        keep = [True] * len(self.program)
+        for index, instruction in enumerate(self.program):
+            if states[index] is None:
+                continue
+            if isinstance(instruction, control_flow.CONDITIONAL_JUMPS) and self._decide(instruction.condition, states[index]) is False:
+                keep[index] = False
+                continue
+            simplified = self._simplify(instruction, states[index])
+            if simplified is not None:
+                self.program[index] = simplified
+                self.report.folded += 1
+                changed = True
+        removed = self._remove(keep)
+        self.report.removed_jumps += removed
+        return changed or removed > 0
+
+    def _final_target(self, target: int, labels: dict[str, int]) -> tuple[int, bool]:
+        # follows labels and unconditional jumps from target, (where execution really continues, whether a jump was passed)
+        visited = set()
+        passed_jump = False
+        while target <= len(self.program) and target not in visited:
+            visited.add(target)
+            instruction = self.program[target - 1]
+            if isinstance(instruction, Label):
+                target += 1
+            elif isinstance(instruction, control_flow.UNCONDITIONAL_JUMPS):
+                next_target = control_flow.jump_target(instruction, labels)
+                if next_target is None:
+                    break
+                target = next_target
+                passed_jump = True
+            else:
+                break
+        return min(target, len(self.program) + 1), passed_jump
+
+    def _thread_jumps(self) -> bool:
+        labels = self._labels()
+        changed = False
+        for index, instruction in enumerate(self.program):
+            if not isinstance(instruction, control_flow.JUMPS):
+                continue
+            target = control_flow.jump_target(instruction, labels)
+            if target is None or target > len(self.program):
+                continue
+            final, passed_jump = self._final_target(target, labels)
+            # a jump past the end has no label in the compiled backends
+            if passed_jump and final != target and final <= len(self.program):
+                self.program[index] = self._retarget(instruction, final)
+                self.report.threaded += 1
+                changed = True
+        return changed
+
+    def _remove_unreachable(self) -> bool:
+        labels = self._labels()
+        reachable = [False] * len(self.program)
+        worklist = [1] if self.program else []
+        while worklist:
+            instruction_pointer = worklist.pop()
+            if reachable[instruction_pointer - 1]:
+                continue
+            reachable[instruction_pointer - 1] = True
+            worklist.extend(self._successors(instruction_pointer, labels))
+
+        removed = self._remove(reachable)
+        self.report.unreachable += removed
+        return removed > 0
+
+    def _remove_useless_jumps(self) -> bool:
+        # a jump whose target is where execution would continue anyway
+        labels = self._labels()
+        keep = [True] * len(self.program)
+        for index, instruction in enumerate(self.program):
+            if isinstance(instruction, control_flow.JUMPS):
+                target = control_flow.jump_target(instruction, labels)
+                if target is None:
+                    continue
+                following = index + 2
+                while following <= len(self.program) and isinstance(self.program[following - 1], Label):
+                    following += 1
+                # only labels between the jump and its target
+                if index + 2 <= min(target, len(self.program) + 1) <= following:
+                    keep[index] = False
+        removed = self._remove(keep)
+        self.report.removed_jumps += removed
+        return removed > 0
+
+    def _live_registers(self) -> list[Optional[set[int]]]:
+        # registers read later on, after every instruction, None when any register may be read (Load from an unknown address)
+        labels = self._labels()
+        states = self._constant_states()
+        live_after: list[Optional[set[int]]] = [set() for _ in self.program]
+        live_before: list[Optional[set[int]]] = [set() for _ in self.program]
+        predecessors: list[list[int]] = [[] for _ in self.program]
+        for index in range(len(self.program)):
+            for successor in self._successors(index + 1, labels):
+                predecessors[successor - 1].append(index + 1)
+
+        worklist = list(range(1, len(self.program) + 1))
+        while worklist:
+            instruction_pointer = worklist.pop()
+            index = instruction_pointer - 1
+            after: Optional[set[int]] = set()
+            for successor in self._successors(instruction_pointer, labels):
+                before = live_before[successor - 1]
+                after = None if after is None or before is None else after | before
+            live_after[index] = after
+
+            instruction = self.program[index]
+            before = self._live_before(instruction, after, states[index])
+            if before != live_before[index]:
+                live_before[index] = before
+                worklist.extend(predecessors[index])
+        return live_after
+
+    @staticmethod
+    def _live_before(instruction: Instruction, after: Optional[set[int]], state: Optional[ConstantState]) -> Optional[set[int]]:
+        # registers the instruction reads are live before it, the one it writes is not (unless it reads it too)
+        address = None
+        if isinstance(instruction, Load):
+            address = state.get(instruction.source_register) if state is not None else None
+            if address is None:
+                return None
+        if after is None:
+            return None
+        before = set(after)
+        written = control_flow.written_register(instruction)
+        if written is not None:
+            before.discard(written)
+        before.update(Optimizer._read_registers(instruction))
+        if address is not None:
+            before.add(address)
+        return before
+
+    @staticmethod
+    def _read_registers(instruction: Instruction) -> list[int]:
+        if isinstance(instruction, (SetRegister, SetRegisterRegOpConst, Load, Write)):
+            return [instruction.source_register]
+        if isinstance(instruction, SetRegisterRegOpReg):
+            return [instruction.first_source_register, instruction.second_source_register]
+        if isinstance(instruction, Store):
+            return [instruction.target_register, instruction.source_register]
+        if isinstance(instruction, control_flow.CONDITIONAL_JUMPS):
+            return control_flow.condition_registers(instruction.condition)
+        return []
+
+    def _remove_dead_stores(self) -> bool:
+        live_after = self._live_registers()
+        keep = [True] * len(self.program)
+        for index, instruction in enumerate(self.program):
+            if not isinstance(instruction, (SetValue, SetRegister, SetRegisterRegOpConst, SetRegisterRegOpReg, Load)):
+                continue
+            # a division may still have to raise
+            if isinstance(instruction, SetRegisterRegOpReg) and instruction.op == Op.DIV \
+               or isinstance(instruction, SetRegisterRegOpConst) and instruction.op == Op.DIV and instruction.value == 0:
+                continue
+            if live_after[index] is not None and instruction.target_register not in live_after[index]:
+                keep[index] = False
+        removed = self._remove(keep)
+        self.report.dead_stores += removed
+        return removed > 0
+
+    def _remove_unused_labels(self) -> bool:
+        used = { instruction.label for instruction in self.program if isinstance(instruction, (UnconditionalJmpToLabel, ConditionalJmpToLabel)) }
+        keep = [not isinstance(instruction, Label) or instruction.label in used for instruction in self.program]
+        removed = self._remove(keep)
+        self.report.removed_labels += removed
+        return removed > 0
+
+def optimize(program: Program, level: int = 1) -> tuple[Program, list[int], OptimizationReport]:
+    # optimized program, original instruction pointer of each of its instructions, report
+    optimizer = Optimizer(program, level)
+    optimized = optimizer.optimize()
+    return optimized, optimizer.origins, optimizer.report
@@ -1,252 +1,193 @@
-from .parser_combinators import ApplyParser
+import io
+import re
+from typing import Iterable, Iterator
 
 from .instruction import *
+from .encoded_program import EncodedProgram
 class FailedToParse(Exception):
     pass
 
+# every form is matched as a prefix of the line, whatever follows it (comments) is ignored
+# whitespace is only spaces and tabs, registers and labels have to start the line, keywords may be indented
+_WS = r"[ \t]*"
+_REGISTER = r"R([0-9]+)"
+_ASSIGN = _WS + ":=" + _WS
+_RELATION = re.compile(_REGISTER + _WS + r"(==|!=|<=|>=|<|>)" + _WS + r"(?:R([0-9]+)|([0-9]+))")
+_TARGET = re.compile(r"([A-Za-z][A-Za-z0-9_]*)|([0-9]+)") # label or instruction number
+
+_SET_VALUE = re.compile(_REGISTER + _ASSIGN + r"(-?[0-9]+)")
+_SET_REGISTER = re.compile(_REGISTER + _ASSIGN + _REGISTER)
+_OPERAND = re.compile(_WS + r"([+\-*/])" + _WS + r"(?:R([0-9]+)|([0-9]+))")
+_OPERATOR = re.compile(_WS + r"[+\-*/]")
+_LOAD = re.compile(_REGISTER + _ASSIGN + _WS + r"\[" + _WS + _REGISTER + _WS + r"\]")
+_READ = re.compile(_REGISTER + _ASSIGN + _WS + r"(?:READ|read)" + _WS + _WS + r"\(" + _WS + _WS + r"\)")
+_STORE = re.compile(_WS + r"\[" + _WS + _REGISTER + _WS + r"\]" + _WS + _ASSIGN + _REGISTER)
+_IF = re.compile(_WS + r"(?:IF|if)" + _WS + _WS + r"\(" + _WS)
+_CLOSE_IF = re.compile(_WS + r"\)" + _WS + _WS + r"(?:GOTO|goto)" + _WS)
+_GOTO = re.compile(_WS + r"(?:GOTO|goto)" + _WS)
+_WRITE = re.compile(_WS + r"(?:WRITE|write)" + _WS + _WS + r"\(" + _WS + _REGISTER + _WS + r"\)")
+_HALT = re.compile(_WS + r"(?:HALT|halt)")
+_LABEL = re.compile(r"([A-Za-z][A-Za-z0-9_]*)" + _WS + ":")
+_REGISTER_START = re.compile(_REGISTER)
 
 class ProgramParser():
+    # a single regex pass per form, the first non blank character decides which forms are tried
     @staticmethod
     def parse(input_str: str) -> Program:
-        return [ProgramParser.parse_instruction(line) for line in input_str.splitlines() if line.strip() != ""]
-    
-    @staticmethod
-    def parse_instruction(input_str: str) -> Instruction:
-        pp = ProgramParser
-        ins_parsers = [pp.parse_set_value
-                       , pp.parse_set_register
-                       , pp.parse_load
-                       , pp.parse_store
-                       , pp.parse_conditional_jmp
-                       , pp.parse_unconditional_jmp
-                       , pp.parse_read
-                       , pp.parse_write
-                       , pp.parse_halt
-                       , pp.parse_label]
-        
-        for parser in ins_parsers:
-            result = parser(input_str)
-            if result is not None:
-                return result
-        
-        raise FailedToParse(f"Failed to parse instruction from {input_str}")
+        parse_instruction = ProgramParser.parse_instruction
+        return [parse_instruction(line) for line in input_str.splitlines() if line.strip() != ""]
 
     @staticmethod
-    def parse_set_value(input_str: str) -> Union[SetValue, None]: 
-        if not(register_result := ApplyParser.register(input_str)).is_valid:
-            return None
-        input_str = register_result.rest
-        if not(assign_result := ApplyParser.assign_op(input_str)).is_valid:
-            return None
-        input_str = assign_result.rest
-        if not(value_result := ApplyParser.sint(input_str)).is_valid:
-            return None
+    def parse_encoded(input_str: str) -> EncodedProgram:
+        # the same as parse, no instruction object (or line) outlives its parsing
+        return EncodedProgram.from_instructions(ProgramParser.iter_parse(io.StringIO(input_str)))
 
-        return SetValue(int(register_result.value[1:]), int(value_result.value))
-    
     @staticmethod
-    def parse_set_register(input_str: str) -> Union[SetRegister, SetRegisterRegOpConst, SetRegisterRegOpReg, None]: 
-        if not(target_register_result := ApplyParser.register(input_str)).is_valid:
-            return None
-        input_str = target_register_result.rest
-        
-        if not(assign_result := ApplyParser.assign_op(input_str)).is_valid:
-            return None
-        input_str = assign_result.rest
-
-        if not(first_source_register_result := ApplyParser.register(input_str)).is_valid:
-            return None
-        input_str = first_source_register_result.rest
+    def iter_parse(lines: Iterable[str]) -> Iterator[Instruction]:
+        # the same as parse, one line at a time, so a file handle is never read as a whole
+        parse_instruction = ProgramParser.parse_instruction
+        for chunk in lines:
+            for line in chunk.splitlines():
+                if line.strip() != "":
+                    yield parse_instruction(line)
 
-        if not(operator_result := ApplyParser.operator(input_str)).is_valid:
-            return SetRegister(int(target_register_result.value[1:]), int(first_source_register_result.value[1:]))
-        input_str = operator_result.rest
+    @staticmethod
+    def source_lines(input_str: str) -> list[int]:
+        # source line (counted from 1) of every instruction returned by parse
+        return [line_number + 1 for line_number, line in enumerate(input_str.splitlines()) if line.strip() != ""]
 
-        second_source_register_result = ApplyParser.register(input_str)
-        const_result = ApplyParser.uint(input_str)
+    @staticmethod
+    def parse_instruction(input_str: str) -> Instruction:
+        pp = ProgramParser
+        if _REGISTER_START.match(input_str):
+            result = pp.parse_set_value(input_str) or pp.parse_set_register(input_str) or pp.parse_load(input_str) or pp.parse_read(input_str)
+        else:
+            first = input_str.lstrip(" \t")[:1]
+            parser = pp.KEYWORD_PARSERS.get(first)
+            result = parser(input_str) if parser is not None else None
+        if result is None:
+            result = pp.parse_label(input_str)
+        if result is not None:
+            return result
 
-        if second_source_register_result.is_valid:
-            return SetRegisterRegOpReg(int(target_register_result.value[1:])
-                                       , int(first_source_register_result.value[1:])
-                                       , Op.from_string(operator_result.value.strip())
-                                       , int(second_source_register_result.value[1:]))
-        elif const_result.is_valid:
-            return SetRegisterRegOpConst(int(target_register_result.value[1:])
-                                         , int(first_source_register_result.value[1:])
-                                         , Op.from_string(operator_result.value.strip())
-                                         , int(const_result.value))
-        return None
+        raise FailedToParse(f"Failed to parse instruction from {input_str}")
 
     @staticmethod
-    def parse_load(input_str: str) -> Union[Load, None]:
-        if not(target_register := ApplyParser.register(input_str)).is_valid:
+    def parse_set_value(input_str: str) -> Union[SetValue, None]:
+        if (match := _SET_VALUE.match(input_str)) is None:
             return None
-        input_str = target_register.rest
+        return SetValue(int(match[1]), int(match[2]))
 
-        if not(assign_op := ApplyParser.assign_op(input_str)).is_valid:
+    @staticmethod
+    def parse_set_register(input_str: str) -> Union[SetRegister, SetRegisterRegOpConst, SetRegisterRegOpReg, None]:
+        if (match := _SET_REGISTER.match(input_str)) is None:
             return None
-        input_str = assign_op.rest
+        target, source = int(match[1]), int(match[2])
 
-        if not(lsparen := ApplyParser.lsparen(input_str)).is_valid:
-            return None
-        input_str = lsparen.rest
+        if (operand := _OPERAND.match(input_str, match.end())) is None:
+            # an operator without an operand after it is not a plain copy
+            if _OPERATOR.match(input_str, match.end()):
+                return None
+            return SetRegister(target, source)
+        if operand[2] is not None:
+            return SetRegisterRegOpReg(target, source, Op.from_string(operand[1]), int(operand[2]))
+        return SetRegisterRegOpConst(target, source, Op.from_string(operand[1]), int(operand[3]))
 
-        if not(source_register := ApplyParser.register(input_str)).is_valid:
+    @staticmethod
+    def parse_load(input_str: str) -> Union[Load, None]:
+        if (match := _LOAD.match(input_str)) is None:
             return None
-        input_str = source_register.rest
+        return Load(int(match[1]), int(match[2]))
 
-        if not(rsparen := ApplyParser.rsparen(input_str)).is_valid:
-            return None
-        
-        return Load(int(target_register.value[1:]), int(source_register.value[1:]))
-    
     @staticmethod
     def parse_store(input_str: str) -> Union[Store, None] :
-        if not(lsparen := ApplyParser.lsparen(input_str)).is_valid:
+        if (match := _STORE.match(input_str)) is None:
             return None
-        input_str = lsparen.rest
+        return Store(int(match[1]), int(match[2]))
 
-        if not(target_register := ApplyParser.register(input_str)).is_valid:
-            return None
-        input_str = target_register.rest
-
-        if not(rsparen := ApplyParser.rsparen(input_str)).is_valid:
-            return None
-        input_str = rsparen.rest
-
-        if not(assign_op := ApplyParser.assign_op(input_str)).is_valid:
-            return None
-        input_str = assign_op.rest
-
-        if not(source_register := ApplyParser.register(input_str)).is_valid:
-            return None
-        
-        return Store(int(target_register.value[1:]), int(source_register.value[1:]))
-        
     @staticmethod
     def parse_conditional_jmp(input_str: str) -> Union[ConditionalJmpToInstruction, ConditionalJmpToLabel, None] :
-        if not (if_result := ApplyParser.if_(input_str)).is_valid:
+        if (match := _IF.match(input_str)) is None:
             return None
-        input_str = if_result.rest
-
-        if not (lparen := ApplyParser.lparen(input_str)).is_valid:
+        if (relation := _RELATION.match(input_str, match.end())) is None:
             return None
-        input_str = lparen.rest
-
-        if not (first_register := ApplyParser.register(input_str)).is_valid:
+        if (close := _CLOSE_IF.match(input_str, relation.end())) is None:
             return None
-        input_str = first_register.rest
-
-        if not (rel_op := ApplyParser.rel_operator(input_str)).is_valid:
+        if (target := _TARGET.match(input_str, close.end())) is None:
             return None
-        input_str = rel_op.rest
 
-        second_register = ApplyParser.register(input_str)
-        const = ApplyParser.uint(input_str)
+        condition = ProgramParser._condition(relation)
+        if target[1] is not None:
+            return ConditionalJmpToLabel(condition, target[1])
+        return ConditionalJmpToInstruction(condition, int(target[2]))
 
-        condition : Union[ConditionWithRegister, ConditionWithConst] = None
+    @staticmethod
+    def _condition(relation: re.Match) -> Union[ConditionWithRegister, ConditionWithConst]:
+        if relation[3] is not None:
+            return ConditionWithRegister(int(relation[1]), Rel.from_string(relation[2]), int(relation[3]))
+        return ConditionWithConst(int(relation[1]), Rel.from_string(relation[2]), int(relation[4]))
 
-        if second_register.is_valid:
-            input_str = second_register.rest
-            condition = ConditionWithRegister(int(first_register.value[1:]), Rel.from_string(rel_op.value.strip()), int(second_register.value[1:]))
-        elif const.is_valid:
-            input_str = const.rest
-            condition = ConditionWithConst(int(first_register.value[1:]), Rel.from_string(rel_op.value.strip()), int(const.value))
-        else:
-            return None
-        
-        if not (rparen := ApplyParser.rparen(input_str)).is_valid:
+    @staticmethod
+    def parse_relation(input_str: str) -> Union[tuple[Union[ConditionWithRegister, ConditionWithConst], str], None]:
+        # register, relation, register or constant; returns the condition and the unparsed rest
+        if (relation := _RELATION.match(input_str)) is None:
             return None
-        input_str = rparen.rest
+        return ProgramParser._condition(relation), input_str[relation.end():]
 
-        if not (goto_result := ApplyParser.goto_(input_str)).is_valid:
+    @staticmethod
+    def parse_condition(input_str: str) -> Union[ConditionWithRegister, ConditionWithConst, None]:
+        # a whole condition like "R3 > 100", used by the debugger's conditional breakpoints
+        if (condition_result := ProgramParser.parse_relation(input_str.strip())) is None:
             return None
-        input_str = goto_result.rest
-
-        label = ApplyParser.label(input_str)
-        instruction = ApplyParser.uint(input_str)
-
-        if label.is_valid:
-            return ConditionalJmpToLabel(condition, label.value)
-        elif instruction.is_valid:
-            return ConditionalJmpToInstruction(condition, int(instruction.value))
+        condition, rest = condition_result
+        if rest.strip() != "":
+            return None
+        return condition
 
-        return None
-        
     @staticmethod
     def parse_unconditional_jmp(input_str: str) -> Union[UnconditionalJmpToInstruction, UnconditionalJmpToLabel, None]:
-        if not (goto_result := ApplyParser.goto_(input_str)).is_valid:
+        if (match := _GOTO.match(input_str)) is None:
+            return None
+        if (target := _TARGET.match(input_str, match.end())) is None:
             return None
-        input_str = goto_result.rest
-        
-        label = ApplyParser.label(input_str)
-        instruction = ApplyParser.uint(input_str)
+        if target[1] is not None:
+            return UnconditionalJmpToLabel(target[1])
+        return UnconditionalJmpToInstruction(int(target[2]))
 
-        if label.is_valid:
-            return UnconditionalJmpToLabel(label.value)
-        elif instruction.is_valid:
-            return UnconditionalJmpToInstruction(int(instruction.value))
-        return None
-    
     @staticmethod
     def parse_read(input_str: str) -> Union[Read, None]:
         # R1 := read()
-        if not (target_register := ApplyParser.register(input_str)).is_valid:
-            return None
-        input_str = target_register.rest
-
-        if not (assign_op := ApplyParser.assign_op(input_str)).is_valid:
-            return None
-        input_str = assign_op.rest
-
-        if not (read_result := ApplyParser.read(input_str)).is_valid:
-            return None
-        input_str = read_result.rest
-
-        if not (lparen := ApplyParser.lparen(input_str)).is_valid:
+        if (match := _READ.match(input_str)) is None:
             return None
-        input_str = lparen.rest
+        return Read(int(match[1]))
 
-        if not (rparen := ApplyParser.rparen(input_str)).is_valid:
-            return None
-        
-        return Read(int(target_register.value[1:]))
-    
     @staticmethod
     def parse_write(input_str: str) -> Union[Write, None]:
-        if not (write_result := ApplyParser.write(input_str)).is_valid:
-            return None
-        input_str = write_result.rest
-
-        if not (lparen := ApplyParser.lparen(input_str)).is_valid:
-            return None
-        input_str = lparen.rest
-
-        if not (source_register := ApplyParser.register(input_str)).is_valid:
+        if (match := _WRITE.match(input_str)) is None:
             return None
-        input_str = source_register.rest
+        return Write(int(match[1]))
 
-        if not (rparen := ApplyParser.rparen(input_str)).is_valid:
-            return None
-        
-        return Write(int(source_register.value[1:]))
-    
     @staticmethod
     def parse_halt(input_str: str) -> Union[Halt, None] :
-        if not (halt_result := ApplyParser.halt(input_str)).is_valid:
+        if _HALT.match(input_str) is None:
             return None
-        input_str = halt_result.rest
-
         return Halt()
-    
+
     @staticmethod
     def parse_label(input_str: str) ->  Union[Label, None]:
-        if not (label_result := ApplyParser.label(input_str)).is_valid:
-            return None
-        input_str = label_result.rest
-
-
-        if not (colon := ApplyParser.colon(input_str)).is_valid:
-            return None
-        
-        return Label(label_result.value)
\ No newline at end of file
+        if (match := _LABEL.match(input_str)) is None:
+            return None
+        return Label(match[1])
+
+# first non blank character -> the only form that can start with it (besides a label)
+ProgramParser.KEYWORD_PARSERS = {
+    "[": ProgramParser.parse_store,
+    "i": ProgramParser.parse_conditional_jmp,
+    "I": ProgramParser.parse_conditional_jmp,
+    "g": ProgramParser.parse_unconditional_jmp,
+    "G": ProgramParser.parse_unconditional_jmp,
+    "w": ProgramParser.parse_write,
+    "W": ProgramParser.parse_write,
+    "h": ProgramParser.parse_halt,
+    "H": ProgramParser.parse_halt,
+}
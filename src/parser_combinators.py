@@ -1,107 +1,140 @@
-
-from string import ascii_letters
-from typing import Callable
+from string import ascii_letters, digits
+from typing import Callable, Iterable, Optional
 
 
 class ParseResult:
-    def __init__(self, value, rest):
+    # parsers never slice the input, a result keeps the text and the position parsing stopped at
+    __slots__ = ("value", "text", "position")
+
+    def __init__(self, value, text: Optional[str], position: Optional[int]):
         self.value = value
-        self.rest = rest
+        self.text = text
+        self.position = position
 
     def __repr__(self):
-        return f"ParseResult({self.value}, {self.rest})"
-    
+        return f"ParseResult({self.value}, {self.position})"
+
     @staticmethod
     def invalid() -> 'ParseResult':
-        return ParseResult(None, None)
-    
+        return INVALID
+
+    @property
+    def rest(self) -> Optional[str]:
+        # the unparsed input, only sliced when asked for
+        if self.position is None:
+            return None
+        return self.text[self.position:]
+
     @property
     def is_valid(self) -> bool:
-        return self.value is not None and self.rest is not None
-    
+        return self.value is not None and self.position is not None
+
     @property
     def is_invalid(self) -> bool:
         return not self.is_valid
-    
+
     @property
     def has_value(self) -> bool:
         return self.value is not None
-    
-    
-Parser = Callable[[str], ParseResult]
+
+INVALID = ParseResult(None, None, None)
+
+# text and the position to start at, 0 when left out
+Parser = Callable[..., ParseResult]
 
 class ParseCombinator:
 
     @staticmethod
     def create_char_parser(input_char: str) -> Parser:
-        def parser(input_str) -> ParseResult:
-            if input_str.startswith(input_char):
-                return ParseResult(input_char, input_str[1:])
+        def parser(text: str, position: int = 0) -> ParseResult:
+            if text.startswith(input_char, position):
+                return ParseResult(input_char, text, position + len(input_char))
             else:
-                return ParseResult.invalid()
+                return INVALID
+        return parser
+
+    @staticmethod
+    def create_char_class_parser(chars: Iterable[str]) -> Parser:
+        # one character out of chars, a set lookup instead of an alternative of char parsers
+        char_set = frozenset(chars)
+        def parser(text: str, position: int = 0) -> ParseResult:
+            if position < len(text) and text[position] in char_set:
+                return ParseResult(text[position], text, position + 1)
+            return INVALID
+        return parser
+
+    @staticmethod
+    def create_span_parser(chars: Iterable[str], min_count: int = 0) -> Parser:
+        # the longest run of characters out of chars, same as repeating create_char_class_parser
+        char_set = frozenset(chars)
+        def parser(text: str, position: int = 0) -> ParseResult:
+            end = position
+            length = len(text)
+            while end < length and text[end] in char_set:
+                end += 1
+            if end - position < min_count:
+                return INVALID
+            return ParseResult(text[position:end], text, end)
         return parser
 
     @staticmethod
     def create_string_parser(input_str: str) -> Parser:
-        return ParseCombinator.create_sequence_parser([ParseCombinator.create_char_parser(c) for c in input_str])
+        return ParseCombinator.create_char_parser(input_str)
 
     @staticmethod
     def create_optional_parser(parser: Parser) -> Parser:
-        def optional_parser(input_str) -> ParseResult:
-            result = parser(input_str)
+        def optional_parser(text: str, position: int = 0) -> ParseResult:
+            result = parser(text, position)
             if result.is_invalid:
-                return ParseResult("", input_str)
+                return ParseResult("", text, position)
             else:
                 return result
         return optional_parser
 
     @staticmethod
     def create_alternative_parser(parsers: list[Parser]) -> Parser:
-        def alternative_parser(input_str) -> ParseResult:
+        def alternative_parser(text: str, position: int = 0) -> ParseResult:
             for parser in parsers:
-                result = parser(input_str)
+                result = parser(text, position)
                 if result.is_valid:
                     return result
-            return ParseResult.invalid()
+            return INVALID
         return alternative_parser
 
     @staticmethod
     def create_repeat_parser(parser: Parser, min_count: int = 0) -> Parser:
-        def repeat_parser(input_str) -> ParseResult:
-            values = []
-            rest = input_str
+        # the value is the consumed text, every parser's value is the text it consumed
+        def repeat_parser(text: str, position: int = 0) -> ParseResult:
+            start = position
+            count = 0
             while True:
-                result = parser(rest)
-                if result.is_invalid:
+                result = parser(text, position)
+                if result.is_invalid or result.position == position:
                     break
-                else:
-                    values.append(result.value)
-                    rest = result.rest
-            if len(values) < min_count:
-                return ParseResult.invalid()
+                position = result.position
+                count += 1
+            if count < min_count:
+                return INVALID
             else:
-                return ParseResult("".join(values), rest)
+                return ParseResult(text[start:position], text, position)
         return repeat_parser
 
     @staticmethod
     def create_sequence_parser(parsers: list[Parser]) -> Parser:
-        def sequence_parser(string) -> ParseResult:
-            values = []
-            rest = string
+        def sequence_parser(text: str, position: int = 0) -> ParseResult:
+            start = position
             for parser in parsers:
-                result = parser(rest)
+                result = parser(text, position)
                 if result.is_invalid:
-                    return ParseResult.invalid()
-                else:
-                    values.append(result.value)
-                    rest = result.rest
-            return ParseResult("".join(values), rest)
+                    return INVALID
+                position = result.position
+            return ParseResult(text[start:position], text, position)
         return sequence_parser
 
 class ApplyParser:
-    digit = ParseCombinator.create_alternative_parser([ParseCombinator.create_char_parser(str(i)) for i in range(10)])
-    whitespace = ParseCombinator.create_repeat_parser(ParseCombinator.create_alternative_parser([ParseCombinator.create_char_parser(' '), ParseCombinator.create_char_parser('\t')]))
-    uint = ParseCombinator.create_repeat_parser(digit, min_count=1)
+    digit = ParseCombinator.create_char_class_parser(digits)
+    whitespace = ParseCombinator.create_span_parser(" \t")
+    uint = ParseCombinator.create_span_parser(digits, min_count=1)
     register = ParseCombinator.create_sequence_parser([ParseCombinator.create_char_parser('R'), uint])
     assign_op = ParseCombinator.create_sequence_parser([whitespace, ParseCombinator.create_string_parser(":="), whitespace])
     lparen = ParseCombinator.create_sequence_parser([whitespace, ParseCombinator.create_char_parser('('), whitespace])
@@ -109,10 +142,7 @@ class ApplyParser:
     lsparen = ParseCombinator.create_sequence_parser([whitespace, ParseCombinator.create_char_parser('['), whitespace])
     rsparen = ParseCombinator.create_sequence_parser([whitespace, ParseCombinator.create_char_parser(']'), whitespace])
     operator = ParseCombinator.create_sequence_parser([whitespace
-                                                       , ParseCombinator.create_alternative_parser([ParseCombinator.create_char_parser('+')
-                                                                                                    , ParseCombinator.create_char_parser('-')
-                                                                                                    , ParseCombinator.create_char_parser('*')
-                                                                                                    , ParseCombinator.create_char_parser('/')])
+                                                       , ParseCombinator.create_char_class_parser("+-*/")
                                                     , whitespace])
     rel_operator = ParseCombinator.create_sequence_parser([whitespace
                                                               , ParseCombinator.create_alternative_parser([ParseCombinator.create_string_parser("==")
@@ -123,14 +153,12 @@ class ApplyParser:
                                                                                                                 , ParseCombinator.create_char_parser('>')])
                                                               , whitespace])
 
-    
-    label = ParseCombinator.create_sequence_parser([ParseCombinator.create_repeat_parser(ParseCombinator.create_alternative_parser([ParseCombinator.create_char_parser(c) for c in ascii_letters]), min_count=1)
-                                                    , ParseCombinator.create_repeat_parser(ParseCombinator.create_alternative_parser([*[ParseCombinator.create_char_parser(c) for c in ascii_letters]
-                                                                                                                                      , uint
-                                                                                                                                      , ParseCombinator.create_char_parser('_')]), min_count=0)])
+
+    label = ParseCombinator.create_sequence_parser([ParseCombinator.create_span_parser(ascii_letters, min_count=1)
+                                                    , ParseCombinator.create_span_parser(ascii_letters + digits + "_")])
     sint = ParseCombinator.create_sequence_parser([ParseCombinator.create_optional_parser(ParseCombinator.create_char_parser('-'))
                                                    , uint])
-    
+
     ignore_case_if = ParseCombinator.create_alternative_parser([ParseCombinator.create_string_parser("IF"), ParseCombinator.create_string_parser("if")])
     ignore_case_goto = ParseCombinator.create_alternative_parser([ParseCombinator.create_string_parser("GOTO"), ParseCombinator.create_string_parser("goto")])
     ignore_case_read = ParseCombinator.create_alternative_parser([ParseCombinator.create_string_parser("READ"), ParseCombinator.create_string_parser("read")])
@@ -143,4 +171,3 @@ class ApplyParser:
     write = ParseCombinator.create_sequence_parser([whitespace, ignore_case_write, whitespace])
     halt = ParseCombinator.create_sequence_parser([whitespace, ignore_case_halt, whitespace])
     colon = ParseCombinator.create_sequence_parser([whitespace, ParseCombinator.create_char_parser(':')])
-    
\ No newline at end of file
@@ -0,0 +1,154 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import BinaryIO, Optional, Sequence
+
+from .encoded_program import EncodedProgram
+from .parse_program import ProgramParser
+
+# file layout, little endian, every section starts 8 byte aligned:
+#   header
+#   instruction table: opcode, A, B, C and jump target columns, instruction count int64 values each
+#   source line map: source line of every instruction, int64
+#   label table: label names separated by newlines, utf-8
+#   wide instructions: the instructions with an operand past int64 as source lines, utf-8
+RAMC_MAGIC = b"RAMCPROG"
+RAMC_VERSION = 1
+HEADER = struct.Struct("<8sH6x32sQQQQ") # magic, version, sha256 of the source, instructions, labels, label bytes, wide bytes
+COLUMNS = 5
+
+class PrecompiledError(Exception):
+    pass
+
+def source_hash(source: bytes) -> bytes:
+    return hashlib.sha256(source).digest()
+
+def _padded(size: int) -> int:
+    return -(-size // 8) * 8
+
+def _little_endian(column: Sequence[int]) -> bytes:
+    values = array('q', column)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+def write_precompiled(program: EncodedProgram, source_lines: Sequence[int], source_sha256: bytes, file: BinaryIO):
+    if len(source_lines) != len(program):
+        raise ValueError(f"{len(source_lines)} source lines for {len(program)} instructions")
+    labels = "\n".join(program.label_names).encode()
+    wide = "\n".join(str(instruction) for instruction in program.wide).encode()
+    file.write(HEADER.pack(RAMC_MAGIC, RAMC_VERSION, source_sha256, len(program), len(program.label_names), len(labels), len(wide)))
+    for column in (program.opcodes, program.a, program.b, program.c, program.targets, source_lines):
+        file.write(_little_endian(column))
+    file.write(labels.ljust(_padded(len(labels)), b"\0"))
+    file.write(wide)
+
+def save_precompiled(program: EncodedProgram, source_lines: Sequence[int], source_sha256: bytes, path: str):
+    # written next to path and renamed over it, a reader (or a mapping of the old file) never sees a partial one
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            write_precompiled(program, source_lines, source_sha256, f)
+        # mkstemp creates it private, it gets the permissions open() would have given it
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0o666 & ~umask)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+def is_precompiled(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(RAMC_MAGIC)) == RAMC_MAGIC
+
+class PrecompiledProgram:
+    # memory maps a .ramc file, the columns are used in place, only label names (and wide instructions) are decoded
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise PrecompiledError(f"{path} is not a precompiled program")
+        if len(self.map) < HEADER.size:
+            raise PrecompiledError(f"{path} is not a precompiled program")
+        magic, version, self.source_sha256, count, label_count, label_bytes, wide_bytes = HEADER.unpack_from(self.map, 0)
+        if magic != RAMC_MAGIC or version != RAMC_VERSION:
+            raise PrecompiledError(f"{path} is not a version {RAMC_VERSION} precompiled program")
+        labels_start = HEADER.size + (COLUMNS + 1) * count * 8
+        wide_start = labels_start + _padded(label_bytes)
+        if len(self.map) != wide_start + wide_bytes:
+            raise PrecompiledError(f"{path} is truncated")
+
+        view = memoryview(self.map)
+        columns = [self._column(view, HEADER.size + index * count * 8, count) for index in range(COLUMNS + 1)]
+        label_names = self.map[labels_start:labels_start + label_bytes].decode().split("\n") if label_count else []
+        if len(label_names) != label_count:
+            raise PrecompiledError(f"{path} has a broken label table")
+        wide = []
+        if wide_bytes:
+            wide = [ProgramParser.parse_instruction(line) for line in self.map[wide_start:wide_start + wide_bytes].decode().split("\n")]
+
+        self.program = EncodedProgram.from_columns(*columns[:COLUMNS], label_names, wide)
+        self.source_lines: Sequence[int] = columns[COLUMNS]
+
+    @staticmethod
+    def _column(view: memoryview, start: int, count: int) -> Sequence[int]:
+        column = view[start:start + count * 8].cast('q')
+        if sys.byteorder != "little":
+            column = array('q', column)
+            column.byteswap()
+        return column
+
+class ProgramCache:
+    # precompiled programs keyed by the sha256 of their source, so an unchanged file is never parsed twice
+    # writes go through save_precompiled, concurrent runs of the same program never see a partial file
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory if directory is not None else self.default_directory()
+
+    @staticmethod
+    def default_directory() -> str:
+        if "RAMPY_CACHE_DIR" in os.environ:
+            return os.environ["RAMPY_CACHE_DIR"]
+        return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "rampy")
+
+    def path(self, source_sha256: bytes) -> str:
+        return os.path.join(self.directory, source_sha256.hex() + ".ramc")
+
+    def get(self, source_sha256: bytes) -> Optional[PrecompiledProgram]:
+        try:
+            precompiled = PrecompiledProgram(self.path(source_sha256))
+        except (OSError, PrecompiledError):
+            return None
+        return precompiled if precompiled.source_sha256 == source_sha256 else None
+
+    def put(self, program: EncodedProgram, source_lines: Sequence[int], source_sha256: bytes):
+        # a cache that cannot be written (read only home, full disk) only costs the next run a parse
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            save_precompiled(program, source_lines, source_sha256, self.path(source_sha256))
+        except OSError:
+            pass
+
+def load_program(path: str, cache: Optional[ProgramCache] = None) -> tuple[EncodedProgram, Sequence[int]]:
+    # program and the source line of every instruction, from a .ramc file, the cache or by parsing the source
+    if is_precompiled(path):
+        precompiled = PrecompiledProgram(path)
+        return precompiled.program, precompiled.source_lines
+
+    with open(path, 'rb') as f:
+        source = f.read()
+    sha256 = source_hash(source) if cache is not None else b""
+    if cache is not None and (precompiled := cache.get(sha256)) is not None:
+        return precompiled.program, precompiled.source_lines
+
+    text = source.decode()
+    program = ProgramParser.parse_encoded(text)
+    source_lines = ProgramParser.source_lines(text)
+    if cache is not None:
+        cache.put(program, source_lines, sha256)
+    return program, source_lines
@@ -0,0 +1,151 @@
+import time
+from typing import Optional
+
+from .instruction import *
+from .interpreter import Interpreter
+from . import control_flow
+
+class Loop:
+    def __init__(self, first: int, last: int, iterations: int, executed: int, time_ns: int):
+        self.first = first # instruction pointer of the jump target
+        self.last = last # instruction pointer of the backward jump
+        self.iterations = iterations
+        self.executed = executed
+        self.time_ns = time_ns
+
+class Profiler:
+    # runs the interpreter's decoded handlers in its own instrumented loop, Interpreter.run stays untouched
+    def __init__(self, interpreter: Interpreter, source_lines: Optional[list[int]] = None):
+        self.interpreter = interpreter
+        self.program: Program = interpreter.program
+        # source line of every instruction (ProgramParser.source_lines), instruction pointers are used without it
+        self.source_lines: list[int] = source_lines if source_lines is not None else list(range(1, len(self.program) + 1))
+
+        self.leaders: list[int] = control_flow.block_leaders(self.program, interpreter.labels)
+        self.jump_targets: list[Optional[int]] = [control_flow.jump_target(instruction, interpreter.labels) if isinstance(instruction, control_flow.JUMPS) else None
+                                                  for instruction in self.program]
+
+        self.counts: list[int] = [0] * len(self.program)
+        self.taken: list[int] = [0] * len(self.program)
+        self.not_taken: list[int] = [0] * len(self.program)
+        self.block_time_ns: list[int] = [0] * len(self.leaders)
+        self.block_entries: list[int] = [0] * len(self.leaders)
+        self.total_time_ns: int = 0
+
+    def run(self, input_fn = input, output_fn = print):
+        interpreter = self.interpreter
+        handlers = interpreter.handlers
+        program_length = len(handlers)
+        counts, taken, not_taken = self.counts, self.taken, self.not_taken
+        block_time_ns, block_entries = self.block_time_ns, self.block_entries
+
+        conditional = [isinstance(instruction, control_flow.CONDITIONAL_JUMPS) for instruction in self.program]
+        # block index for every instruction pointer that starts a block, -1 elsewhere (index 0 and past the end unused)
+        block_at = [-1] * (program_length + 2)
+        for block, leader in enumerate(self.leaders):
+            block_at[leader] = block
+
+        perf_counter_ns = time.perf_counter_ns
+        instruction_pointer = interpreter.instruction_pointer
+        current_block = self._block_of(instruction_pointer) if 1 <= instruction_pointer <= program_length else -1
+        if current_block != -1:
+            block_entries[current_block] += 1
+
+        counted_before = sum(counts)
+        run_start = block_start = perf_counter_ns()
+        try:
+            while instruction_pointer <= program_length:
+                index = instruction_pointer - 1
+                counts[index] += 1
+                next_ip = handlers[index](input_fn, output_fn)
+                if next_ip is None:
+                    break
+
+                if conditional[index]:
+                    if next_ip == self.jump_targets[index]:
+                        taken[index] += 1
+                    else:
+                        not_taken[index] += 1
+
+                if 0 < next_ip <= program_length and block_at[next_ip] != -1:
+                    now = perf_counter_ns()
+                    block_time_ns[current_block] += now - block_start
+                    block_start = now
+                    current_block = block_at[next_ip]
+                    block_entries[current_block] += 1
+                instruction_pointer = next_ip
+        finally:
+            now = perf_counter_ns()
+            if current_block != -1:
+                block_time_ns[current_block] += now - block_start
+            self.total_time_ns += now - run_start
+            interpreter.instruction_pointer = instruction_pointer
+            interpreter.executed_instructions += sum(counts) - counted_before
+
+    def _block_of(self, instruction_pointer: int) -> int:
+        return max(block for block, leader in enumerate(self.leaders) if leader <= instruction_pointer)
+
+    def loops(self) -> list[Loop]:
+        # every backward jump that was taken closes a loop over target..jump, hottest first
+        loops = []
+        for index, target in enumerate(self.jump_targets):
+            instruction_pointer = index + 1
+            if target is None or not (1 <= target <= instruction_pointer):
+                continue
+            iterations = self.taken[index] if isinstance(self.program[index], control_flow.CONDITIONAL_JUMPS) else self.counts[index]
+            if iterations == 0:
+                continue
+            executed = sum(self.counts[target - 1:instruction_pointer])
+            blocks = range(self._block_of(target), self._block_of(instruction_pointer) + 1)
+            loops.append(Loop(target, instruction_pointer, iterations, executed, sum(self.block_time_ns[block] for block in blocks)))
+        return sorted(loops, key=lambda loop: loop.executed, reverse=True)
+
+    def _describe(self, instruction_pointer: int) -> str:
+        return f"line {self.source_lines[instruction_pointer - 1]}: {self.program[instruction_pointer - 1]}"
+
+    def report(self, top: int = 10) -> str:
+        total = sum(self.counts)
+        report = "Profile\n"
+        report += f"  instructions executed: {total}\n"
+        report += f"  time: {self.total_time_ns / 1e6:.3f} ms\n"
+
+        report += "\nHottest instructions:\n"
+        hottest = sorted(range(len(self.counts)), key=lambda index: self.counts[index], reverse=True)[:top]
+        for index in hottest:
+            if self.counts[index] == 0:
+                break
+            report += f"  {self.counts[index]:>12} {100 * self.counts[index] / total:6.2f}%  {self._describe(index + 1)}\n"
+
+        report += "\nConditional jumps (taken / not taken):\n"
+        for index, instruction in enumerate(self.program):
+            if isinstance(instruction, control_flow.CONDITIONAL_JUMPS) and self.counts[index]:
+                report += f"  {self.taken[index]:>12} / {self.not_taken[index]:<12} {self._describe(index + 1)}\n"
+
+        report += "\nHottest loops:\n"
+        for loop in self.loops()[:top]:
+            report += f"  lines {self.source_lines[loop.first - 1]}-{self.source_lines[loop.last - 1]}: {loop.iterations} iterations, {loop.executed} instructions, {loop.time_ns / 1e6:.3f} ms\n"
+
+        report += "\nSlowest blocks:\n"
+        slowest = sorted(range(len(self.leaders)), key=lambda block: self.block_time_ns[block], reverse=True)[:top]
+        for block in slowest:
+            if self.block_entries[block] == 0:
+                break
+            report += f"  {self.block_time_ns[block] / 1e6:10.3f} ms {self.block_entries[block]:>12} entries  {self._describe(self.leaders[block])}\n"
+        return report
+
+    def to_json(self) -> dict:
+        return {
+            "instructions_executed": sum(self.counts),
+            "time_ns": self.total_time_ns,
+            "instructions": [{ "instruction_pointer": index + 1
+                              , "line": self.source_lines[index]
+                              , "instruction": str(instruction)
+                              , "count": self.counts[index]
+                              , **({ "taken": self.taken[index], "not_taken": self.not_taken[index] } if isinstance(instruction, control_flow.CONDITIONAL_JUMPS) else {}) }
+                             for index, instruction in enumerate(self.program)],
+            "blocks": [{ "first_line": self.source_lines[leader - 1], "entries": self.block_entries[block], "time_ns": self.block_time_ns[block] }
+                       for block, leader in enumerate(self.leaders)],
+            "loops": [{ "first_line": self.source_lines[loop.first - 1], "last_line": self.source_lines[loop.last - 1]
+                       , "iterations": loop.iterations, "instructions": loop.executed, "time_ns": loop.time_ns }
+                      for loop in self.loops()],
+        }
@@ -0,0 +1,148 @@
+from typing import Optional
+
+from .instruction import *
+from .interpreter import Interpreter
+from .registers import RegisterFile, wrap_int64, div_int64
+from . import control_flow
+
+class PythonTranslator:
+    FUNCTION_NAME = "ram_program"
+
+    def __init__(self, program: Program, labels: dict[str, int], use_locals: bool, word_size: Optional[int] = None):
+        self.program = program
+        self.labels = labels
+        self.use_locals = use_locals
+        self.word_size = word_size
+
+        self.leaders: list[int] = control_flow.block_leaders(program, labels)
+        self.block_of: dict[int, int] = { leader: block for block, leader in enumerate(self.leaders) }
+        self.registers: list[int] = sorted({ register for instruction in program for register in control_flow.static_registers(instruction) })
+
+    def _register(self, register: int) -> str:
+        return f"r{register}" if self.use_locals else f"regs[{register}]"
+
+    def _goto(self, instruction_pointer: int) -> list[str]:
+        # leaving the program (or landing outside of it) ends the run like the interpreter does
+        if instruction_pointer not in self.block_of:
+            return [f"return {instruction_pointer}"]
+        return [f"block = {self.block_of[instruction_pointer]}", "continue"]
+
+    def _jump(self, instruction: Instruction) -> list[str]:
+        target = control_flow.jump_target(instruction, self.labels)
+        if target is None:
+            return [f"raise KeyError({instruction.label!r})"]
+        return self._goto(target)
+
+    def _condition(self, condition: Union[ConditionWithRegister, ConditionWithConst]) -> str:
+        if isinstance(condition, ConditionWithConst):
+            return f"{self._register(condition.register)} {condition.rel} {condition.value}"
+        elif isinstance(condition, ConditionWithRegister):
+            return f"{self._register(condition.first_register)} {condition.rel} {self._register(condition.second_register)}"
+        else:
+            raise ValueError(f"Invalid condition: {condition}")
+
+    def _operation(self, op: Op, a: str, b: str) -> str:
+        if self.word_size is not None:
+            return f"div({a}, {b})" if op == Op.DIV else f"wrap({a} {op} {b})"
+        return f"{a} // {b}" if op == Op.DIV else f"{a} {op} {b}"
+
+    def _translate_instruction(self, instruction_pointer: int, instruction: Instruction) -> list[str]:
+        reg = self._register
+        if isinstance(instruction, Label):
+            return []
+        elif isinstance(instruction, SetValue):
+            value = instruction.value if self.word_size is None else wrap_int64(instruction.value)
+            return [f"{reg(instruction.target_register)} = {value}"]
+        elif isinstance(instruction, SetRegister):
+            return [f"{reg(instruction.target_register)} = {reg(instruction.source_register)}"]
+        elif isinstance(instruction, SetRegisterRegOpConst):
+            return [f"{reg(instruction.target_register)} = {self._operation(instruction.op, reg(instruction.source_register), str(instruction.value))}"]
+        elif isinstance(instruction, SetRegisterRegOpReg):
+            return [f"{reg(instruction.target_register)} = {self._operation(instruction.op, reg(instruction.first_source_register), reg(instruction.second_source_register))}"]
+        elif isinstance(instruction, Load):
+            return [f"{reg(instruction.target_register)} = get({reg(instruction.source_register)})"]
+        elif isinstance(instruction, Store):
+            return [f"set_({reg(instruction.target_register)}, {reg(instruction.source_register)})"]
+        elif isinstance(instruction, Read):
+            if self.word_size is not None:
+                return [f"{reg(instruction.target_register)} = wrap(int(input_fn()))"]
+            return [f"{reg(instruction.target_register)} = int(input_fn())"]
+        elif isinstance(instruction, Write):
+            return [f"output_fn({reg(instruction.source_register)})"]
+        elif isinstance(instruction, Halt):
+            return [f"return {instruction_pointer}"]
+        elif isinstance(instruction, control_flow.UNCONDITIONAL_JUMPS):
+            return self._jump(instruction)
+        elif isinstance(instruction, control_flow.CONDITIONAL_JUMPS):
+            return [f"if {self._condition(instruction.condition)}:", *["    " + line for line in self._jump(instruction)]]
+        else:
+            raise ValueError(f"Invalid instruction: {instruction}")
+
+    def _translate_block(self, block: int) -> list[str]:
+        start = self.leaders[block]
+        end = self.leaders[block + 1] if block + 1 < len(self.leaders) else len(self.program) + 1
+
+        lines = [f"# instructions {start}..{end - 1}"]
+        for instruction_pointer in range(start, end):
+            lines += self._translate_instruction(instruction_pointer, self.program[instruction_pointer - 1])
+
+        last = self.program[end - 2]
+        if not (isinstance(last, (Halt, *control_flow.UNCONDITIONAL_JUMPS))):
+            lines += self._goto(end)
+        return lines
+
+    def _dispatch(self, first: int, last: int) -> list[str]:
+        # binary search over block indices, so a jump costs O(log blocks) comparisons
+        if first == last:
+            return self._translate_block(first)
+        middle = (first + last + 1) // 2
+        return [f"if block < {middle}:"
+                , *["    " + line for line in self._dispatch(first, middle - 1)]
+                , "else:"
+                , *["    " + line for line in self._dispatch(middle, last)]]
+
+    def translate(self) -> str:
+        lines = [f"def {self.FUNCTION_NAME}(input_fn, output_fn, regs, get, set_, block):"]
+        body = []
+        if self.use_locals:
+            body += [f"r{register} = regs[{register}]" for register in self.registers]
+        body += ["while True:"]
+        if self.leaders:
+            body += ["    " + line for line in self._dispatch(0, len(self.leaders) - 1)]
+        else:
+            body += ["    return 1"]
+
+        if self.use_locals and self.registers:
+            # registers are written back even when the program raises
+            lines += ["    try:"
+                      , *["        " + line for line in body]
+                      , "    finally:"
+                      , *[f"        regs[{register}] = r{register}" for register in self.registers]]
+        else:
+            lines += ["    " + line for line in body]
+        return "\n".join(lines) + "\n"
+
+class PyJitInterpreter(Interpreter):
+    def __init__(self, program: Program, registers: Optional[RegisterFile] = None, word_size: Optional[int] = None):
+        super().__init__(program, registers, word_size)
+        # indirect access can reach any register, so those programs keep everything in the register list
+        use_locals = not any(isinstance(instruction, (Load, Store)) for instruction in program)
+        self.translator = PythonTranslator(program, self.labels, use_locals, word_size)
+        self.source: str = self.translator.translate()
+
+        namespace = { "wrap": wrap_int64, "div": div_int64 }
+        exec(compile(self.source, "<rampy-pyjit>", "exec"), namespace)
+        self.compiled = namespace[PythonTranslator.FUNCTION_NAME]
+
+    def run(self, input_fn = input, output_fn = print):
+        # the generated code can only be entered at the start of a block
+        while self.instruction_pointer not in self.translator.block_of:
+            if self.step(input_fn=input_fn, output_fn=output_fn):
+                return
+
+        self.instruction_pointer = self.compiled(input_fn
+                                                 , output_fn
+                                                 , self._indexable(self.largest_register)
+                                                 , self.registers.get
+                                                 , self.registers.set
+                                                 , self.translator.block_of[self.instruction_pointer])
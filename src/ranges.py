@@ -0,0 +1,274 @@
+from typing import Optional
+
+from .instruction import *
+from .registers import INT64_MIN
+from . import control_flow
+
+INT64_MAX = -INT64_MIN - 1
+
+# inclusive bounds of the values a register may hold, None is unbounded on that side
+Interval = tuple[Optional[int], Optional[int]]
+UNBOUNDED: Interval = (None, None)
+
+def join(a: Interval, b: Interval) -> Interval:
+    low = None if a[0] is None or b[0] is None else min(a[0], b[0])
+    high = None if a[1] is None or b[1] is None else max(a[1], b[1])
+    return low, high
+
+def intersect(a: Interval, b: Interval) -> Optional[Interval]:
+    # None when the intervals do not overlap
+    low = b[0] if a[0] is None else a[0] if b[0] is None else max(a[0], b[0])
+    high = b[1] if a[1] is None else a[1] if b[1] is None else min(a[1], b[1])
+    if low is not None and high is not None and low > high:
+        return None
+    return low, high
+
+def contains(interval: Interval, value: int) -> bool:
+    return (interval[0] is None or interval[0] <= value) and (interval[1] is None or value <= interval[1])
+
+def _bounded(interval: Interval) -> Interval:
+    # a bound past the int64 range may have wrapped around in compiled code, nothing is known then
+    low, high = interval
+    if low is not None and not INT64_MIN <= low <= INT64_MAX or high is not None and not INT64_MIN <= high <= INT64_MAX:
+        return UNBOUNDED
+    return interval
+
+class RangeState:
+    # intervals of the registers before an instruction, registers missing from values are in rest
+    def __init__(self, values: dict[int, Interval], rest: Interval):
+        self.values = values
+        self.rest = rest
+
+    def get(self, register: int) -> Interval:
+        return self.values.get(register, self.rest)
+
+    def copy(self) -> "RangeState":
+        return RangeState(dict(self.values), self.rest)
+
+    def join(self, other: "RangeState") -> "RangeState":
+        values = { register: join(self.get(register), other.get(register)) for register in self.values.keys() | other.values.keys() }
+        return RangeState(values, join(self.rest, other.rest))
+
+    def widen(self, newer: "RangeState") -> "RangeState":
+        # bounds still moving after a few visits go to infinity, so loops reach a fixpoint
+        def widened(old: Interval, new: Interval) -> Interval:
+            return (old[0] if new[0] is not None and old[0] is not None and new[0] >= old[0] else None,
+                    old[1] if new[1] is not None and old[1] is not None and new[1] <= old[1] else None)
+        values = { register: widened(self.get(register), newer.get(register)) for register in self.values.keys() | newer.values.keys() }
+        return RangeState(values, widened(self.rest, newer.rest))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RangeState) and self.rest == other.rest \
+               and all(self.get(register) == other.get(register) for register in self.values.keys() | other.values.keys())
+
+class RangeAnalysis:
+    # interval analysis from the all-zero start, used to find which registers Load/Store can reach
+    # adding a small step to a value bounded on one side is assumed not to overflow (that takes 2^31 such steps at least),
+    # anything else leaving int64 is unbounded
+    SMALL_STEP = 1 << 32
+    WIDEN_AFTER = 3 # visits of a loop head before its state is widened
+    NARROWING_ROUNDS = 2
+
+    def __init__(self, program: Program):
+        # instructions are looked at over and over, an encoded program is unpacked once for the analysis
+        self.program = list(program)
+        self.labels = { instruction.label: index + 1 for index, instruction in enumerate(program) if isinstance(instruction, Label) }
+        self._states: Optional[list[Optional[RangeState]]] = None
+        # every directly named register is tracked on its own, so a Store to an unknown address does not blur them together
+        named = { register for instruction in program for register in control_flow.static_registers(instruction) }
+        self.start = RangeState({ register: (0, 0) for register in named }, (0, 0))
+
+    @classmethod
+    def _small(cls, interval: Interval) -> bool:
+        return None not in interval and -cls.SMALL_STEP <= interval[0] and interval[1] <= cls.SMALL_STEP
+
+    @classmethod
+    def _apply(cls, op: Op, a: Interval, b: Interval) -> Interval:
+        if op == Op.ADD or op == Op.SUB:
+            if op == Op.SUB:
+                b = (None if b[1] is None else -b[1], None if b[0] is None else -b[0])
+            low = None if a[0] is None or b[0] is None else a[0] + b[0]
+            high = None if a[1] is None or b[1] is None else a[1] + b[1]
+            if (low is None or high is None) and not cls._small(a) and not cls._small(b):
+                return UNBOUNDED
+            return _bounded((low, high))
+        if None in a or None in b:
+            return UNBOUNDED
+        if op == Op.MUL:
+            products = [x * y for x in a for y in b]
+            return _bounded((min(products), max(products)))
+        if op == Op.DIV:
+            if contains(b, 0):
+                return UNBOUNDED
+            # quotients are monotonic between the corners, truncating and flooring backends both stay within floor..ceil
+            low = min(x // y for x in a for y in b)
+            high = max(-(-x // y) for x in a for y in b)
+            return _bounded((low, high))
+        return UNBOUNDED
+
+    def _transfer(self, instruction: Instruction, state: RangeState) -> RangeState:
+        state = state.copy()
+        if isinstance(instruction, SetValue):
+            state.values[instruction.target_register] = _bounded((instruction.value, instruction.value))
+        elif isinstance(instruction, SetRegister):
+            state.values[instruction.target_register] = state.get(instruction.source_register)
+        elif isinstance(instruction, SetRegisterRegOpConst):
+            value = (instruction.value, instruction.value)
+            state.values[instruction.target_register] = self._apply(instruction.op, state.get(instruction.source_register), value)
+        elif isinstance(instruction, SetRegisterRegOpReg):
+            state.values[instruction.target_register] = self._apply(instruction.op, state.get(instruction.first_source_register)
+                                                                    , state.get(instruction.second_source_register))
+        elif isinstance(instruction, Load):
+            address = state.get(instruction.source_register)
+            value = state.rest
+            for register, interval in state.values.items():
+                if contains(address, register):
+                    value = join(value, interval)
+            state.values[instruction.target_register] = value
+        elif isinstance(instruction, Store):
+            address = state.get(instruction.target_register)
+            value = state.get(instruction.source_register)
+            if address[0] is not None and address[0] == address[1]:
+                state.values[address[0]] = value
+            else:
+                for register in state.values:
+                    if contains(address, register):
+                        state.values[register] = join(state.values[register], value)
+                state.rest = join(state.rest, value)
+        elif isinstance(instruction, Read):
+            state.values[instruction.target_register] = UNBOUNDED
+        return state
+
+    @staticmethod
+    def _refine(condition: Union[ConditionWithConst, ConditionWithRegister], holds: bool, state: RangeState) -> Optional[RangeState]:
+        # state on the edge where condition is (not) true, None when that edge is never taken
+        rel = condition.rel
+        if not holds:
+            rel = { Rel.LT: Rel.GE, Rel.GE: Rel.LT, Rel.GT: Rel.LE, Rel.LE: Rel.GT, Rel.EQ: Rel.NE, Rel.NE: Rel.EQ }[rel]
+
+        def limit(register: int, rel: Rel, other: Interval) -> bool:
+            # narrows register to the values that can satisfy `register rel other`
+            low, high = other
+            if rel == Rel.LT:
+                bound = (None, None if high is None else high - 1)
+            elif rel == Rel.LE:
+                bound = (None, high)
+            elif rel == Rel.GT:
+                bound = (None if low is None else low + 1, None)
+            elif rel == Rel.GE:
+                bound = (low, None)
+            elif rel == Rel.EQ:
+                bound = other
+            else:
+                current = state.get(register)
+                # only a single excluded value on the edge of the interval narrows anything
+                if low is None or low != high or current[0] is None and current[1] is None:
+                    return True
+                bound = (current[0] + 1 if current[0] == low else current[0], current[1] - 1 if current[1] == low else current[1])
+            narrowed = intersect(state.get(register), bound)
+            if narrowed is None:
+                return False
+            state.values[register] = narrowed
+            return True
+
+        state = state.copy()
+        if isinstance(condition, ConditionWithConst):
+            feasible = limit(condition.register, rel, (condition.value, condition.value))
+        else:
+            mirrored = { Rel.LT: Rel.GT, Rel.GT: Rel.LT, Rel.LE: Rel.GE, Rel.GE: Rel.LE, Rel.EQ: Rel.EQ, Rel.NE: Rel.NE }[rel]
+            first, second = condition.first_register, condition.second_register
+            feasible = limit(first, rel, state.get(second)) and limit(second, mirrored, state.get(first))
+        return state if feasible else None
+
+    def _edges(self, instruction_pointer: int, state: RangeState) -> list[tuple[int, RangeState]]:
+        # (successor, state entering it), past the end means the program finishes
+        instruction = self.program[instruction_pointer - 1]
+        if isinstance(instruction, Halt):
+            return []
+        after = self._transfer(instruction, state)
+        edges = []
+        target = control_flow.jump_target(instruction, self.labels) if isinstance(instruction, control_flow.JUMPS) else None
+        if isinstance(instruction, control_flow.CONDITIONAL_JUMPS):
+            taken, fallthrough = self._refine(instruction.condition, True, after), self._refine(instruction.condition, False, after)
+            if fallthrough is not None:
+                edges.append((instruction_pointer + 1, fallthrough))
+            if taken is not None and target is not None:
+                edges.append((target, taken))
+        elif isinstance(instruction, control_flow.UNCONDITIONAL_JUMPS):
+            if target is not None:
+                edges.append((target, after))
+        else:
+            edges.append((instruction_pointer + 1, after))
+        return [(successor, state) for successor, state in edges if 1 <= successor <= len(self.program)]
+
+    def states(self) -> list[Optional[RangeState]]:
+        # state before every instruction, None for instructions never reached
+        if self._states is not None:
+            return self._states
+        states: list[Optional[RangeState]] = [None] * len(self.program)
+        if not self.program:
+            self._states = states
+            return states
+        visits = [0] * len(self.program)
+        # widening only at loop heads, everywhere else joins stay precise
+        loop_heads = set()
+        for index, instruction in enumerate(self.program):
+            if isinstance(instruction, control_flow.JUMPS):
+                target = control_flow.jump_target(instruction, self.labels)
+                if target is not None and target <= index + 1:
+                    loop_heads.add(target)
+        states[0] = self.start
+        worklist = [1]
+        while worklist:
+            instruction_pointer = worklist.pop()
+            for successor, state in self._edges(instruction_pointer, states[instruction_pointer - 1]):
+                old = states[successor - 1]
+                new = state if old is None else old.join(state)
+                if old is not None and new == old:
+                    continue
+                visits[successor - 1] += 1
+                if old is not None and successor in loop_heads and visits[successor - 1] > self.WIDEN_AFTER:
+                    new = old.widen(new)
+                states[successor - 1] = new
+                worklist.append(successor)
+
+        # a few decreasing rounds in program order win back the bounds loop conditions give
+        predecessors: list[set[int]] = [set() for _ in self.program]
+        for index, state in enumerate(states):
+            if state is not None:
+                for successor, _ in self._edges(index + 1, state):
+                    predecessors[successor - 1].add(index + 1)
+        for _ in range(self.NARROWING_ROUNDS):
+            for index in range(len(self.program)):
+                if states[index] is None:
+                    continue
+                narrowed = self.start if index == 0 else None
+                for predecessor in predecessors[index]:
+                    if states[predecessor - 1] is None:
+                        continue
+                    for successor, edge_state in self._edges(predecessor, states[predecessor - 1]):
+                        if successor == index + 1:
+                            narrowed = edge_state if narrowed is None else narrowed.join(edge_state)
+                states[index] = narrowed
+        self._states = states
+        return states
+
+    def indirect_addresses(self) -> Optional[Interval]:
+        # every address a reachable Load/Store may use, None when there is no such access
+        addresses = None
+        # jumps below the first instruction wrap around in the interpreter, the analysis does not follow them
+        wraps = any(isinstance(instruction, control_flow.JUMPS) and (control_flow.jump_target(instruction, self.labels) or 1) < 1
+                    for instruction in self.program)
+        for instruction, state in zip(self.program, self.states()):
+            if state is None:
+                continue
+            if isinstance(instruction, Load):
+                address = state.get(instruction.source_register)
+            elif isinstance(instruction, Store):
+                address = state.get(instruction.target_register)
+            else:
+                continue
+            addresses = address if addresses is None else join(addresses, address)
+        if wraps and any(isinstance(instruction, (Load, Store)) for instruction in self.program):
+            return UNBOUNDED
+        return addresses
@@ -0,0 +1,102 @@
+from array import array
+from typing import Iterator, MutableSequence
+
+class RegisterFile:
+    # low registers live in a flat list the decoded handlers index directly,
+    # everything above is kept in pages which are only allocated on a nonzero write
+    DEFAULT_DENSE_SIZE = 1024
+    PAGE_SIZE = 1024
+    MAX_DENSE_SIZE = 1 << 20 # reserve stops here, a program naming a higher register does not get it allocated up front
+
+    def __init__(self, dense_size: int = DEFAULT_DENSE_SIZE):
+        self.dense: MutableSequence[int] = self._new_storage(-(-dense_size // self.PAGE_SIZE) * self.PAGE_SIZE)
+        self.pages: dict[int, MutableSequence[int]] = {}
+
+    def _new_storage(self, size: int) -> MutableSequence[int]:
+        return [0] * size
+
+    def reserve(self, size: int):
+        # grows the dense region in place (whole pages, at most MAX_DENSE_SIZE), handlers keep referencing the same list
+        size = -(-min(size, self.MAX_DENSE_SIZE) // self.PAGE_SIZE) * self.PAGE_SIZE
+        if size <= len(self.dense):
+            return
+        self.dense.extend(self._new_storage(size - len(self.dense)))
+
+        for page_index in [index for index in self.pages if 0 <= index < size // self.PAGE_SIZE]:
+            page_start = page_index * self.PAGE_SIZE
+            self.dense[page_start:page_start + self.PAGE_SIZE] = self.pages.pop(page_index)
+
+    def get(self, register: int) -> int:
+        if 0 <= register < len(self.dense):
+            return self.dense[register]
+
+        page = self.pages.get(register // self.PAGE_SIZE)
+        if page is None:
+            return 0
+        return page[register % self.PAGE_SIZE]
+
+    def set(self, register: int, value: int):
+        if 0 <= register < len(self.dense):
+            self.dense[register] = value
+            return
+
+        page_index = register // self.PAGE_SIZE
+        page = self.pages.get(page_index)
+        if page is None:
+            if value == 0:
+                return
+            page = self.pages[page_index] = self._new_storage(self.PAGE_SIZE)
+        page[register % self.PAGE_SIZE] = value
+
+    __getitem__ = get
+    __setitem__ = set
+
+    def clear(self):
+        # in place, the decoded handlers keep a reference to the dense list
+        self.dense[:] = self._new_storage(len(self.dense))
+        self.pages.clear()
+
+    def snapshot(self) -> tuple[MutableSequence[int], dict[int, MutableSequence[int]]]:
+        return self.dense[:], { index: page[:] for index, page in self.pages.items() }
+
+    def restore(self, snapshot: tuple[MutableSequence[int], dict[int, MutableSequence[int]]]):
+        # in place, like clear, the dense region keeps its size even if it grew (reserve) since the snapshot
+        dense, pages = snapshot
+        self.dense[:len(dense)] = dense
+        self.dense[len(dense):] = self._new_storage(len(self.dense) - len(dense))
+        self.pages.clear()
+        for page_index, page in pages.items():
+            page_start = page_index * self.PAGE_SIZE
+            if 0 <= page_start < len(self.dense):
+                self.dense[page_start:page_start + self.PAGE_SIZE] = page
+            else:
+                self.pages[page_index] = page[:]
+
+    def populated(self, start: int = 0) -> Iterator[tuple[int, int]]:
+        # (register, value) pairs from start on, of the dense region followed by every allocated page
+        for register in range(max(start, 0), len(self.dense)):
+            yield register, self.dense[register]
+        for page_index in sorted(self.pages):
+            page_start = page_index * self.PAGE_SIZE
+            if page_start + self.PAGE_SIZE <= start:
+                continue
+            page = self.pages[page_index]
+            for offset in range(max(start - page_start, 0), self.PAGE_SIZE):
+                yield page_start + offset, page[offset]
+
+INT64_MIN = -(1 << 63)
+INT64_MASK = (1 << 64) - 1
+
+def wrap_int64(value: int) -> int:
+    # two's complement wrap around, like int64_t arithmetic in the compiled backends
+    return ((value - INT64_MIN) & INT64_MASK) + INT64_MIN
+
+def div_int64(a: int, b: int) -> int:
+    # C division truncates towards zero, python's // floors
+    quotient = abs(a) // abs(b)
+    return wrap_int64(quotient if (a < 0) == (b < 0) else -quotient)
+
+class Int64RegisterFile(RegisterFile):
+    # registers stored as machine words in array('q'), values have to be wrapped before they are set
+    def _new_storage(self, size: int) -> array:
+        return array('q', bytes(8 * size))
@@ -0,0 +1,186 @@
+import bisect
+import mmap
+import struct
+from enum import Enum
+from typing import BinaryIO, Iterator, Optional
+
+from .instruction import *
+from .interpreter import Interpreter
+from . import control_flow
+
+# file layout: header, then fixed size records (kind: u8, a: i64, b: i64), little endian
+#   STEP           a = instruction pointer about to execute
+#   REGISTER_WRITE a = register, b = value after the step
+#   INPUT          b = value read
+#   OUTPUT         b = value written
+TRACE_MAGIC = b"RAMTRACE"
+TRACE_VERSION = 1
+HEADER = struct.Struct("<8sHxxxxxx")
+RECORD = struct.Struct("<Bqq")
+
+class RecordKind(Enum):
+    STEP = 0
+    REGISTER_WRITE = 1
+    INPUT = 2
+    OUTPUT = 3
+
+class TraceError(Exception):
+    pass
+
+class TraceWriter:
+    BUFFER_SIZE = 1 << 20
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.buffer = bytearray()
+        self.file.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION))
+
+    def record(self, kind: int, a: int, b: int = 0):
+        try:
+            self.buffer += RECORD.pack(kind, a, b)
+        except struct.error:
+            raise TraceError(f"Value does not fit a 64bit trace record: {b}, use --word-size=64")
+        if len(self.buffer) >= self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer.clear()
+        self.file.flush()
+
+class TraceRecorder:
+    # runs the interpreter's decoded handlers in its own loop, recording every step into a TraceWriter
+    def __init__(self, interpreter: Interpreter, writer: TraceWriter):
+        self.interpreter = interpreter
+        self.writer = writer
+
+    def run(self, input_fn = input, output_fn = print):
+        interpreter = self.interpreter
+        handlers = interpreter.handlers
+        program_length = len(handlers)
+        get_register = interpreter.registers.get
+        record = self.writer.record
+
+        # statically known written register, or the address register of a Store
+        written = [control_flow.written_register(instruction) for instruction in interpreter.program]
+        store_address = [instruction.target_register if isinstance(instruction, Store) else None for instruction in interpreter.program]
+
+        step, register_write = RecordKind.STEP.value, RecordKind.REGISTER_WRITE.value
+        input_kind, output_kind = RecordKind.INPUT.value, RecordKind.OUTPUT.value
+
+        def traced_input():
+            value = input_fn()
+            record(input_kind, 0, int(value))
+            return value
+
+        def traced_output(value):
+            record(output_kind, 0, value)
+            output_fn(value)
+
+        instruction_pointer = interpreter.instruction_pointer
+        executed = 0
+        try:
+            while instruction_pointer <= program_length:
+                index = instruction_pointer - 1
+                record(step, instruction_pointer)
+                target = written[index]
+                if store_address[index] is not None:
+                    target = get_register(store_address[index])
+
+                executed += 1
+                next_ip = handlers[index](traced_input, traced_output)
+                if target is not None:
+                    record(register_write, target, get_register(target))
+                if next_ip is None:
+                    break
+                instruction_pointer = next_ip
+        finally:
+            interpreter.instruction_pointer = instruction_pointer
+            interpreter.executed_instructions += executed
+            self.writer.flush()
+
+class TraceState:
+    def __init__(self, step: int, instruction_pointer: Optional[int], registers: dict[int, int], output: list[int]):
+        self.step = step
+        self.instruction_pointer = instruction_pointer # None past the last recorded step
+        self.registers = registers # only registers written so far, everything else is 0
+        self.output = output
+
+    def __repr__(self):
+        return f"TraceState({self.step}, {self.instruction_pointer}, {self.registers}, {self.output})"
+
+class TraceReader:
+    # memory maps a trace file, nothing is re-executed to answer queries
+    def __init__(self, path: str):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise TraceError(f"{path} is not a trace file")
+        magic, version = HEADER.unpack_from(self.map, 0)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise TraceError(f"{path} is not a version {TRACE_VERSION} trace file")
+        self.records_view = memoryview(self.map)[HEADER.size:HEADER.size + (len(self.map) - HEADER.size) // RECORD.size * RECORD.size]
+        self._step_index: Optional[list[int]] = None
+
+    def close(self):
+        self.records_view.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self) -> "TraceReader":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.records_view) // RECORD.size
+
+    def record(self, index: int) -> tuple[RecordKind, int, int]:
+        kind, a, b = RECORD.unpack_from(self.records_view, index * RECORD.size)
+        return RecordKind(kind), a, b
+
+    def records(self, start: int = 0, stop: Optional[int] = None) -> Iterator[tuple[int, int, int]]:
+        # raw (kind, a, b) tuples, unpacked in C by iter_unpack
+        stop = len(self) if stop is None else stop
+        return RECORD.iter_unpack(self.records_view[start * RECORD.size:stop * RECORD.size])
+
+    @property
+    def step_index(self) -> list[int]:
+        # record index of every STEP record, step k (counted from 0) starts at step_index[k]
+        if self._step_index is None:
+            step = RecordKind.STEP.value
+            self._step_index = [index for index, (kind, _, _) in enumerate(self.records()) if kind == step]
+        return self._step_index
+
+    @property
+    def steps(self) -> int:
+        return len(self.step_index)
+
+    def instruction_pointer_at(self, step: int) -> int:
+        return self.record(self.step_index[step])[1]
+
+    def last_write(self, register: int, before_step: Optional[int] = None) -> Optional[tuple[int, int]]:
+        # (step, value) of the last write to register by a step before before_step (default all steps)
+        stop = len(self) if before_step is None or before_step >= self.steps else self.step_index[before_step]
+        register_write = RecordKind.REGISTER_WRITE.value
+        for index in range(stop - 1, -1, -1):
+            kind, a, b = RECORD.unpack_from(self.records_view, index * RECORD.size)
+            if kind == register_write and a == register:
+                # the write belongs to the closest STEP record before it
+                return bisect.bisect_right(self.step_index, index) - 1, b
+        return None
+
+    def state_at(self, step: int) -> TraceState:
+        # registers and output right before step (counted from 0) executes
+        stop = len(self) if step >= self.steps else self.step_index[step]
+        registers: dict[int, int] = {}
+        output: list[int] = []
+        register_write, output_kind = RecordKind.REGISTER_WRITE.value, RecordKind.OUTPUT.value
+        for kind, a, b in self.records(0, stop):
+            if kind == register_write:
+                registers[a] = b
+            elif kind == output_kind:
+                output.append(b)
+        instruction_pointer = self.instruction_pointer_at(step) if step < self.steps else None
+        return TraceState(step, instruction_pointer, registers, output)